@@ -0,0 +1,126 @@
+"""Helpers to generate a synthetic fleet of containers in a temporary directory.
+
+fake_fleet() lays out the files a host with `size` imperative containers would have:
+a store path, profile and nspawn unit for each, and machined state for those running.
+All of nixos_nspawn's host paths are redirected into that tree. With stubs=True,
+the programs nixos_nspawn runs are replaced on PATH by the stubs in _stubs.py,
+which act on the same tree, so that commands which change containers work too.
+"""
+
+import os
+from collections.abc import Generator
+from contextlib import ExitStack, contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import Optional
+from unittest import mock
+
+from ._stubs import install_stubs, make_system, set_profile
+
+
+@dataclass
+class Fleet:
+    root: Path
+    unit_file_dir: Path
+    profile_dir: Path
+    state_dir: Path
+    machined_dir: Path
+    declarative_dir: Path
+    runtime_dir: Path
+    runtime_unit_dir: Path
+    store_dir: Path
+    bin_dir: Path
+    popen_calls: list[list[str]]
+
+    def names(self) -> list[str]:
+        return sorted(unit.stem for unit in self.unit_file_dir.glob("*.nspawn"))
+
+
+def _write_container(fleet: Fleet, index: int, running: bool) -> None:
+    name = f"bench{index}"
+    system = make_system(fleet.store_dir, name, serial=index)
+    set_profile(fleet.profile_dir / name / "system", system)
+    (fleet.state_dir / name).mkdir()
+    (fleet.unit_file_dir / f"{name}.nspawn").symlink_to(system / "nixos-nspawn" / f"{name}.nspawn")
+    if running:
+        (fleet.machined_dir / name).write_text(f"NAME={name}\nLEADER={1000 + index}\n")
+
+
+@contextmanager
+def fake_fleet(
+    size: int,
+    running_ratio: float = 0.5,
+    stubs: bool = False,
+    latency: Optional[dict[str, float]] = None,
+    failure_rate: Optional[dict[str, float]] = None,
+) -> Generator[Fleet, None, None]:
+    """Creates `size` containers and redirects nixos_nspawn's host paths to them.
+
+    latency and failure_rate are keyed by program name, and only apply with stubs.
+    """
+    with TemporaryDirectory(prefix="nixos-nspawn-bench-") as tmp, ExitStack() as stack:
+        root = Path(tmp)
+        fleet = Fleet(
+            root=root,
+            unit_file_dir=root / "etc" / "systemd" / "nspawn",
+            profile_dir=root / "profiles",
+            state_dir=root / "machines",
+            machined_dir=root / "run" / "machines",
+            declarative_dir=root / "declarative.d",
+            runtime_dir=root / "run" / "nixos-nspawn",
+            runtime_unit_dir=root / "run" / "systemd" / "system",
+            store_dir=root / "store",
+            bin_dir=root / "bin",
+            popen_calls=[],
+        )
+        for path in (
+            fleet.unit_file_dir,
+            fleet.profile_dir,
+            fleet.state_dir,
+            fleet.machined_dir,
+            fleet.store_dir,
+        ):
+            path.mkdir(parents=True)
+
+        running_every = int(1 / running_ratio) if running_ratio else 0
+        for index in range(size):
+            _write_container(fleet, index, bool(running_every) and index % running_every == 0)
+
+        from nixos_nspawn.utilities import command
+
+        real_popen = command.Popen
+
+        def counting_popen(args: list[str], *pargs, **kwargs):  # noqa: ANN002, ANN003, ANN202
+            fleet.popen_calls.append(args)
+            return real_popen(args, *pargs, **kwargs)
+
+        for target, value in (
+            ("nixos_nspawn.constants.DEFAULT_NSPAWN_DIR", fleet.unit_file_dir),
+            ("nixos_nspawn.constants.DAEMON_SOCKET", fleet.runtime_dir / "daemon.sock"),
+            ("nixos_nspawn.models.container.NIX_PROFILE_DIR", fleet.profile_dir),
+            ("nixos_nspawn.models.container.NIX_STORE_DIR", fleet.store_dir),
+            ("nixos_nspawn.models.container.MACHINE_STATE_DIR", fleet.state_dir),
+            ("nixos_nspawn.models.container.DECLARATIVE_CONFIG_DIR", fleet.declarative_dir),
+            ("nixos_nspawn.models.container.RUNTIME_UNIT_DIR", fleet.runtime_unit_dir),
+            ("nixos_nspawn.utilities.machine_state.MACHINED_STATE_DIR", fleet.machined_dir),
+            ("nixos_nspawn.utilities.cache.NIX_STORE_DIR", fleet.store_dir),
+            ("nixos_nspawn.utilities.cache.RUNTIME_DIR", fleet.runtime_dir),
+            ("nixos_nspawn.utilities.lock.LOCK_DIR", fleet.runtime_dir / "locks"),
+            ("nixos_nspawn.utilities.reaper.TRASH_DIR", fleet.state_dir / ".nixos-nspawn-trash"),
+            ("nixos_nspawn.utilities.command.Popen", counting_popen),
+        ):
+            stack.enter_context(mock.patch(target, value))
+
+        if stubs:
+            install_stubs(
+                root, fleet.bin_dir, fleet.machined_dir, fleet.store_dir, latency, failure_rate
+            )
+            environment = {
+                "PATH": f"{fleet.bin_dir}{os.pathsep}{os.environ.get('PATH', '')}",
+                # The stubs stand in for machinectl, not machined's D-Bus API
+                "NIXOS_NSPAWN_BACKEND": "subprocess",
+            }
+            stack.enter_context(mock.patch.dict(os.environ, environment))
+
+        yield fleet
@@ -0,0 +1,205 @@
+"""Stand-ins for the host programs nixos-nspawn runs, acting on a synthetic fleet.
+
+Each stub executable in a fleet's bin directory calls main() with its program name.
+They read their configuration from stubs.json in the fleet's root, which sets the
+latency and failure rate of each program, and where the fake host's state lives.
+"""
+
+import json
+import os
+import random
+import sys
+import time
+from pathlib import Path
+from typing import Optional
+
+PROGRAMS = ("machinectl", "systemctl", "nix-env", "nix", "nix-build", "nix-store", "nsenter")
+
+CONFIG_FILE = "stubs.json"
+
+STUB_TEMPLATE = """#!{python} -I
+import sys
+sys.path.insert(0, {repo!r})
+from benchmarks._stubs import main
+sys.exit(main({program!r}, {config!r}, sys.argv[1:]))
+"""
+
+
+def make_system(store_dir: Path, name: str, serial: Optional[int] = None) -> Path:
+    """Creates a store path holding a container system, as eval-config.nix would build"""
+    serial = serial if serial is not None else time.monotonic_ns()
+    system = store_dir / f"{serial:032x}-{name}"
+    data_dir = system / "nixos-nspawn"
+    data_dir.mkdir(parents=True, exist_ok=True)
+    (data_dir / "data.json").write_text(
+        json.dumps({"declarative": False, "activation": {"strategy": "restart"}})
+    )
+    (data_dir / f"{name}.nspawn").write_text(f"[Exec]\nBoot=false\nParameters={system}/init\n")
+    (data_dir / "service-overrides.conf").write_text(
+        f"[Service]\nExecReload={system}/bin/switch-to-configuration test\n"
+    )
+    return system
+
+
+def set_profile(profile: Path, target: Path) -> int:
+    """Adds a generation to a profile and switches to it, as nix-env --set does"""
+    profile.parent.mkdir(parents=True, exist_ok=True)
+    prefix = f"{profile.name}-"
+    existing = [
+        int(entry.name[len(prefix) : -len("-link")])
+        for entry in profile.parent.iterdir()
+        if entry.name.startswith(prefix) and entry.name.endswith("-link")
+    ]
+    generation = max(existing, default=0) + 1
+    link = profile.with_name(f"{profile.name}-{generation}-link")
+    link.symlink_to(target)
+
+    temporary = profile.with_name(f".{profile.name}.tmp")
+    temporary.unlink(missing_ok=True)
+    temporary.symlink_to(link.name)
+    temporary.replace(profile)
+    return generation
+
+
+def _option(args: list[str], name: str) -> Optional[str]:
+    return args[args.index(name) + 1] if name in args else None
+
+
+def _link_results(out_link: str, systems: list[Path], first_suffix: int) -> None:
+    """Links each result as nix build (result, result-1) or nix-build (result, result-2) does"""
+    for i, system in enumerate(systems):
+        link = Path(out_link if i == 0 else f"{out_link}-{i + first_suffix - 1}")
+        link.unlink(missing_ok=True)
+        link.symlink_to(system)
+
+
+def _machinectl(config: dict, args: list[str]) -> int:
+    machined_dir = Path(config["machined_dir"])
+    command, name = args[0], args[1] if len(args) > 1 else ""
+    state_file = machined_dir / name
+
+    if command in ("start", "reboot"):
+        # A new leader process each time it boots
+        temporary = machined_dir / f".{name}.tmp"
+        temporary.write_text(f"NAME={name}\nLEADER={random.randint(1000, 2**22)}\n")
+        temporary.replace(state_file)
+    elif command in ("poweroff", "terminate"):
+        state_file.unlink(missing_ok=True)
+    elif command == "show":
+        key = _option(args, "--property") or ""
+        try:
+            props = dict(line.split("=", 1) for line in state_file.read_text().splitlines())
+        except FileNotFoundError:
+            print(f"Could not get path to machine: No machine '{name}' known", file=sys.stderr)
+            return 1
+        print(props.get(key.upper(), ""))
+    elif command == "list":
+        machines = [{"machine": entry.name} for entry in machined_dir.iterdir()]
+        print(json.dumps(machines))
+    return 0
+
+
+def _systemctl(config: dict, args: list[str]) -> int:
+    if args[0] == "show":
+        print("no")
+    return 0
+
+
+def _nix_env(config: dict, args: list[str]) -> int:
+    profile = Path(_option(args, "-p") or "")
+    if "--set" not in args:
+        return 0
+
+    target = args[args.index("--set") + 1] if args[-1] != "--set" else None
+    if target is None or target.startswith("-"):
+        # Built from a configuration file
+        name = (_option(args, "name") or '"container"').strip('"')
+        target = str(make_system(Path(config["store_dir"]), name))
+    set_profile(profile, Path(target))
+    return 0
+
+
+def _nix(config: dict, args: list[str]) -> int:
+    store_dir = Path(config["store_dir"])
+    installables = [arg for arg in args[1:] if "#" in arg]
+    systems = [make_system(store_dir, arg.rsplit(".", 1)[-1]) for arg in installables]
+
+    if profile := _option(args, "--profile"):
+        set_profile(Path(profile), systems[0])
+    if out_link := _option(args, "--out-link"):
+        _link_results(out_link, systems, first_suffix=1)
+    if "--json" in args:
+        print(json.dumps([{"outputs": {"out": str(system)}} for system in systems]))
+    return 0
+
+
+def _nix_build(config: dict, args: list[str]) -> int:
+    store_dir = Path(config["store_dir"])
+    systems = [
+        make_system(store_dir, container["name"])
+        for container in json.loads(_option(args, "containers") or "[]")
+    ]
+    if out_link := _option(args, "--out-link"):
+        _link_results(out_link, systems, first_suffix=2)
+    for system in systems:
+        print(system)
+    return 0
+
+
+def _nix_store(config: dict, args: list[str]) -> int:
+    print("0 store paths deleted, 0.00 MiB freed", file=sys.stderr)
+    return 0
+
+
+HANDLERS = {
+    "machinectl": _machinectl,
+    "systemctl": _systemctl,
+    "nix-env": _nix_env,
+    "nix": _nix,
+    "nix-build": _nix_build,
+    "nix-store": _nix_store,
+    "nsenter": lambda config, args: 0,
+}
+
+
+def main(program: str, config_file: str, args: list[str]) -> int:
+    config = json.loads(Path(config_file).read_text())
+    time.sleep(config["latency"].get(program, 0.0))
+    if random.random() < config["failure_rate"].get(program, 0.0):
+        print(f"{program}: simulated failure", file=sys.stderr)
+        return 1
+
+    return HANDLERS[program](config, args)
+
+
+def install_stubs(
+    root: Path,
+    bin_dir: Path,
+    machined_dir: Path,
+    store_dir: Path,
+    latency: Optional[dict[str, float]] = None,
+    failure_rate: Optional[dict[str, float]] = None,
+) -> None:
+    """Writes the stub executables and their configuration"""
+    config_file = root / CONFIG_FILE
+    config_file.write_text(
+        json.dumps(
+            {
+                "machined_dir": str(machined_dir),
+                "store_dir": str(store_dir),
+                "latency": latency or {},
+                "failure_rate": failure_rate or {},
+            }
+        )
+    )
+
+    bin_dir.mkdir(parents=True, exist_ok=True)
+    repo = str(Path(__file__).resolve().parent.parent)
+    for program in PROGRAMS:
+        stub = bin_dir / program
+        stub.write_text(
+            STUB_TEMPLATE.format(
+                python=sys.executable, repo=repo, program=program, config=str(config_file)
+            )
+        )
+        os.chmod(stub, 0o755)
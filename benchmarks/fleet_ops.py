@@ -0,0 +1,195 @@
+"""Times each nixos-nspawn operation against synthetic fleets, on a simulated host.
+
+Run with `python -m benchmarks.fleet_ops`. Every operation runs in a fresh fleet
+with stub host programs, so it can be repeated at any size without root or Nix.
+Subprocesses are those nixos-nspawn started. rw_syscalls counts only the read and
+write syscalls made by nixos-nspawn itself (syscr and syscw in /proc/self/io), not
+every syscall, and excludes the stubs'. Use `strace -c -f` for a full breakdown.
+
+    python -m benchmarks.fleet_ops --sizes 10,100,1000 --latency 0.01
+    python -m benchmarks.fleet_ops --operations update --failure-rate nix=0.1
+"""
+
+import os
+import sys
+from argparse import ArgumentParser, ArgumentTypeError
+from collections.abc import Callable
+from contextlib import redirect_stderr, redirect_stdout
+from dataclasses import dataclass
+from io import StringIO
+from pathlib import Path
+from time import perf_counter
+
+import nixos_nspawn
+
+from ._fleet import Fleet, fake_fleet
+from ._stubs import PROGRAMS, make_system
+
+SIZES = (10, 100, 1000)
+
+# Files of 1 MiB in the state directory of the container cloned
+CLONE_STATE_FILES = 64
+
+
+@dataclass
+class Result:
+    operation: str
+    size: int
+    seconds: float
+    exit_code: int
+    subprocesses: int
+    rw_syscalls: int
+
+
+def _rw_syscalls() -> int:
+    """Read and write syscalls made by this process so far. Other syscalls aren't counted."""
+    try:
+        counters = dict(line.split(": ") for line in Path("/proc/self/io").read_text().splitlines())
+    except OSError:
+        return 0
+    return int(counters["syscr"]) + int(counters["syscw"])
+
+
+def _list(fleet: Fleet) -> list[str]:
+    return ["list", "--json"]
+
+
+def _autostart(fleet: Fleet) -> list[str]:
+    return ["autostart"]
+
+
+def _update(fleet: Fleet) -> list[str]:
+    # Every container is built by one (stub) nix build
+    return ["update", "--all", "--flake", str(fleet.root / "flake")]
+
+
+def _update_profile(fleet: Fleet) -> list[str]:
+    return ["update", "bench0", "--profile", str(make_system(fleet.store_dir, "bench0"))]
+
+
+def _stop(fleet: Fleet) -> list[str]:
+    return ["stop", "--all"]
+
+
+def _remove(fleet: Fleet) -> list[str]:
+    return ["remove", "bench0"]
+
+
+def _list_generations(fleet: Fleet) -> list[str]:
+    return ["list-generations", "bench0", "--json"]
+
+
+def _clone(fleet: Fleet) -> list[str]:
+    # Enough state that copying it shows, unless it can be reflinked
+    state = fleet.state_dir / "bench0" / "var" / "lib" / "data"
+    state.mkdir(parents=True)
+    for index in range(CLONE_STATE_FILES):
+        (state / f"{index}.db").write_bytes(os.urandom(1 << 20))
+    system = make_system(fleet.store_dir, "replica")
+    return ["clone", "bench0", "replica", "--profile", str(system)]
+
+
+OPERATIONS: dict[str, Callable[[Fleet], list[str]]] = {
+    "list": _list,
+    "autostart": _autostart,
+    "update": _update,
+    "update-profile": _update_profile,
+    "stop": _stop,
+    "remove": _remove,
+    "list-generations": _list_generations,
+    "clone": _clone,
+}
+
+
+def bench(
+    operation: str,
+    size: int,
+    latency: dict[str, float],
+    failure_rate: dict[str, float],
+) -> Result:
+    with (
+        fake_fleet(size, stubs=True, latency=latency, failure_rate=failure_rate) as fleet,
+        redirect_stdout(StringIO()),
+        redirect_stderr(StringIO()),
+    ):
+        args = ["nixos-nspawn", "--unit-file-dir", str(fleet.unit_file_dir)]
+        args.extend(OPERATIONS[operation](fleet))
+
+        rw_syscalls = _rw_syscalls()
+        start = perf_counter()
+        exit_code = nixos_nspawn.main(args)
+        seconds = perf_counter() - start
+
+        return Result(
+            operation=operation,
+            size=size,
+            seconds=seconds,
+            exit_code=exit_code,
+            subprocesses=len(fleet.popen_calls),
+            rw_syscalls=_rw_syscalls() - rw_syscalls,
+        )
+
+
+def parse_rates(value: str) -> dict[str, float]:
+    """Parses either one number for every program, or program=number pairs"""
+    try:
+        if "=" not in value:
+            return dict.fromkeys(PROGRAMS, float(value))
+        rates = {
+            program: float(rate)
+            for program, rate in (pair.split("=", 1) for pair in value.split(","))
+        }
+    except ValueError:
+        raise ArgumentTypeError(f"'{value}' is not a number or a list of program=number") from None
+    if unknown := rates.keys() - set(PROGRAMS):
+        raise ArgumentTypeError(f"Unknown programs {', '.join(sorted(unknown))}")
+    return rates
+
+
+def main() -> int:
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--sizes",
+        help="Comma separated fleet sizes",
+        type=lambda value: [int(size) for size in value.split(",")],
+        default=SIZES,
+    )
+    parser.add_argument(
+        "--operations",
+        help=f"Comma separated operations, from: {', '.join(OPERATIONS)}",
+        type=lambda value: value.split(","),
+        default=list(OPERATIONS),
+    )
+    parser.add_argument(
+        "--latency",
+        help="Seconds each host program takes, for all or as program=seconds pairs",
+        type=parse_rates,
+        default={},
+    )
+    parser.add_argument(
+        "--failure-rate",
+        help="Chance each host program fails, for all or as program=chance pairs",
+        type=parse_rates,
+        default={},
+    )
+    args = parser.parse_args()
+    if unknown := set(args.operations) - OPERATIONS.keys():
+        parser.error(f"Unknown operations {', '.join(sorted(unknown))}")
+
+    print(
+        f"{'operation':<18} {'containers':>10} {'time (s)':>10} {'exit':>5}"
+        f" {'subprocesses':>12} {'rw_syscalls':>11}"
+    )
+    for operation in args.operations:
+        for size in args.sizes:
+            result = bench(operation, size, args.latency, args.failure_rate)
+            print(
+                f"{result.operation:<18} {result.size:>10} {result.seconds:>10.3f}"
+                f" {result.exit_code:>5} {result.subprocesses:>12} {result.rw_syscalls:>11}"
+            )
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,52 @@
+"""Times `nixos-nspawn list` against synthetic fleets of increasing size.
+
+Run with `python -m benchmarks.list_state`. The subprocess column should stay
+constant as the fleet grows, since runtime state is collected in one pass.
+The warm run reuses the persistent cache written by the cold run. The fields run
+only asks for names and types, so it should never fork or read machine state.
+"""
+
+import sys
+from contextlib import redirect_stdout
+from io import StringIO
+from time import perf_counter
+
+import nixos_nspawn
+
+from ._fleet import fake_fleet
+
+SIZES = (10, 100, 1000)
+
+
+def bench_list(size: int) -> tuple[float, float, float, int]:
+    with fake_fleet(size) as fleet, redirect_stdout(StringIO()):
+        args = ["nixos-nspawn", "--unit-file-dir", str(fleet.unit_file_dir), "list"]
+        start = perf_counter()
+        nixos_nspawn.main(args)
+        cold = perf_counter() - start
+
+        start = perf_counter()
+        nixos_nspawn.main(args)
+        warm = perf_counter() - start
+
+        start = perf_counter()
+        nixos_nspawn.main([*args, "--fields", "name,type", "--ndjson"])
+        fields = perf_counter() - start
+
+        return cold, warm, fields, len(fleet.popen_calls)
+
+
+def main() -> int:
+    print(
+        f"{'containers':>10} {'cold (s)':>10} {'warm (s)':>10} {'fields (s)':>10}"
+        f" {'subprocesses':>12}"
+    )
+    for size in SIZES:
+        cold, warm, fields, forks = bench_list(size)
+        print(f"{size:>10} {cold:>10.3f} {warm:>10.3f} {fields:>10.3f} {forks:>12}")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,52 @@
+"""Measures manager memory and lookup latency against large synthetic fleets.
+
+Run with `python -m benchmarks.registry`. Single-name lookups should not depend on the
+fleet size, and materialising every container should stay in the low megabytes.
+"""
+
+import sys
+import tracemalloc
+from time import perf_counter
+
+from nixos_nspawn.backends import SubprocessBackend
+from nixos_nspawn.manager import NixosNspawnManager
+
+from ._fleet import fake_fleet
+
+SIZES = (1000, 10000)
+
+
+def bench_registry(size: int) -> dict[str, float]:
+    results: dict[str, float] = {}
+    with fake_fleet(size, running_ratio=0) as fleet:
+        tracemalloc.start()
+
+        start = perf_counter()
+        manager = NixosNspawnManager(fleet.unit_file_dir, backend=SubprocessBackend())
+        container = manager.get(f"bench{size // 2}")
+        results["get_ms"] = (perf_counter() - start) * 1000
+        assert container is not None
+
+        start = perf_counter()
+        containers = manager.list()
+        results["list_ms"] = (perf_counter() - start) * 1000
+        assert len(containers) == size
+
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        results["peak_mib"] = peak / 1024 / 1024
+
+    return results
+
+
+def main() -> int:
+    print(f"{'containers':>10} {'get (ms)':>10} {'list (ms)':>10} {'peak (MiB)':>11}")
+    for size in SIZES:
+        res = bench_registry(size)
+        print(f"{size:>10} {res['get_ms']:>10.3f} {res['list_ms']:>10.1f} {res['peak_mib']:>11.2f}")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
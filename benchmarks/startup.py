@@ -0,0 +1,71 @@
+"""Times how long nixos-nspawn takes to start, against a bare Python interpreter.
+
+Run with `python -m benchmarks.startup`. Each case runs in a fresh interpreter,
+so nothing is already imported or cached. The median overhead over bare Python
+must stay within the budget, otherwise the benchmark exits non-zero.
+"""
+
+import sys
+from pathlib import Path
+from statistics import median
+from subprocess import DEVNULL, run
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+RUNS = 15
+
+# Maximum median overhead over bare Python, in seconds
+BUDGET = {
+    "import": 0.200,
+    "list --json": 0.250,
+}
+
+
+def time_command(args: list[str]) -> float:
+    # Once first, so that bytecode is compiled and files are in the page cache
+    run(args, check=True, stdout=DEVNULL)
+    timings = []
+    for _ in range(RUNS):
+        start = perf_counter()
+        run(args, check=True, stdout=DEVNULL)
+        timings.append(perf_counter() - start)
+    return median(timings)
+
+
+def main() -> int:
+    with TemporaryDirectory(prefix="nixos-nspawn-bench-") as tmp:
+        unit_file_dir = Path(tmp)
+        cases = {
+            "import": [sys.executable, "-c", "import nixos_nspawn.main"],
+            "list --json": [
+                sys.executable,
+                "-m",
+                "nixos_nspawn",
+                "--unit-file-dir",
+                str(unit_file_dir),
+                "list",
+                "--json",
+            ],
+        }
+
+        baseline = time_command([sys.executable, "-c", "pass"])
+        print(f"{'case':>12} {'median (s)':>10} {'overhead (s)':>12} {'budget (s)':>10}")
+        print(f"{'python':>12} {baseline:>10.3f}")
+
+        over_budget = []
+        for case, args in cases.items():
+            elapsed = time_command(args)
+            overhead = elapsed - baseline
+            print(f"{case:>12} {elapsed:>10.3f} {overhead:>12.3f} {BUDGET[case]:>10.3f}")
+            if overhead > BUDGET[case]:
+                over_budget.append(case)
+
+    if over_budget:
+        print(f"Over budget: {', '.join(over_budget)}", file=sys.stderr)
+        return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
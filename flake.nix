@@ -34,7 +34,10 @@
 
                 format = "pyproject";
                 buildInputs = [ python-prev.setuptools ];
-                propagatedBuildInputs = [ python-prev.rich ];
+                propagatedBuildInputs = [
+                  python-prev.rich
+                  python-prev.jeepney
+                ];
 
                 patches = [
                   # Need to compile in the system architecture.
@@ -89,7 +92,7 @@
         };
 
         devShells = {
-          default = (pkgs.python3.withPackages (pyPkgs: [ pyPkgs.rich ])).env.overrideAttrs (prev: {
+          default = (pkgs.python3.withPackages (pyPkgs: [ pyPkgs.rich pyPkgs.jeepney ])).env.overrideAttrs (prev: {
             nativeBuildInputs = prev.nativeBuildInputs ++ [ pkgs.ruff pkgs.ty pkgs.nixfmt ];
           });
         };
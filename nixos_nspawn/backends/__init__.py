@@ -0,0 +1,77 @@
+from logging import getLogger
+from os import getenv
+from pathlib import Path
+from typing import Optional, cast
+
+from ._backend import Backend
+from .host_actions import DAEMON_RELOAD, RELOAD_NETWORKD, SYNC, HostAction, HostActions
+from .subprocess_backend import SubprocessBackend
+
+DEFAULT_SYSTEM_BUS_SOCKET = Path("/run/dbus/system_bus_socket")
+
+
+def get_backend(name: Optional[str] = None) -> Backend:
+    """Selects a backend by name (auto, dbus or subprocess).
+
+    The default can be set with the NIXOS_NSPAWN_BACKEND environment variable.
+    In auto mode, D-Bus is used when jeepney is installed and the system bus is reachable.
+    """
+    logger = getLogger("nixos_nspawn.backend")
+    name = (name or getenv("NIXOS_NSPAWN_BACKEND", "auto")).lower()
+
+    if name in ("auto", "dbus"):
+        try:
+            from .dbus_backend import DBusBackend
+        except ImportError as err:
+            if name == "dbus":
+                raise err
+            logger.debug("jeepney is not installed, using the subprocess backend")
+        else:
+            if name == "dbus":
+                return DBusBackend()
+            if getenv("DBUS_SYSTEM_BUS_ADDRESS"):
+                return DBusBackend()
+            if DEFAULT_SYSTEM_BUS_SOCKET.exists():
+                return DBusBackend()
+            logger.debug("System bus is unavailable, using the subprocess backend")
+
+    elif name != "subprocess":
+        raise ValueError(f"Unknown backend '{name}'")
+
+    return SubprocessBackend()
+
+
+class LazyBackend(object):
+    """Selects and creates the backend on first use, so that commands which
+    never talk to systemd don't pay for connecting to it, or importing jeepney."""
+
+    def __init__(self, name: Optional[str] = None) -> None:
+        self.__name = name
+        self.__backend: Optional[Backend] = None
+
+    def __getattr__(self, attr: str) -> object:
+        if self.__backend is None:
+            self.__backend = get_backend(self.__name)
+        return getattr(self.__backend, attr)
+
+    def close(self) -> None:
+        # A backend which was never created has nothing to close
+        if self.__backend is not None:
+            self.__backend.close()
+
+
+def lazy_backend(name: Optional[str] = None) -> Backend:
+    return cast(Backend, LazyBackend(name))
+
+
+__all__ = [
+    "DAEMON_RELOAD",
+    "RELOAD_NETWORKD",
+    "SYNC",
+    "Backend",
+    "HostAction",
+    "HostActions",
+    "SubprocessBackend",
+    "get_backend",
+    "lazy_backend",
+]
@@ -0,0 +1,50 @@
+from abc import abstractmethod
+from typing import Protocol
+
+
+class Backend(Protocol):
+    """Protocol definition for the interface to systemd and systemd-machined"""
+
+    @abstractmethod
+    def get_machine_property(self, name: str, key: str) -> str:
+        """Reads a property of a registered machine, as `machinectl show` would"""
+        ...
+
+    @abstractmethod
+    def start_machine(self, name: str) -> None:
+        """Starts the machine's nspawn service and waits for the job to finish"""
+        ...
+
+    @abstractmethod
+    def reboot_machine(self, name: str) -> None:
+        """Asks the machine's init process to reboot"""
+        ...
+
+    @abstractmethod
+    def poweroff_machine(self, name: str) -> None:
+        """Asks the machine's init process to power off"""
+        ...
+
+    @abstractmethod
+    def reload_unit(self, unit: str) -> None:
+        """Reloads a unit and waits for the job to finish"""
+        ...
+
+    @abstractmethod
+    def daemon_reload(self) -> None:
+        """Reloads the systemd manager configuration"""
+        ...
+
+    @abstractmethod
+    def revert_unit(self, unit: str) -> None:
+        """Removes runtime overrides and drop-ins of a unit"""
+        ...
+
+    @abstractmethod
+    def unit_needs_daemon_reload(self, unit: str) -> bool:
+        """Whether the unit's files on disk have changed since systemd last loaded them"""
+        ...
+
+    def close(self) -> None:
+        """Releases any connections held. The backend may still be used afterwards."""
+        return None
@@ -0,0 +1,176 @@
+from logging import getLogger
+from signal import SIGINT, SIGRTMIN
+from threading import Lock, local
+from typing import Any, Optional
+
+from jeepney import DBusAddress, HeaderFields, MatchRule, Message, MessageType, new_method_call
+from jeepney.bus_messages import message_bus
+from jeepney.io.blocking import DBusConnection, open_dbus_connection
+
+from ..utilities import CommandError
+from ._backend import Backend
+
+SYSTEMD = DBusAddress(
+    "/org/freedesktop/systemd1",
+    bus_name="org.freedesktop.systemd1",
+    interface="org.freedesktop.systemd1.Manager",
+)
+MACHINED = DBusAddress(
+    "/org/freedesktop/machine1",
+    bus_name="org.freedesktop.machine1",
+    interface="org.freedesktop.machine1.Manager",
+)
+MACHINE_INTERFACE = "org.freedesktop.machine1.Machine"
+UNIT_INTERFACE = "org.freedesktop.systemd1.Unit"
+PROPERTIES_INTERFACE = "org.freedesktop.DBus.Properties"
+
+# Same signals machinectl sends to the container's init process
+SIGNAL_REBOOT = int(SIGINT)
+SIGNAL_POWEROFF = int(SIGRTMIN) + 4
+
+# Upper bound for a single method call or job to complete
+DEFAULT_TIMEOUT = 300.0
+
+
+class DBusBackendError(CommandError):
+    """A failed D-Bus call. Shaped like a CommandError so callers can treat both alike."""
+
+    def __init__(self, call: list[str], message: str) -> None:
+        super().__init__(call, 1, message)
+
+
+class DBusBackend(Backend):
+    """Talks to systemd and systemd-machined directly over the system bus.
+
+    Each thread opens a connection on first use and reuses it for every call, so
+    that threads acting on different containers never wait on each other's jobs.
+    """
+
+    name = "dbus"
+
+    def __init__(self, address: str = "SYSTEM", timeout: float = DEFAULT_TIMEOUT) -> None:
+        self.address = address
+        self.timeout = timeout
+
+        # The calling thread's connection, and whether it is subscribed to job signals
+        self.__local = local()
+        self.__connections: list[DBusConnection] = []
+        self.__lock = Lock()
+        self.__logger = getLogger("nixos_nspawn.backend.dbus")
+
+    @property
+    def connection(self) -> DBusConnection:
+        connection: Optional[DBusConnection] = getattr(self.__local, "connection", None)
+        if connection is None:
+            self.__logger.debug("Connecting to the %s bus", self.address)
+            connection = self.__local.connection = open_dbus_connection(self.address)
+            self.__local.subscribed = False
+            with self.__lock:
+                self.__connections.append(connection)
+        return connection
+
+    def close(self) -> None:
+        """Closes the connections of every thread"""
+        with self.__lock:
+            connections, self.__connections = self.__connections, []
+            self.__local = local()
+        for connection in connections:
+            connection.close()
+
+    def _call(
+        self,
+        address: DBusAddress,
+        method: str,
+        signature: str = "",
+        *body: Any,  # noqa: ANN401
+    ) -> tuple:
+        self.__logger.debug("Calling %s.%s%s", address.interface, method, body)
+        reply: Message = self.connection.send_and_get_reply(
+            new_method_call(address, method, signature or None, body), timeout=self.timeout
+        )
+        if reply.header.message_type == MessageType.error:
+            error_name = reply.header.fields.get(HeaderFields.error_name)
+            raise DBusBackendError(
+                [f"{address.interface}.{method}", *(str(arg) for arg in body)],
+                f"{error_name}: {' '.join(map(str, reply.body))}",
+            )
+        return reply.body
+
+    def _call_job(self, method: str, signature: str, *body: Any) -> None:  # noqa: ANN401
+        """Calls a systemd method which enqueues a job, and waits for the job to finish"""
+        # No sender in the rule: signals carry systemd's unique name, not its well-known name
+        rule = MatchRule(
+            type="signal",
+            interface=SYSTEMD.interface,
+            member="JobRemoved",
+            path=SYSTEMD.object_path,
+        )
+        if not getattr(self.__local, "subscribed", False):
+            # Job signals are only guaranteed to be delivered to subscribers
+            self._call(SYSTEMD, "Subscribe")
+            self.connection.send_and_get_reply(message_bus.AddMatch(rule), timeout=self.timeout)
+            self.__local.subscribed = True
+
+        with self.connection.filter(rule, bufsize=64) as queue:
+            (job_path,) = self._call(SYSTEMD, method, signature, *body)
+            while True:
+                signal = self.connection.recv_until_filtered(queue, timeout=self.timeout)
+                _, path, unit, result = signal.body
+                if path == job_path:
+                    break
+
+        if result != "done":
+            raise DBusBackendError(
+                [f"{SYSTEMD.interface}.{method}", *(str(arg) for arg in body)],
+                f"Job for {unit} finished with result '{result}'",
+            )
+
+    def get_machine_property(self, name: str, key: str) -> str:
+        (machine_path,) = self._call(MACHINED, "GetMachine", "s", name)
+        ((_, value),) = self._call(
+            DBusAddress(machine_path, MACHINED.bus_name, PROPERTIES_INTERFACE),
+            "Get",
+            "ss",
+            MACHINE_INTERFACE,
+            key,
+        )
+
+        if isinstance(value, (list, tuple)):
+            return " ".join(map(str, value))
+        return str(value)
+
+    def start_machine(self, name: str) -> None:
+        self._call_job("StartUnit", "ss", f"systemd-nspawn@{name}.service", "replace")
+
+    def reboot_machine(self, name: str) -> None:
+        self._call(MACHINED, "KillMachine", "ssi", name, "leader", SIGNAL_REBOOT)
+
+    def poweroff_machine(self, name: str) -> None:
+        self._call(MACHINED, "KillMachine", "ssi", name, "leader", SIGNAL_POWEROFF)
+
+    def reload_unit(self, unit: str) -> None:
+        self._call_job("ReloadUnit", "ss", unit, "replace")
+
+    def daemon_reload(self) -> None:
+        self._call(SYSTEMD, "Reload")
+
+    def unit_needs_daemon_reload(self, unit: str) -> bool:
+        try:
+            (unit_path,) = self._call(SYSTEMD, "GetUnit", "s", unit)
+        except DBusBackendError:
+            # Units which aren't loaded are read from disk when next used
+            return False
+        ((_, value),) = self._call(
+            DBusAddress(unit_path, SYSTEMD.bus_name, PROPERTIES_INTERFACE),
+            "Get",
+            "ss",
+            UNIT_INTERFACE,
+            "NeedDaemonReload",
+        )
+
+        return bool(value)
+
+    def revert_unit(self, unit: str) -> None:
+        self._call(SYSTEMD, "RevertUnitFiles", "as", [unit])
+        # systemctl revert reloads the manager afterwards, so do we
+        self._call(SYSTEMD, "Reload")
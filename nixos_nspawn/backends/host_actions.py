@@ -0,0 +1,146 @@
+from collections.abc import Generator
+from contextlib import AbstractContextManager, contextmanager, nullcontext
+from dataclasses import dataclass
+from logging import getLogger
+from threading import RLock
+from typing import Optional
+
+from ..utilities import DurableWriter, FileLocks, traced
+from ._backend import Backend
+
+NETWORKD_UNIT = "systemd-networkd.service"
+
+SYNC = "sync"
+
+DAEMON_RELOAD = "daemon-reload"
+
+RELOAD_NETWORKD = "reload-networkd"
+
+# Order in which pending actions are performed. Files are made durable
+# before systemd and networkd are asked to read them.
+ACTION_ORDER = (SYNC, DAEMON_RELOAD, RELOAD_NETWORKD)
+
+# Outside of a batch, these are performed as soon as they're requested
+IMMEDIATE_ACTIONS = frozenset({SYNC, RELOAD_NETWORKD})
+
+# Only performed when something needs them. A daemon-reload is only needed right
+# before a unit is reloaded, since starting a unit reads its files anyway.
+DEFERRED_ACTIONS = frozenset({DAEMON_RELOAD})
+
+
+@dataclass(frozen=True)
+class HostAction:
+    """A change made to the host outside of a container's own files"""
+
+    action: str
+    target: str = ""
+    # Containers on whose behalf the change was made
+    containers: tuple[str, ...] = ()
+
+    def __str__(self) -> str:
+        return f"{self.action} {self.target}" if self.target else self.action
+
+
+class HostActions(object):
+    """Performs host-wide side effects through a backend, and records each one.
+
+    Containers report the links and files they change here too, so that the
+    manager can tell the user exactly what was touched on the host.
+
+    Within a batch, requested syncs and reloads are collected and each is performed
+    once, the next time something needs them (see flush), or when the batch ends.
+    Deferred actions nothing asked for by the end of the batch are dropped.
+
+    Containers may be acted on from several threads. A thread needing a pending
+    action waits while another performs it. With locks, reloads also wait for those
+    of other processes on the host.
+    """
+
+    def __init__(self, backend: Backend, locks: Optional[FileLocks] = None) -> None:
+        self.backend = backend
+        self.locks = locks
+        # Files and links are written through this, so that a sync only
+        # has to flush what was actually touched
+        self.durable = DurableWriter()
+        self.performed: list[HostAction] = []
+        # Number of requested actions which were satisfied by another request
+        self.saved = 0
+
+        self.__pending: dict[str, list[str]] = {}
+        self.__batches = 0
+        self.__lock = RLock()
+        self.__logger = getLogger("nixos_nspawn.host")
+
+    def _host_lock(self) -> AbstractContextManager[None]:
+        return self.locks.host() if self.locks else nullcontext()
+
+    def record(self, action: str, target: str = "", container: Optional[str] = None) -> None:
+        entry = HostAction(action, target, (container,) if container else ())
+        self.__logger.debug("%s", entry)
+        self.performed.append(entry)
+
+    def for_container(self, name: str) -> list[HostAction]:
+        return [entry for entry in self.performed if name in entry.containers]
+
+    @contextmanager
+    def batch(self) -> Generator[None, None, None]:
+        """Coalesces the actions requested inside the block. Batches may be nested."""
+        self.__batches += 1
+        try:
+            yield
+        finally:
+            self.__batches -= 1
+            if not self.__batches:
+                with self.__lock:
+                    self.flush(
+                        *(action for action in ACTION_ORDER if action not in DEFERRED_ACTIONS)
+                    )
+                    for action in DEFERRED_ACTIONS & self.__pending.keys():
+                        self.saved += len(self.__pending.pop(action))
+                if self.saved:
+                    self.__logger.info("Coalescing saved %d host actions", self.saved)
+
+    def is_pending(self, action: str) -> bool:
+        return action in self.__pending
+
+    def request(self, action: str, container: Optional[str] = None) -> None:
+        with self.__lock:
+            self.__pending.setdefault(action, []).append(container or "")
+
+            if not self.__batches and action in IMMEDIATE_ACTIONS:
+                self.flush(action)
+
+    @traced()
+    def flush(self, *actions: str) -> None:
+        """Performs the pending actions given, or all of them"""
+        with self.__lock:
+            for action in ACTION_ORDER:
+                if action not in self.__pending or (actions and action not in actions):
+                    continue
+
+                requesters = self.__pending.pop(action)
+                if action == SYNC:
+                    self.durable.sync()
+                    target = ""
+                elif action == DAEMON_RELOAD:
+                    with self._host_lock():
+                        self.backend.daemon_reload()
+                    target = ""
+                else:
+                    with self._host_lock():
+                        self.backend.reload_unit(NETWORKD_UNIT)
+                    action, target = "reload", NETWORKD_UNIT
+
+                self.saved += len(requesters) - 1
+                entry = HostAction(action, target, tuple(sorted({c for c in requesters if c})))
+                self.__logger.debug("%s (requested %d times)", entry, len(requesters))
+                self.performed.append(entry)
+
+    def sync(self, container: Optional[str] = None) -> None:
+        self.request(SYNC, container)
+
+    def reload_networkd(self, container: Optional[str] = None) -> None:
+        self.request(RELOAD_NETWORKD, container)
+
+    def daemon_reload(self, container: Optional[str] = None) -> None:
+        self.request(DAEMON_RELOAD, container)
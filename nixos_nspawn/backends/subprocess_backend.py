@@ -0,0 +1,50 @@
+from ..utilities import run_command
+from ._backend import Backend
+
+# Upper bound for a single machinectl or systemctl call to complete
+DEFAULT_TIMEOUT = 300.0
+
+
+class SubprocessBackend(Backend):
+    """Talks to systemd by running machinectl and systemctl"""
+
+    name = "subprocess"
+
+    def __init__(self, timeout: float = DEFAULT_TIMEOUT) -> None:
+        self.timeout = timeout
+
+    def get_machine_property(self, name: str, key: str) -> str:
+        _, stdout = run_command(
+            ["machinectl", "show", name, "--property", key, "--value"],
+            capture_stdout=True,
+            capture_stderr=True,
+            timeout=self.timeout,
+        )
+        return stdout
+
+    def start_machine(self, name: str) -> None:
+        run_command(["machinectl", "start", name], timeout=self.timeout)
+
+    def reboot_machine(self, name: str) -> None:
+        run_command(["machinectl", "reboot", name], timeout=self.timeout)
+
+    def poweroff_machine(self, name: str) -> None:
+        run_command(["machinectl", "poweroff", name], timeout=self.timeout)
+
+    def reload_unit(self, unit: str) -> None:
+        run_command(["systemctl", "reload", unit], timeout=self.timeout)
+
+    def daemon_reload(self) -> None:
+        run_command(["systemctl", "daemon-reload"], timeout=self.timeout)
+
+    def unit_needs_daemon_reload(self, unit: str) -> bool:
+        _, stdout = run_command(
+            ["systemctl", "show", unit, "--property", "NeedDaemonReload", "--value"],
+            capture_stdout=True,
+            capture_stderr=True,
+            timeout=self.timeout,
+        )
+        return stdout.strip() == "yes"
+
+    def revert_unit(self, unit: str) -> None:
+        run_command(["systemctl", "revert", unit], timeout=self.timeout)
@@ -1,30 +1,80 @@
+from importlib import import_module
+from typing import TYPE_CHECKING, Any
+
 from ._command import Command
-from .autostart import AutostartCommand
-from .create import CreateCommand
-from .list import ListCommand
-from .list_generations import ListGenerationsCommand
-from .remove import RemoveCommand
-from .rollback import RollbackCommand
-from .update import UpdateCommand
-
-COMMANDS = [
-    AutostartCommand,
-    CreateCommand,
-    ListCommand,
-    ListGenerationsCommand,
-    RemoveCommand,
-    RollbackCommand,
-    UpdateCommand,
-]
+
+if TYPE_CHECKING:
+    from .autostart import AutostartCommand
+    from .clone import CloneCommand
+    from .create import CreateCommand
+    from .events import EventsCommand
+    from .gc import GcCommand
+    from .list import ListCommand
+    from .list_generations import ListGenerationsCommand
+    from .power import RebootCommand, StartCommand, StopCommand
+    from .reap import ReapCommand
+    from .remove import RemoveCommand
+    from .rollback import RollbackCommand
+    from .serve import ServeCommand
+    from .update import UpdateCommand
+
+    COMMANDS: list[type[Command]]
+
+# Command names, and the module and class implementing each. Modules are only
+# imported when their command is used, to keep startup fast.
+COMMAND_MODULES = {
+    "autostart": ("autostart", "AutostartCommand"),
+    "clone": ("clone", "CloneCommand"),
+    "create": ("create", "CreateCommand"),
+    "events": ("events", "EventsCommand"),
+    "gc": ("gc", "GcCommand"),
+    "list": ("list", "ListCommand"),
+    "list-generations": ("list_generations", "ListGenerationsCommand"),
+    "reap": ("reap", "ReapCommand"),
+    "reboot": ("power", "RebootCommand"),
+    "remove": ("remove", "RemoveCommand"),
+    "rollback": ("rollback", "RollbackCommand"),
+    "serve": ("serve", "ServeCommand"),
+    "start": ("power", "StartCommand"),
+    "stop": ("power", "StopCommand"),
+    "update": ("update", "UpdateCommand"),
+}
+
+
+def get_command(name: str) -> type[Command]:
+    """Imports and returns the Command registered under a command line name"""
+    module, class_name = COMMAND_MODULES[name]
+    return getattr(import_module(f".{module}", __name__), class_name)
+
+
+def __getattr__(name: str) -> Any:  # noqa: ANN401
+    # Keeps `from nixos_nspawn.commands import ListCommand` and COMMANDS working
+    if name == "COMMANDS":
+        return [get_command(command) for command in COMMAND_MODULES]
+    for module, class_name in COMMAND_MODULES.values():
+        if class_name == name:
+            return getattr(import_module(f".{module}", __name__), class_name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
 __all__ = [
     "Command",
     "COMMANDS",
+    "COMMAND_MODULES",
+    "get_command",
     "AutostartCommand",
+    "CloneCommand",
     "CreateCommand",
+    "EventsCommand",
+    "GcCommand",
     "ListCommand",
     "ListGenerationsCommand",
+    "ReapCommand",
+    "RebootCommand",
     "RemoveCommand",
     "RollbackCommand",
+    "ServeCommand",
+    "StartCommand",
+    "StopCommand",
     "UpdateCommand",
 ]
@@ -1,12 +1,13 @@
 from abc import abstractmethod
 from argparse import ArgumentParser, Namespace
 from json import dumps
-from typing import Any, ClassVar, Protocol
-
-import rich
+from typing import TYPE_CHECKING, Any, ClassVar, Optional, Protocol, TextIO
 
 from ..manager import NixosNspawnManager
 
+if TYPE_CHECKING:
+    from rich.console import Console
+
 
 class Command(Protocol):
     """Protocol definition for a Command"""
@@ -40,11 +41,20 @@ class BaseCommand(object):
     """Whether to require a name positional argument for this Command"""
     needs_name: ClassVar[bool] = False
 
+    """Whether this Command is run by the daemon when one is serving"""
+    remote: ClassVar[bool] = False
+
+    """Whether this Command changes the containers it is given"""
+    mutates: ClassVar[bool] = False
+
     def __init__(self, parsed_args: Namespace, manager: NixosNspawnManager) -> None:
         # The initializer for the commands must reside outside of
         super(BaseCommand, self).__init__(parsed_args, manager)
         self.parsed_args = parsed_args
         self.manager = manager
+        # Where output goes instead of stdout, such as a daemon client's buffer
+        self.output: Optional[TextIO] = None
+        self.console: Optional["Console"] = None
 
     @classmethod
     def register_arguments(cls, parser: ArgumentParser) -> None:
@@ -64,9 +74,16 @@ class BaseCommand(object):
     def _rprint(self, *vals: Any) -> None:  # noqa: ANN401
         """Prints the given values with rich if the JSON flag is toggled OFF"""
         if not self._json:
+            if self.console is not None:
+                self.console.print(*vals)
+                return
+
+            # Imported here so that JSON output never loads rich
+            import rich
+
             rich.print(*vals)
 
     def _jprint(self, val: Any) -> None:  # noqa: ANN401
         """Prints the given value as JSON if the JSON flag is toggled ON"""
         if self._json:
-            print(dumps(val))
+            print(dumps(val), file=self.output)
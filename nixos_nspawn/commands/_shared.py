@@ -1,22 +1,69 @@
+from argparse import ArgumentTypeError
+from collections.abc import Callable
 from pathlib import Path
 from typing import Optional
 
-import rich
 
+def _print_error(message: str) -> None:
+    # Only loaded when there is something to print
+    import rich
 
-def check_config_source(config: Optional[Path], profile: Optional[Path], flake: Optional[str]) -> int:
+    rich.print(message)
+
+
+def check_config_source(
+    config: Optional[Path],
+    profile: Optional[Path],
+    flake: Optional[str],
+    print_error: Callable[[str], None] = _print_error,
+) -> int:
+    """Checks that exactly one source was given. Errors are printed with print_error,
+    which should be the command's own printer so that they reach daemon clients."""
     num_sources = sum((config and 1 or 0, profile and 1 or 0, flake and 1 or 0))
     if num_sources > 1:
-        rich.print(
+        print_error(
             "[red]Options [bold]--config[/bold], [bold]--profile[/bold] and [bold]--flake[/bold]"
             " are mutually exclusive, please specify only one.[/red]"
         )
         return 1
 
     if num_sources == 0:
-        rich.print(
+        print_error(
             "[red]One of [bold]--config[/bold], [bold]--profile[/bold] or [bold]--flake[/bold] must be specified.[/red]"
         )
         return 1
 
     return 0
+
+
+def _parse_count(value: str, minimum: int) -> int:
+    try:
+        count = int(value)
+    except ValueError:
+        raise ArgumentTypeError(f"'{value}' is not a whole number") from None
+    if count < minimum:
+        raise ArgumentTypeError(f"'{value}' is less than {minimum}")
+    return count
+
+
+def non_negative_int(value: str) -> int:
+    """Parses a count which may be 0"""
+    return _parse_count(value, 0)
+
+
+def positive_int(value: str) -> int:
+    """Parses a count which must be at least 1"""
+    return _parse_count(value, 1)
+
+
+DURATION_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
+
+
+def parse_duration(value: str) -> float:
+    """Parses a duration such as 90, 30m or 14d into seconds"""
+    unit = value[-1:] if value[-1:] in DURATION_UNITS else "s"
+    number = value[:-1] if value[-1:] in DURATION_UNITS else value
+    try:
+        return float(number) * DURATION_UNITS[unit]
+    except ValueError:
+        raise ArgumentTypeError(f"'{value}' is not a duration such as 90, 30m or 14d") from None
@@ -1,7 +1,15 @@
 from argparse import ArgumentParser
+from time import monotonic
 
-from ..models import Container, ContainerError
+from ..constants import RC_OPERATION_FAILED
+from ..manager.manager import ACTION_START, DEFAULT_POWER_JOBS, DEFAULT_POWER_RETRIES
+from ..models import STATUS_FAILED, Container, ContainerError, OperationResult
+from ..utilities import STATE_POWERED_OFF
 from ._command import BaseCommand, Command
+from ._shared import non_negative_int, positive_int
+
+# How many of the slowest containers the boot time report lists
+SLOWEST_SHOWN = 5
 
 
 class AutostartCommand(BaseCommand, Command):
@@ -21,38 +29,143 @@ class AutostartCommand(BaseCommand, Command):
             action="store_true",
             default=False,
         )
+        parser.add_argument(
+            "-j",
+            "--jobs",
+            help=f"Number of containers to start at once. Default: {DEFAULT_POWER_JOBS}",
+            type=positive_int,
+            default=DEFAULT_POWER_JOBS,
+        )
+        parser.add_argument(
+            "--retries",
+            help="Times to retry a container which failed to start, waiting longer each time."
+            f" Default: {DEFAULT_POWER_RETRIES}",
+            type=non_negative_int,
+            default=DEFAULT_POWER_RETRIES,
+        )
+        parser.add_argument(
+            "--budget",
+            help="Seconds all containers should have started within. A warning is shown if not",
+            type=float,
+            default=None,
+        )
+
+    def _write_config_files(
+        self, containers: list[Container], known: set[str]
+    ) -> list[OperationResult]:
+        """Writes each container's files, returning the failures, and failing the
+        containers which had to start after them. As systemd's Requires= would, a
+        container fails if a container it starts after doesn't exist."""
+        failed = []
+        for container in containers:
+            if missing := [dep for dep in container.start_after if dep not in known]:
+                error = f"Not attempted, since {missing[0]} does not exist"
+                failed.append(OperationResult(container.name, ACTION_START, STATUS_FAILED, error))
+                continue
+            try:
+                with self.manager.locks.container(container.name):
+                    container.write_config_files()
+            except (ContainerError, OSError) as err:
+                failed.append(
+                    OperationResult(container.name, ACTION_START, STATUS_FAILED, str(err))
+                )
+
+        pending = [result.name for result in failed]
+        skipped = set(pending)
+        while pending:
+            dependency = pending.pop()
+            for container in containers:
+                if dependency in container.start_after and container.name not in skipped:
+                    skipped.add(container.name)
+                    pending.append(container.name)
+                    error = f"Not attempted, since {dependency} failed to {ACTION_START}"
+                    failed.append(
+                        OperationResult(container.name, ACTION_START, STATUS_FAILED, error)
+                    )
+        return failed
+
+    def _report_budget(self, results: list[OperationResult], elapsed: float) -> None:
+        budget = self.parsed_args.budget
+        self._rprint(f"Autostart took {elapsed:.2f}s")
+
+        slowest = sorted((r for r in results if r.elapsed), key=lambda r: -r.elapsed)
+        for result in slowest[:SLOWEST_SHOWN]:
+            self._rprint(f"  {result.elapsed:6.2f}s {result.name}")
+
+        if budget is not None and elapsed > budget:
+            self._rprint(
+                f"[yellow]Autostart exceeded its budget of {budget:.2f}s"
+                f" by {elapsed - budget:.2f}s[/yellow]"
+            )
 
     def run(self) -> int:
         dry_run: bool = self.parsed_args.dry_run
+        if self.parsed_args.jobs < 1:
+            self._rprint("[red][bold]--jobs[/bold] must be at least 1.[/red]")
+            return 1
+
         containers = self.manager.list()
-        results: list[Container] = []
+        selected: list[Container] = []
 
         for container in containers:
             if not container.is_managed:
                 self._rprint(f"Skipping unmanaged container {container.unit_file}")
-            elif container.state != "powered off":
+            elif container.state != STATE_POWERED_OFF:
                 self._rprint(f"Skipping container {container.unit_file} in state {container.state}")
             elif container.is_imperative and container.autostart:
-                results.append(container)
-                dry_run or container.write_config_files()
-                retries = 0
-                while retries < 3:
-                    try:
-                        dry_run or container.start()
-                        break
-                    except ContainerError as err:
-                        self._rprint(f"Failed to start container: {err}. Retries :{retries}/3")
-                        retries += 1
+                selected.append(container)
             else:
                 typ = container.is_imperative and "imperative" or "declarative"
                 self._rprint(f"Skipping {typ} container {container.name}")
 
-        action = "Would start" if dry_run else "Started"
-        self._rprint(f"{action} {len(results)} of {len(containers)} containers:")
+        if dry_run:
+            self._rprint(f"Would start {len(selected)} of {len(containers)} containers:")
+            for container in selected:
+                self._rprint(container.render())
+            self._jprint([c.to_dict() for c in selected])
+            return 0
+
+        started_at = monotonic()
+        # Write every container's files first, so that networkd is reloaded once
+        with self.manager.batch():
+            failed = self._write_config_files(selected, {c.name for c in containers})
+            skipped = {result.name for result in failed}
+            for result in failed:
+                self._rprint(result.render())
 
-        for container in results:
-            self._rprint(container.render())
+            results = failed + list(
+                self.manager.power_many(
+                    [c for c in selected if c.name not in skipped],
+                    ACTION_START,
+                    jobs=self.parsed_args.jobs,
+                    retries=max(0, self.parsed_args.retries),
+                    after={c.name: c.start_after for c in selected},
+                    on_result=lambda result: self._rprint(result.render()),
+                )
+            )
+        elapsed = monotonic() - started_at
 
-        self._jprint([c.to_dict() for c in results])
+        if saved := self.manager.host_actions.saved:
+            self._rprint(f"Coalesced host reloads and syncs, saving {saved}")
+
+        by_name = {result.name: result for result in results}
+        failures = sum(not result.ok for result in results)
+        self._rprint(
+            f"Started {len(results) - failures} of {len(containers)} containers"
+            + (f", [red]{failures} failed[/red]" if failures else "")
+        )
+        self._report_budget(results, elapsed)
+
+        self._jprint(
+            [
+                {
+                    **c.to_dict(),
+                    "status": by_name[c.name].status,
+                    "error": by_name[c.name].error,
+                    "elapsed": by_name[c.name].elapsed,
+                }
+                for c in selected
+            ]
+        )
 
-        return 0
+        return RC_OPERATION_FAILED if failures else 0
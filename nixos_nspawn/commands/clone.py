@@ -0,0 +1,73 @@
+from argparse import ArgumentParser
+from pathlib import Path
+from typing import Optional
+
+from ..constants import RC_CONTAINER_MISSING
+from ..metadata import default_system
+from ..utilities import DEFAULT_COPY_JOBS
+from ._command import BaseCommand, Command
+from ._shared import check_config_source, positive_int
+
+
+class CloneCommand(BaseCommand, Command):
+    """Create a container from its own configuration, starting from a copy of another's state"""
+
+    name = "clone"
+    supports_json = True
+    remote = True
+    mutates = True
+
+    @classmethod
+    def register_arguments(cls, parser: ArgumentParser) -> None:
+        parser.add_argument("source", help="Container whose state is copied")
+        super().register_arguments(parser)
+        parser.add_argument("name", help="Name of the new container")
+        parser.add_argument("--config", help="Container configuration file", type=Path)
+        parser.add_argument("--profile", help="Container system profile path", type=Path)
+        parser.add_argument("--flake", help="Container configuration flake URL", type=str)
+        parser.add_argument(
+            "--system",
+            help=f"The host platform name. The default ({default_system})"
+            " is selected at compile time.",
+            type=str,
+            default=default_system,
+        )
+        parser.add_argument(
+            "-j",
+            "--jobs",
+            help="Files to copy at once, if the state directory can't be snapshotted"
+            f" or reflinked. Default: {DEFAULT_COPY_JOBS}",
+            type=positive_int,
+            default=DEFAULT_COPY_JOBS,
+        )
+
+    def run(self) -> int:
+        name: str = self.parsed_args.name
+        source_name: str = self.parsed_args.source
+        config: Optional[Path] = self.parsed_args.config
+        profile: Optional[Path] = self.parsed_args.profile
+        flake: Optional[str] = self.parsed_args.flake
+
+        if rc := check_config_source(config, profile, flake, self._rprint):
+            return rc
+        if not (source := self.manager.get(source_name)):
+            self._rprint(f"[red]Container [bold]{source_name}[/bold] does not exist![/red]")
+            return RC_CONTAINER_MISSING
+
+        container, method = self.manager.clone(
+            source,
+            name,
+            config=config,
+            profile=profile,
+            flake=flake,
+            system=self.parsed_args.system,
+            jobs=self.parsed_args.jobs,
+        )
+
+        self._jprint({**container.to_dict(), "status": "created", "state_copy": method})
+        self._rprint(
+            f"Container [bold]{name}[/bold] cloned from [bold]{source_name}[/bold]"
+            f" [green]successfully[/green]. Details:\n" + container.render()
+        )
+
+        return 0
@@ -14,6 +14,8 @@ class CreateCommand(BaseCommand, Command):
     name = "create"
     needs_name = True
     supports_json = True
+    remote = True
+    mutates = True
 
     @classmethod
     def register_arguments(cls, parser: ArgumentParser) -> None:
@@ -21,6 +23,12 @@ class CreateCommand(BaseCommand, Command):
         parser.add_argument("--config", help="Container configuration file", type=Path)
         parser.add_argument("--profile", help="Container system profile path", type=Path)
         parser.add_argument("--flake", help="Container configuration flake URL", type=str)
+        parser.add_argument(
+            "--from-template",
+            help="Start from a copy of this container's state, instead of an empty one",
+            metavar="CONTAINER",
+            type=str,
+        )
         parser.add_argument(
             "--system",
             help=f"The host platform name. The default ({default_system})"
@@ -28,6 +36,35 @@ class CreateCommand(BaseCommand, Command):
             type=str,
             default=default_system,
         )
+        parser.add_argument(
+            "--exist-ok",
+            help=(
+                "Succeed without doing anything if the container already exists"
+                " and is known to have the requested system"
+            ),
+            action="store_true",
+            default=False,
+        )
+
+    def _create_from_template(self, name: str, template: str) -> int:
+        if not (source := self.manager.get(template)):
+            self._rprint(f"[red]Container [bold]{template}[/bold] does not exist![/red]")
+            return RC_CONTAINER_MISSING
+
+        container, method = self.manager.clone(
+            source,
+            name,
+            config=self.parsed_args.config,
+            profile=self.parsed_args.profile,
+            flake=self.parsed_args.flake,
+            system=self.parsed_args.system,
+        )
+        self._jprint({**container.to_dict(), "status": "created", "state_copy": method})
+        self._rprint(
+            f"Container [bold]{name}[/bold] created from [bold]{template}[/bold]"
+            " [green]successfully[/green]. Details:\n" + container.render()
+        )
+        return 0
 
     def run(self) -> int:
         name: str = self.parsed_args.name
@@ -35,19 +72,35 @@ class CreateCommand(BaseCommand, Command):
         profile: Optional[Path] = self.parsed_args.profile
         flake: Optional[str] = self.parsed_args.flake
         system: str = self.parsed_args.system
+        template: Optional[str] = self.parsed_args.from_template
 
-        if rc := check_config_source(config, profile, flake):
+        if rc := check_config_source(config, profile, flake, self._rprint):
             return rc
+        if template:
+            return self._create_from_template(name, template)
+
+        existed = self.manager.get(name) is not None
 
         try:
-            container = self.manager.create(name=name, config=config, profile=profile, flake=flake, system=system)
+            container = self.manager.create(
+                name=name,
+                config=config,
+                profile=profile,
+                flake=flake,
+                system=system,
+                exist_ok=self.parsed_args.exist_ok,
+            )
         except ValueError:
             # FIXME I'm not sure how I ever came to the conlusion that ValueError is a dupe error
             self._rprint(f"[red]Container [bold]{name}[/bold] already exists![/red]")
             # Distinguishable return code from other exceptions
             return RC_CONTAINER_MISSING
 
-        self._jprint(container.to_dict())
+        self._jprint({**container.to_dict(), "status": "unchanged" if existed else "created"})
+        if existed:
+            self._rprint(f"Container [bold]{name}[/bold] is unchanged. Nothing done.")
+            return 0
+
         self._rprint(
             f"Container [bold]{name}[/bold] created [green]successfully[/green]. Details:\n"
             + container.render()
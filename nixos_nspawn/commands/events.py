@@ -0,0 +1,63 @@
+import os
+import sys
+from argparse import ArgumentParser
+from json import dumps
+
+from ._command import BaseCommand, Command
+
+
+class EventsCommand(BaseCommand, Command):
+    """Stream container changes as JSON lines, starting with a snapshot of all containers"""
+
+    name = "events"
+
+    @classmethod
+    def register_arguments(cls, parser: ArgumentParser) -> None:
+        super().register_arguments(parser)
+        parser.add_argument(
+            "names",
+            help="Only report these containers",
+            metavar="name",
+            nargs="*",
+        )
+
+    def _emit(self, event: dict) -> None:
+        output = self.output or sys.stdout
+        output.write(dumps(event) + "\n")
+        output.flush()
+
+    def run(self) -> int:
+        # Imported here, since no other command needs the watcher
+        from ..daemon.events import ChangeSet, EventStream
+        from ..daemon.watcher import ContainerWatcher
+
+        changes = ChangeSet()
+        watcher = ContainerWatcher(
+            self.manager.unit_file_dir,
+            self.manager.cache,
+            self.manager.machine_state,
+            listener=changes.add,
+        )
+        stream = EventStream(self.manager, self.parsed_args.names or None)
+
+        # Changes are collected by the watcher's thread while this one writes. A slow
+        # reader only makes the changes between two writes pile up, and each container
+        # is then reported once with its latest state.
+        watcher.start()
+        try:
+            if not watcher.live:
+                self._rprint("[red]Following changes requires inotify[/red]")
+                return 1
+
+            self._emit(stream.snapshot(watcher.names()))
+            while True:
+                for event in stream.update(watcher.names(), changes.take()):
+                    self._emit(event)
+        except KeyboardInterrupt:
+            return 0
+        except BrokenPipeError:
+            # The reader went away. Stop Python from complaining when it flushes stdout.
+            os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+            return 0
+        finally:
+            watcher.stop()
@@ -0,0 +1,118 @@
+from argparse import ArgumentParser
+from time import monotonic, time
+from typing import Optional
+
+from ..constants import RC_CONTAINER_MISSING
+from ._command import BaseCommand, Command
+from ._shared import non_negative_int, parse_duration
+
+
+class GcCommand(BaseCommand, Command):
+    """Delete old generations of containers, and optionally collect garbage in the Nix store"""
+
+    name = "gc"
+    supports_json = True
+    remote = True
+    mutates = True
+
+    @classmethod
+    def register_arguments(cls, parser: ArgumentParser) -> None:
+        super().register_arguments(parser)
+        parser.add_argument("names", help="Container names", metavar="name", nargs="*")
+        parser.add_argument(
+            "--all",
+            help="Collect the generations of all imperative containers",
+            action="store_true",
+            default=False,
+        )
+        parser.add_argument(
+            "--keep-last",
+            help="Keep this many of the most recent generations, besides the current one",
+            type=non_negative_int,
+        )
+        parser.add_argument(
+            "--keep-newer-than",
+            help="Keep generations younger than this duration, such as 30d or 12h",
+            type=parse_duration,
+        )
+        parser.add_argument(
+            "--store-gc",
+            help="Run the Nix store garbage collector once afterwards",
+            action="store_true",
+            default=False,
+        )
+        parser.add_argument(
+            "-n",
+            "--dry-run",
+            help="Show which generations would be deleted",
+            action="store_true",
+            default=False,
+        )
+
+    def run(self) -> int:
+        names: list[str] = self.parsed_args.names
+        keep_last: Optional[int] = self.parsed_args.keep_last
+        keep_newer_than: Optional[float] = self.parsed_args.keep_newer_than
+        dry_run: bool = self.parsed_args.dry_run
+
+        if keep_last is None and keep_newer_than is None:
+            self._rprint(
+                "[red]Specify a retention policy with [bold]--keep-last[/bold]"
+                " and/or [bold]--keep-newer-than[/bold].[/red]"
+            )
+            return 1
+
+        if self.parsed_args.all:
+            containers = [c for c in self.manager.list() if c.is_managed and c.is_imperative]
+        elif names:
+            containers = []
+            for name in names:
+                if not (container := self.manager.get(name)):
+                    self._rprint(f"[red]Container [bold]{name}[/bold] does not exist![/red]")
+                    return RC_CONTAINER_MISSING
+                containers.append(container)
+        else:
+            self._rprint("[red]Specify container names, or [bold]--all[/bold].[/red]")
+            return 1
+
+        start = monotonic()
+        results = self.manager.gc(
+            containers,
+            keep_last=keep_last,
+            keep_newer_than=None if keep_newer_than is None else time() - keep_newer_than,
+            dry_run=dry_run,
+        )
+
+        store_paths, freed = 0, 0
+        if self.parsed_args.store_gc and not dry_run:
+            store_paths, freed = self.manager.collect_garbage()
+        elapsed = monotonic() - start
+
+        for result in results:
+            self._rprint(result.render())
+
+        removed = sum(len(result.removed) for result in results)
+        action = "Would remove" if dry_run else "Removed"
+        self._rprint(
+            f"{action} {removed} generations of {len(results)} containers in {elapsed:.2f}s"
+        )
+        if self.parsed_args.store_gc:
+            if dry_run:
+                self._rprint("Would collect garbage in the Nix store")
+            else:
+                self._rprint(
+                    f"Deleted {store_paths} store paths, freeing {freed / (1 << 20):.2f} MiB"
+                )
+
+        self._jprint(
+            {
+                "containers": [result.to_dict() for result in results],
+                "dry_run": dry_run,
+                "removed_generations": removed,
+                "deleted_store_paths": store_paths,
+                "reclaimed_bytes": freed,
+                "elapsed": elapsed,
+            }
+        )
+
+        return 0
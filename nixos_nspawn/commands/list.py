@@ -1,15 +1,56 @@
-from argparse import ArgumentParser
+import sys
+from argparse import ArgumentParser, ArgumentTypeError
+from collections.abc import Generator, Sequence
+from json import dumps
 from logging import getLogger
+from typing import Any
 
-from ..models import Container
+from ..models import FIELDS, Container
 from ._command import BaseCommand, Command
 
+# The fields of Container.to_dict(), which --json shows by default
+DEFAULT_FIELDS = ("name", "unit_file", "is_imperative")
+
+TABLE_FIELDS = ("name", "type", "state")
+
+NDJSON = "ndjson"
+
+
+def parse_fields(value: str) -> list[str]:
+    """Parses a comma separated list of field names"""
+    fields = [field.strip() for field in value.split(",") if field.strip()]
+    if unknown := [field for field in fields if field not in FIELDS]:
+        raise ArgumentTypeError(
+            f"Unknown fields {', '.join(unknown)}. Choose from {', '.join(FIELDS)}"
+        )
+    return fields
+
+
+def parse_filter(value: str) -> tuple[str, str]:
+    """Parses a filter such as state=running"""
+    field, separator, expected = value.partition("=")
+    if not separator or field not in FIELDS:
+        raise ArgumentTypeError(f"'{value}' is not a filter such as state=running")
+    return field, expected
+
+
+def format_value(value: Any) -> str:  # noqa: ANN401
+    """Formats a field for comparison with a filter, and for tables"""
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, list):
+        return ",".join(format_value(item) for item in value)
+    return str(value)
+
 
 class ListCommand(BaseCommand, Command):
     """List containers on the system"""
 
     name = "list"
     supports_json = True
+    remote = True
 
     @classmethod
     def register_arguments(cls, parser: ArgumentParser) -> None:
@@ -19,34 +60,106 @@ class ListCommand(BaseCommand, Command):
             choices=["imperative", "declarative"],
             default=None,
         )
-        return super().register_arguments(parser)
+        parser.add_argument(
+            "--fields",
+            help=f"Comma separated fields to show, from: {', '.join(FIELDS)}",
+            type=parse_fields,
+        )
+        parser.add_argument(
+            "--filter",
+            help="Only show containers with a field of this value, such as state=running."
+            " May be given more than once",
+            metavar="FIELD=VALUE",
+            type=parse_filter,
+            action="append",
+            default=[],
+        )
+        parser.add_argument(
+            "--table",
+            help="Show one row per container instead of the details of each",
+            action="store_true",
+            default=False,
+        )
+        super().register_arguments(parser)
+        parser.add_argument(
+            "--ndjson",
+            help="Output one JSON object per line, each as soon as it is ready",
+            dest="json",
+            action="store_const",
+            const=NDJSON,
+        )
 
-    def run(self) -> int:
-        container_type = self.parsed_args.type
-        containers = self.manager.list()
-        results: list[Container] = []
+    def _matches(self, container: Container) -> bool:
         logger = getLogger("nixos_nspawn")
+        container_type = self.parsed_args.type
+
+        if not container.is_managed:
+            logger.debug(f"Skipping unmanaged container {container.unit_file}")
+            return False
+        if container_type and (container_type == "imperative") != container.is_imperative:
+            logger.debug(
+                f"Skipping {container.is_imperative and 'imperative' or 'declarative'}"
+                f" container {container.name}"
+            )
+            return False
+
+        # Fields are only computed until one doesn't match
+        return all(
+            format_value(container.field(field)) == expected
+            for field, expected in self.parsed_args.filter
+        )
+
+    def _rows(self, fields: Sequence[str]) -> Generator[tuple[Container, dict], None, None]:
+        """Yields each matching container with the fields requested, one at a time"""
+        for name in self.manager.names():
+            if (container := self.manager.get(name)) and self._matches(container):
+                yield container, {field: container.field(field) for field in fields}
+
+    def _write(self, text: str) -> None:
+        output = self.output or sys.stdout
+        output.write(text)
+        output.flush()
+
+    def _print_table(self, fields: Sequence[str], rows: list[dict]) -> None:
+        """Prints plain aligned columns. Much faster than rich for thousands of rows."""
+        cells = [[field.upper() for field in fields]]
+        cells.extend([format_value(row[field]) or "-" for field in fields] for row in rows)
+        widths = [max(len(line[column]) for line in cells) for column in range(len(fields))]
 
-        for container in containers:
-            if not container.is_managed:
-                logger.debug(f"Skipping unmanaged container {container.unit_file}")
-            elif (
-                not container_type
-                or (container_type == "imperative" and container.is_imperative)
-                or (container_type == "declarative" and not container.is_imperative)
-            ):
-                results.append(container)
-            else:
-                logger.debug(
-                    f"Skipping {container.is_imperative and 'imperative' or 'declarative'}"
-                    f" container {container.name}"
-                )
-
-        self._rprint(f"Showing {len(results)} of {len(containers)} containers:")
+        self._write(
+            "".join(
+                "  ".join(
+                    cell.ljust(width) for cell, width in zip(line, widths, strict=True)
+                ).rstrip()
+                + "\n"
+                for line in cells
+            )
+        )
+
+    def run(self) -> int:
+        fields: Sequence[str] = self.parsed_args.fields or ()
+
+        if self.parsed_args.json == NDJSON:
+            for _, row in self._rows(fields or DEFAULT_FIELDS):
+                self._write(dumps(row) + "\n")
+            return 0
+
+        if self._json:
+            self._jprint([row for _, row in self._rows(fields or DEFAULT_FIELDS)])
+            return 0
+
+        if fields or self.parsed_args.table:
+            self._print_table(
+                fields or TABLE_FIELDS, [row for _, row in self._rows(fields or TABLE_FIELDS)]
+            )
+            return 0
+
+        total = len(self.manager.names())
+        results = [container for container, _ in self._rows(())]
+
+        self._rprint(f"Showing {len(results)} of {total} containers:")
 
         for container in results:
             self._rprint(container.render())
 
-        self._jprint([c.to_dict() for c in results])
-
         return 0
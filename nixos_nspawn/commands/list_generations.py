@@ -8,6 +8,7 @@ class ListGenerationsCommand(BaseCommand, Command):
     name = "list-generations"
     needs_name = True
     supports_json = True
+    remote = True
 
     def run(self) -> int:
         name: str = self.parsed_args.name
@@ -19,9 +20,9 @@ class ListGenerationsCommand(BaseCommand, Command):
             # Distinguishable return code from other exceptions
             return RC_CONTAINER_MISSING
 
-        generations = container.get_generations()
+        generations = list(container.get_generations())
 
-        self._jprint([g.render() for g in generations])
+        self._jprint([g.to_dict() for g in generations])
 
         self._rprint(f"Showing {len(generations)} generations for container [bold]{name}[/bold]:")
         for generation in generations:
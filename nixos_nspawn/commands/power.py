@@ -0,0 +1,162 @@
+import sys
+from argparse import ArgumentParser
+from json import dumps
+from typing import ClassVar, Optional
+
+from ..constants import RC_CONTAINER_MISSING, RC_OPERATION_FAILED
+from ..manager.manager import (
+    ACTION_REBOOT,
+    ACTION_START,
+    ACTION_STOP,
+    DEFAULT_POWER_JOBS,
+    DEFAULT_POWER_RETRIES,
+)
+from ..models import Container, OperationResult
+from ._command import BaseCommand, Command
+from ._shared import non_negative_int, positive_int
+from .list import NDJSON, format_value, parse_filter
+
+
+class PowerCommand(BaseCommand):
+    """Starts, stops or reboots many containers at once"""
+
+    action: ClassVar[str]
+    # Shown in the summary, e.g. "Started 3 of 4 containers"
+    past_tense: ClassVar[str]
+    supports_json = True
+
+    @classmethod
+    def register_arguments(cls, parser: ArgumentParser) -> None:
+        super().register_arguments(parser)
+        parser.add_argument(
+            "names",
+            help="Container names",
+            metavar="name",
+            nargs="*",
+        )
+        parser.add_argument(
+            "--all",
+            help="Act on all containers",
+            action="store_true",
+            default=False,
+        )
+        parser.add_argument(
+            "--filter",
+            help="Only act on containers with a field of this value, such as autostart=true."
+            " May be given more than once",
+            metavar="FIELD=VALUE",
+            type=parse_filter,
+            action="append",
+            default=[],
+        )
+        parser.add_argument(
+            "-j",
+            "--jobs",
+            help=f"Number of containers to act on at once. Default: {DEFAULT_POWER_JOBS}",
+            type=positive_int,
+            default=DEFAULT_POWER_JOBS,
+        )
+        parser.add_argument(
+            "--retries",
+            help="Times to retry a container which failed, waiting longer each time."
+            f" Default: {DEFAULT_POWER_RETRIES}",
+            type=non_negative_int,
+            default=DEFAULT_POWER_RETRIES,
+        )
+        parser.add_argument(
+            "--timeout",
+            help="Seconds to wait for each container to be ready, or to have gone",
+            type=float,
+            default=None,
+        )
+        parser.add_argument(
+            "--ndjson",
+            help="Output one JSON object per line, as soon as each container is done",
+            dest="json",
+            action="store_const",
+            const=NDJSON,
+        )
+
+    def _select(self) -> Optional[list[Container]]:
+        """The containers named, or matching the filters. None if a name is unknown."""
+        names: list[str] = self.parsed_args.names
+        filters: list[tuple[str, str]] = self.parsed_args.filter
+
+        if names:
+            containers = []
+            for name in names:
+                if not (container := self.manager.get(name)):
+                    self._rprint(f"[red]Container [bold]{name}[/bold] does not exist![/red]")
+                    return None
+                containers.append(container)
+        else:
+            containers = [c for c in self.manager.list() if c.is_managed]
+
+        return [
+            container
+            for container in containers
+            if all(format_value(container.field(field)) == value for field, value in filters)
+        ]
+
+    def _report(self, result: OperationResult) -> None:
+        if self.parsed_args.json == NDJSON:
+            output = self.output or sys.stdout
+            output.write(dumps(result.to_dict()) + "\n")
+            output.flush()
+        else:
+            self._rprint(result.render())
+
+    def run(self) -> int:
+        if not (self.parsed_args.names or self.parsed_args.all or self.parsed_args.filter):
+            self._rprint(
+                "[red]Specify container names, [bold]--all[/bold] or [bold]--filter[/bold].[/red]"
+            )
+            return 1
+        if self.parsed_args.jobs < 1:
+            self._rprint("[red][bold]--jobs[/bold] must be at least 1.[/red]")
+            return 1
+
+        if (containers := self._select()) is None:
+            return RC_CONTAINER_MISSING
+
+        results = self.manager.power_many(
+            containers,
+            self.action,
+            jobs=self.parsed_args.jobs,
+            retries=max(0, self.parsed_args.retries),
+            timeout=self.parsed_args.timeout,
+            on_result=self._report,
+        )
+        if self.parsed_args.json != NDJSON:
+            self._jprint([result.to_dict() for result in results])
+
+        failed = sum(not result.ok for result in results)
+        self._rprint(
+            f"{self.past_tense} {len(results) - failed} of {len(results)} containers"
+            + (f", [red]{failed} failed[/red]" if failed else "")
+        )
+        return RC_OPERATION_FAILED if failed else 0
+
+
+class StartCommand(PowerCommand, Command):
+    """Start containers, and wait until they are ready"""
+
+    name = "start"
+    action = ACTION_START
+    past_tense = "Started"
+
+
+class StopCommand(PowerCommand, Command):
+    """Power off containers, and wait until they have stopped"""
+
+    name = "stop"
+    action = ACTION_STOP
+    past_tense = "Stopped"
+
+
+class RebootCommand(PowerCommand, Command):
+    """Reboot containers, and wait until they are ready again"""
+
+    name = "reboot"
+    action = ACTION_REBOOT
+    past_tense = "Rebooted"
@@ -0,0 +1,81 @@
+from argparse import ArgumentParser
+from pathlib import Path
+from typing import Optional
+
+from ..utilities import DEFAULT_REAP_JOBS, ReapProgress, Trash
+from ._command import BaseCommand, Command
+from ._shared import positive_int
+
+
+class ReapCommand(BaseCommand, Command):
+    """Delete the state directories of removed containers, or show how much is left"""
+
+    name = "reap"
+    supports_json = True
+
+    @classmethod
+    def register_arguments(cls, parser: ArgumentParser) -> None:
+        super().register_arguments(parser)
+        parser.add_argument(
+            "--status",
+            help="Show what is left to delete, and the progress of the running reaper",
+            action="store_true",
+            default=False,
+        )
+        parser.add_argument(
+            "-j",
+            "--jobs",
+            help=f"Directories to empty at once. Default: {DEFAULT_REAP_JOBS}",
+            type=positive_int,
+            default=DEFAULT_REAP_JOBS,
+        )
+        parser.add_argument(
+            "--trash-dir",
+            help="Trash directory to reap. Default: the one beside the state directories",
+            type=Path,
+        )
+
+    def run(self) -> int:
+        trash_dir: Optional[Path] = self.parsed_args.trash_dir
+        trash = Trash(trash_dir) if trash_dir else self.manager.trash
+
+        if self.parsed_args.status:
+            return self._status(trash)
+
+        def on_progress(progress: ReapProgress) -> None:
+            self._rprint(
+                f"[bold]{progress.entry}[/bold]: {progress.files} files,"
+                f" {progress.bytes} bytes deleted in {progress.elapsed:.1f}s"
+            )
+
+        reaped = trash.reap(jobs=self.parsed_args.jobs, on_progress=on_progress)
+        if reaped is None:
+            self._jprint({"status": "running", "reaping": trash.progress()})
+            self._rprint("[yellow]Another reaper is running; Nothing done.[/yellow]")
+            return 0
+
+        self._jprint({"status": "done", "reaped": [progress.to_dict() for progress in reaped]})
+        self._rprint(
+            f"Deleted {len(reaped)} state directories,"
+            f" {sum(progress.bytes for progress in reaped)} bytes"
+        )
+        return 1 if trash.entries() else 0
+
+    def _status(self, trash: Trash) -> int:
+        status = trash.status()
+        self._jprint(status)
+
+        if reaping := status["reaping"]:
+            self._rprint(
+                f"Reaping [bold]{reaping['entry']}[/bold]: {reaping['files']} files,"
+                f" {reaping['bytes']} bytes deleted in {reaping['elapsed']:.1f}s"
+            )
+        for entry in status["remaining"]:
+            self._rprint(
+                f"[bold]{entry['entry']}[/bold]: {entry['files']} files, {entry['bytes']} bytes"
+            )
+        self._rprint(
+            f"{len(status['remaining'])} state directories left to delete,"
+            f" {status['files']} files and {status['bytes']} bytes"
+        )
+        return 0
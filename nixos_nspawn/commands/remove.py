@@ -8,6 +8,8 @@ class RemoveCommand(BaseCommand, Command):
 
     name = "remove"
     needs_name = True
+    remote = True
+    mutates = True
 
     @classmethod
     def register_arguments(cls, parser: ArgumentParser) -> None:
@@ -15,7 +17,14 @@ class RemoveCommand(BaseCommand, Command):
             "--delete-state",
             help="Delete the container's state directory",
             default=False,
-            action='store_true',
+            action="store_true",
+        )
+        parser.add_argument(
+            "--wait",
+            help="Wait until the state directory is deleted, rather than deleting it"
+            " in the background",
+            default=False,
+            action="store_true",
         )
         return super().register_arguments(parser)
 
@@ -31,7 +40,11 @@ class RemoveCommand(BaseCommand, Command):
             return 0
 
         self._rprint(f"Removing container [bold]{name}[/bold]...")
-        self.manager.remove(container, delete_state=self.parsed_args.delete_state)
+        self.manager.remove(
+            container,
+            delete_state=self.parsed_args.delete_state,
+            wait=self.parsed_args.wait,
+        )
         self._rprint(f"Container [bold]{name}[/bold] removed [green]successfully[/green]")
 
         return 0
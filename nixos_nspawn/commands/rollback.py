@@ -1,3 +1,6 @@
+from argparse import ArgumentParser
+from typing import Optional
+
 from ..constants import RC_CONTAINER_MISSING
 from ._command import BaseCommand, Command
 
@@ -8,9 +11,21 @@ class RollbackCommand(BaseCommand, Command):
     name = "rollback"
     needs_name = True
     supports_json = True
+    remote = True
+    mutates = True
+
+    @classmethod
+    def register_arguments(cls, parser: ArgumentParser) -> None:
+        super().register_arguments(parser)
+        parser.add_argument(
+            "--generation",
+            help="Switch to this generation instead of the previous one",
+            type=int,
+        )
 
     def run(self) -> int:
         name: str = self.parsed_args.name
+        generation_id: Optional[int] = self.parsed_args.generation
 
         container = self.manager.get(name)
 
@@ -19,15 +34,21 @@ class RollbackCommand(BaseCommand, Command):
             # Distinguishable return code from other exceptions
             return RC_CONTAINER_MISSING
 
-        if len(container.get_generations()) < 2:
+        if generation_id is None and container.previous_generation_id() is None:
             self._rprint(
                 f"[red]Container [bold]{name}[/bold] has no previous"
                 " generations to roll back to![/red]"
             )
             return 3
 
+        if generation_id is not None and generation_id not in container.generation_ids():
+            self._rprint(
+                f"[red]Container [bold]{name}[/bold] has no generation {generation_id}![/red]"
+            )
+            return 3
+
         self._rprint(f"Rolling back container [bold]{name}[/bold]...")
-        self.manager.rollback(container)
+        self.manager.rollback(container, generation_id=generation_id)
         self._rprint(f"Container [bold]{name}[/bold] rolled back [green]successfully[/green]")
         self._jprint(container)
 
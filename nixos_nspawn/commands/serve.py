@@ -0,0 +1,47 @@
+from argparse import ArgumentParser
+from pathlib import Path
+from signal import SIGTERM, signal
+from threading import Thread
+from typing import Any
+
+from ..constants import DAEMON_SOCKET
+from ._command import BaseCommand, Command
+
+
+class ServeCommand(BaseCommand, Command):
+    """Keep container state warm in a daemon. Other commands use it while it runs."""
+
+    name = "serve"
+
+    @classmethod
+    def register_arguments(cls, parser: ArgumentParser) -> None:
+        super().register_arguments(parser)
+        parser.add_argument(
+            "--socket",
+            help=f"Unix socket to listen on. Clients only look for it at {DAEMON_SOCKET}",
+            type=Path,
+            default=DAEMON_SOCKET,
+        )
+
+    def run(self) -> int:
+        # Imported here, since no other command needs the server
+        from ..daemon import DaemonServer
+
+        server = DaemonServer(
+            self.manager.unit_file_dir,
+            socket_path=self.parsed_args.socket,
+            cache=self.manager.cache,
+            machine_state=self.manager.machine_state,
+        )
+
+        def stop(*_: Any) -> None:  # noqa: ANN401
+            # shutdown() waits for serve_forever(), which this handler interrupted
+            Thread(target=server.shutdown).start()
+
+        signal(SIGTERM, stop)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+        return 0
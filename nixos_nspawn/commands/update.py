@@ -2,7 +2,7 @@ from argparse import ArgumentParser
 from pathlib import Path
 from typing import Optional
 
-from ..constants import RC_CONTAINER_MISSING
+from ..constants import RC_CONTAINER_MISSING, RC_OPERATION_FAILED
 from ..metadata import default_system
 from ._command import BaseCommand, Command
 from ._shared import check_config_source
@@ -12,22 +12,52 @@ class UpdateCommand(BaseCommand, Command):
     """Update a container present on the system"""
 
     name = "update"
-    needs_name = True
     supports_json = True
+    remote = True
+    mutates = True
 
     @classmethod
     def register_arguments(cls, parser: ArgumentParser) -> None:
         super().register_arguments(parser)
-        parser.add_argument("--config", help="Container configuration file", type=Path)
-        parser.add_argument("--profile", help="Container system profile path", type=Path)
-        parser.add_argument("--flake", help="Container configuration flake path", type=str)
+        parser.add_argument(
+            "names",
+            help="Container names. Multiple containers are built together in one Nix invocation",
+            metavar="name",
+            nargs="*",
+        )
+        parser.add_argument(
+            "--all",
+            help="Update all imperative containers",
+            action="store_true",
+            default=False,
+        )
+        parser.add_argument(
+            "--config",
+            help=(
+                "Container configuration file."
+                " When updating many containers, must be a directory containing <name>.nix files"
+            ),
+            type=Path,
+        )
+        parser.add_argument(
+            "--profile", help="Container system profile path. Only for one container", type=Path
+        )
+        parser.add_argument(
+            "--flake",
+            help=(
+                "Container configuration flake path."
+                " When updating many containers, must not have an attribute,"
+                " which defaults to each container's name"
+            ),
+            type=str,
+        )
         parser.add_argument(
             "--strategy",
             help=(
                 "Activation strategy to use to apply the update to the container."
                 " Leave blank to use strategy configured in the container's configuration."
             ),
-            choices=["reload", "restart"],
+            choices=["reload", "restart", "dynamic"],
         )
         parser.add_argument(
             "--system",
@@ -38,16 +68,24 @@ class UpdateCommand(BaseCommand, Command):
         )
 
     def run(self) -> int:
-        name: str = self.parsed_args.name
+        names: list[str] = self.parsed_args.names
         strategy: Optional[str] = self.parsed_args.strategy
         config: Optional[Path] = self.parsed_args.config
         profile: Optional[Path] = self.parsed_args.profile
         flake: Optional[str] = self.parsed_args.flake
         system: str = self.parsed_args.system
 
-        if rc := check_config_source(config, profile, flake):
+        if rc := check_config_source(config, profile, flake, self._rprint):
             return rc
 
+        if self.parsed_args.all or len(names) > 1:
+            return self._update_many(names, config, profile, flake, system, strategy)
+
+        if len(names) != 1:
+            self._rprint("[red]Specify a container name, or [bold]--all[/bold].[/red]")
+            return 1
+
+        name = names[0]
         container = self.manager.get(name)
 
         if not container:
@@ -55,7 +93,7 @@ class UpdateCommand(BaseCommand, Command):
             # Distinguishable return code from other exceptions
             return RC_CONTAINER_MISSING
 
-        self.manager.update(
+        changed = self.manager.update(
             container=container,
             config=config,
             profile=profile,
@@ -64,10 +102,67 @@ class UpdateCommand(BaseCommand, Command):
             activation_strategy=strategy,
         )
 
-        self._jprint(container.to_dict())
+        host_actions = [str(action) for action in self.manager.host_actions.performed]
+        self._jprint(
+            {
+                **container.to_dict(),
+                "status": "updated" if changed else "unchanged",
+                "host_actions": host_actions,
+            }
+        )
+        if not changed:
+            self._rprint(f"Container [bold]{name}[/bold] is unchanged. Nothing done.")
+            return 0
+
         self._rprint(
             f"Container [bold]{name}[/bold] updated [green]successfully[/green]. Details:\n"
             + container.render()
         )
+        self._rprint(
+            "Host actions: " + (", ".join(host_actions) if host_actions else "none required")
+        )
 
         return 0
+
+    def _update_many(
+        self,
+        names: list[str],
+        config: Optional[Path],
+        profile: Optional[Path],
+        flake: Optional[str],
+        system: str,
+        strategy: Optional[str],
+    ) -> int:
+        if self.parsed_args.all:
+            containers = [c for c in self.manager.list() if c.is_managed and c.is_imperative]
+        else:
+            containers = []
+            for name in names:
+                if not (container := self.manager.get(name)):
+                    self._rprint(f"[red]Container [bold]{name}[/bold] does not exist![/red]")
+                    return RC_CONTAINER_MISSING
+                containers.append(container)
+
+        self._rprint(f"Updating {len(containers)} containers...")
+        results = self.manager.update_many(
+            containers=containers,
+            config=config,
+            profile=profile,
+            flake=flake,
+            system=system,
+            activation_strategy=strategy,
+        )
+
+        for result in results:
+            self._rprint(result.render())
+        self._jprint([result.to_dict() for result in results])
+
+        failed = sum(not result.ok for result in results)
+        self._rprint(
+            f"Updated {len(results) - failed} of {len(results)} containers"
+            + (f", [red]{failed} failed[/red]" if failed else "")
+        )
+        if saved := self.manager.host_actions.saved:
+            self._rprint(f"Coalesced host reloads and syncs, saving {saved}")
+
+        return RC_OPERATION_FAILED if failed else 0
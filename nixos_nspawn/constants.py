@@ -10,8 +10,22 @@ NSENTER_ARGS = ["-m", "-u", "-U", "-i", "-n", "-p"]
 
 RC_CONTAINER_MISSING = 2
 
+RC_OPERATION_FAILED = 4
+
 DEFAULT_EVAL_SCRIPT = Path(__file__).parent / "nix" / "eval-config.nix"
 
+DEFAULT_BATCH_EVAL_SCRIPT = Path(__file__).parent / "nix" / "eval-configs.nix"
+
 FLAKE_KEY = "nixosContainers"
 
 DECLARATIVE_CONFIG_DIR = Path("/etc/nixos-nspawn/declarative.d")
+
+MACHINED_STATE_DIR = Path("/run/systemd/machines")
+
+RUNTIME_DIR = Path("/run/nixos-nspawn")
+
+NIX_STORE_DIR = Path("/nix/store")
+
+RUNTIME_UNIT_DIR = Path("/run/systemd/system")
+
+DAEMON_SOCKET = RUNTIME_DIR / "daemon.sock"
@@ -0,0 +1,12 @@
+from ._protocol import DaemonError, DaemonUnavailableError
+from .client import DaemonClient
+from .server import DaemonServer
+from .watcher import ContainerWatcher
+
+__all__ = [
+    "ContainerWatcher",
+    "DaemonClient",
+    "DaemonError",
+    "DaemonServer",
+    "DaemonUnavailableError",
+]
@@ -0,0 +1,58 @@
+from json import dumps, loads
+from typing import Any, Optional
+
+# Standard JSON-RPC 2.0 error codes
+PARSE_ERROR = -32700
+INVALID_REQUEST = -32600
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+INTERNAL_ERROR = -32603
+
+# The daemon can't serve this request, and the client should run it itself
+UNAVAILABLE = -32000
+
+# Environment variables which change what a command builds. The daemon only changes
+# containers for clients which have the same values as itself.
+BUILD_ENVIRONMENT = (
+    "NIX_PATH",
+    "NIXOS_NSPAWN_NIXPKGS",
+    "NIXOS_NSPAWN_EVAL",
+    "NIXOS_NSPAWN_BATCH_EVAL",
+)
+
+
+class DaemonError(Exception):
+    def __init__(self, code: int, message: str) -> None:
+        self.code = code
+        super().__init__(message)
+
+
+class DaemonUnavailableError(DaemonError):
+    """Nothing was done. The request can safely be run without the daemon."""
+
+    def __init__(self, message: str) -> None:
+        super().__init__(UNAVAILABLE, message)
+
+
+def encode(message: dict) -> bytes:
+    """Messages are one JSON object per line"""
+    return dumps(message, separators=(",", ":")).encode() + b"\n"
+
+
+def decode(line: bytes) -> dict:
+    message = loads(line)
+    if not isinstance(message, dict):
+        raise ValueError("Expected a JSON object")
+    return message
+
+
+def result(request_id: Any, value: Any) -> dict:  # noqa: ANN401
+    return {"jsonrpc": "2.0", "id": request_id, "result": value}
+
+
+def error(request_id: Any, code: int, message: str) -> dict:  # noqa: ANN401
+    return {"jsonrpc": "2.0", "id": request_id, "error": {"code": code, "message": message}}
+
+
+def request(request_id: int, method: str, params: Optional[dict] = None) -> dict:
+    return {"jsonrpc": "2.0", "id": request_id, "method": method, "params": params or {}}
@@ -0,0 +1,85 @@
+import os
+import socket
+import sys
+from itertools import count
+from pathlib import Path
+from shutil import get_terminal_size
+from typing import Any, Optional
+
+from ..constants import DAEMON_SOCKET
+from ._protocol import (
+    BUILD_ENVIRONMENT,
+    UNAVAILABLE,
+    DaemonError,
+    DaemonUnavailableError,
+    decode,
+    encode,
+    request,
+)
+
+# Connecting should be instant. Anything slower means the daemon is stuck.
+CONNECT_TIMEOUT = 2.0
+
+
+class DaemonClient(object):
+    """Sends requests to a daemon started with `nixos-nspawn serve`"""
+
+    def __init__(self, socket_path: Optional[Path] = None, timeout: Optional[float] = None) -> None:
+        self.socket_path = socket_path or DAEMON_SOCKET
+        # No timeout by default, since builds may take a long time
+        self.timeout = timeout
+        self.__ids = count(1)
+
+    def _connect(self) -> socket.socket:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM | socket.SOCK_CLOEXEC)
+        sock.settimeout(CONNECT_TIMEOUT)
+        try:
+            sock.connect(str(self.socket_path))
+        except OSError as err:
+            sock.close()
+            raise DaemonUnavailableError(f"Could not connect to {self.socket_path}: {err}") from err
+        sock.settimeout(self.timeout)
+        return sock
+
+    def call(self, method: str, **params: Any) -> Any:  # noqa: ANN401
+        """Sends one request and waits for its result"""
+        with self._connect() as sock:
+            try:
+                sock.sendall(encode(request(next(self.__ids), method, params)))
+                with sock.makefile("rb") as response_fd:
+                    line = response_fd.readline()
+            except OSError as err:
+                raise DaemonError(0, f"Lost the connection to the daemon: {err}") from err
+
+        if not line:
+            raise DaemonError(0, "The daemon closed the connection without responding")
+
+        try:
+            response = decode(line)
+        except ValueError as err:
+            raise DaemonError(0, f"Invalid response from the daemon: {err}") from None
+
+        if error := response.get("error"):
+            if error.get("code") == UNAVAILABLE:
+                raise DaemonUnavailableError(error.get("message", ""))
+            raise DaemonError(error.get("code", 0), error.get("message", ""))
+
+        return response.get("result")
+
+    def ping(self) -> dict:
+        return self.call("ping")
+
+    def run(self, args: list[str]) -> int:
+        """Runs a command line, without the program name, in the daemon.
+        Its output is written to stdout and stderr here, and its exit code returned."""
+        result = self.call(
+            "run",
+            args=args,
+            cwd=os.getcwd(),
+            color=sys.stdout.isatty(),
+            width=get_terminal_size().columns,
+            environment={name: os.environ.get(name) for name in BUILD_ENVIRONMENT},
+        )
+        sys.stdout.write(result["stdout"])
+        sys.stderr.write(result["stderr"])
+        return result["exit_code"]
@@ -0,0 +1,148 @@
+from collections.abc import Iterable
+from threading import Condition
+from time import time
+from typing import Optional
+
+from ..manager import NixosNspawnManager
+from .watcher import CHANGE_ALL, CHANGE_CONFIG, CHANGE_PROFILE
+
+EVENT_SNAPSHOT = "snapshot"
+EVENT_ADDED = "added"
+EVENT_REMOVED = "removed"
+EVENT_STATE = "state"
+EVENT_GENERATION = "generation"
+
+
+class ChangeSet(object):
+    """Names of the containers changed since the last take(), and how.
+
+    A container changing again before it is taken is only recorded once, so memory
+    is bounded by the number of containers however slowly changes are consumed.
+    """
+
+    def __init__(self) -> None:
+        self.__changes: dict[str, set[str]] = {}
+        self.__everything = False
+        self.__condition = Condition()
+
+    def add(self, kind: str, name: str) -> None:
+        with self.__condition:
+            if kind == CHANGE_ALL:
+                self.__everything = True
+            else:
+                self.__changes.setdefault(name, set()).add(kind)
+            self.__condition.notify()
+
+    def take(self, timeout: Optional[float] = None) -> Optional[dict[str, set[str]]]:
+        """Waits up to timeout seconds for changes, then returns and forgets them.
+
+        Returns None if everything may have changed, and {} if nothing did.
+        """
+        with self.__condition:
+            self.__condition.wait_for(lambda: self.__changes or self.__everything, timeout)
+            changes, self.__changes = self.__changes, {}
+            everything, self.__everything = self.__everything, False
+
+        return None if everything else changes
+
+
+class EventStream(object):
+    """Turns container changes into events, by comparing each container with how it
+    was last reported. Only the latest record of each container is kept."""
+
+    def __init__(self, manager: NixosNspawnManager, names: Optional[Iterable[str]] = None) -> None:
+        self.manager = manager
+        # Only report these containers, or all of them if None
+        self.names = set(names) if names is not None else None
+        self.__records: dict[str, dict] = {}
+
+    def _wanted(self, name: str) -> bool:
+        return self.names is None or name in self.names
+
+    def _record(self, name: str) -> Optional[dict]:
+        """The reported properties of a container, or None if it doesn't exist"""
+        if (container := self.manager.get(name)) is None or not container.is_managed:
+            return None
+
+        system_path = container.system_path
+        return {
+            "name": container.name,
+            "state": container.state,
+            "is_imperative": container.is_imperative,
+            "generation": container.current_generation_id(),
+            "system": str(system_path) if system_path else None,
+        }
+
+    def snapshot(self, index: Iterable[str]) -> dict:
+        """Records every container, and returns an event listing them all"""
+        self.manager.load(index)
+        self.__records = {}
+        for name in self.manager.names():
+            if self._wanted(name) and (record := self._record(name)) is not None:
+                self.__records[name] = record
+
+        return {
+            "event": EVENT_SNAPSHOT,
+            "time": time(),
+            "containers": list(self.__records.values()),
+        }
+
+    def update(self, index: Iterable[str], changes: Optional[dict[str, set[str]]]) -> list[dict]:
+        """Re-reads the changed containers, and returns an event for each difference.
+        If changes is None, every container is re-read."""
+        self.manager.load(index)
+        if changes is None:
+            names = set(self.manager.names()) | self.__records.keys()
+            changes = {name: {CHANGE_ALL} for name in names}
+
+        events: list[dict] = []
+        for name in sorted(changes):
+            if not self._wanted(name):
+                continue
+
+            if changes[name] & {CHANGE_ALL, CHANGE_CONFIG, CHANGE_PROFILE}:
+                if container := self.manager.get(name):
+                    container.invalidate()
+
+            previous = self.__records.pop(name, None)
+            if (current := self._record(name)) is not None:
+                self.__records[name] = current
+            events.extend(self._differences(name, previous, current))
+
+        return events
+
+    def _differences(
+        self, name: str, previous: Optional[dict], current: Optional[dict]
+    ) -> list[dict]:
+        now = time()
+        if previous is None:
+            return [] if current is None else [{"event": EVENT_ADDED, "time": now, **current}]
+        if current is None:
+            return [{"event": EVENT_REMOVED, "time": now, "name": name}]
+
+        events: list[dict] = []
+        if current["state"] != previous["state"]:
+            events.append(
+                {
+                    "event": EVENT_STATE,
+                    "time": now,
+                    "name": name,
+                    "state": current["state"],
+                    "previous": previous["state"],
+                }
+            )
+        if (
+            current["generation"] != previous["generation"]
+            or current["system"] != previous["system"]
+        ):
+            events.append(
+                {
+                    "event": EVENT_GENERATION,
+                    "time": now,
+                    "name": name,
+                    "generation": current["generation"],
+                    "previous": previous["generation"],
+                    "system": current["system"],
+                }
+            )
+        return events
@@ -0,0 +1,291 @@
+import os
+from collections.abc import Generator
+from contextlib import contextmanager
+from contextvars import ContextVar
+from io import StringIO
+from itertools import count
+from logging import DEBUG, INFO, Filter, LogRecord, StreamHandler, getLogger
+from pathlib import Path
+from socketserver import StreamRequestHandler, ThreadingUnixStreamServer
+from typing import Any, Optional
+
+from ..constants import DAEMON_SOCKET
+from ..manager import NixosNspawnManager
+from ..metadata import version
+from ..utilities import (
+    ContainerLogFilter,
+    FileLocks,
+    MachineStateSnapshot,
+    PersistentCache,
+    PlainFormatter,
+)
+from ._protocol import (
+    BUILD_ENVIRONMENT,
+    INTERNAL_ERROR,
+    INVALID_PARAMS,
+    INVALID_REQUEST,
+    METHOD_NOT_FOUND,
+    PARSE_ERROR,
+    DaemonError,
+    DaemonUnavailableError,
+    decode,
+    encode,
+    error,
+    result,
+)
+from .watcher import ContainerWatcher
+
+
+def _absolute_flake(flake: str, cwd: str) -> str:
+    """Makes a flake reference to a local path absolute. Other references are unchanged."""
+    ref, separator, attribute = flake.partition("#")
+    if ":" in ref or os.path.isabs(ref):
+        return flake
+    return os.path.normpath(os.path.join(cwd, ref)) + separator + attribute
+
+
+def absolute_arguments(parsed_args: Any, cwd: str) -> None:  # noqa: ANN401
+    """Resolves relative paths on a client's command line against its working directory"""
+    for key, value in vars(parsed_args).items():
+        if isinstance(value, Path) and not value.is_absolute():
+            setattr(parsed_args, key, Path(cwd) / value)
+        elif key == "flake" and isinstance(value, str):
+            setattr(parsed_args, key, _absolute_flake(value, cwd))
+
+
+# The request being served by the current thread. Worker threads started through
+# ContextThreadPoolExecutor inherit it from the thread which submitted their work.
+_request: ContextVar[Optional[int]] = ContextVar("nixos_nspawn_request", default=None)
+_request_ids = count(1)
+
+
+class _RequestFilter(Filter):
+    """Only passes records logged on behalf of one request"""
+
+    def __init__(self, request: int) -> None:
+        super().__init__()
+        self.request = request
+
+    def filter(self, record: LogRecord) -> bool:
+        # Filters run in the thread which logged the record, so its context is current
+        return _request.get() == self.request
+
+
+class _RequestHandler(StreamRequestHandler):
+    server: "_UnixServer"
+
+    def handle(self) -> None:
+        # Clients may send several requests over one connection
+        for line in self.rfile:
+            try:
+                message = decode(line)
+            except ValueError as err:
+                response = error(None, PARSE_ERROR, str(err))
+            else:
+                response = self.server.daemon.handle(message)
+            self.wfile.write(encode(response))
+
+
+class _UnixServer(ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path: Path, daemon: "DaemonServer") -> None:
+        self.daemon = daemon
+        super().__init__(str(socket_path), _RequestHandler)
+
+
+class DaemonServer(object):
+    """Serves commands over a unix socket, from a long-running process.
+
+    Requests are JSON-RPC 2.0 objects, one per line. The container index, parsed
+    files and machine state stay in memory between requests, kept current by a
+    ContainerWatcher. Each request gets its own manager on top of them.
+
+    Commands which change containers take the same file locks as they do outside the
+    daemon, which also serialise the daemon's own threads. Reads never wait for them.
+    """
+
+    def __init__(
+        self,
+        unit_file_dir: Path,
+        socket_path: Optional[Path] = None,
+        cache: Optional[PersistentCache] = None,
+        machine_state: Optional[MachineStateSnapshot] = None,
+        watcher: Optional[ContainerWatcher] = None,
+    ) -> None:
+        self.unit_file_dir = unit_file_dir
+        self.socket_path = socket_path or DAEMON_SOCKET
+        self.cache = cache or PersistentCache()
+        self.machine_state = machine_state or MachineStateSnapshot()
+        self.watcher = watcher or ContainerWatcher(unit_file_dir, self.cache, self.machine_state)
+        # Number of requests served
+        self.requests = 0
+
+        self.__server: Optional[_UnixServer] = None
+        self.__logger = getLogger("nixos_nspawn.daemon")
+
+    def bind(self) -> None:
+        """Creates the socket. Only the daemon's own user may connect to it."""
+        if self.socket_path.is_socket():
+            from .client import DaemonClient
+
+            try:
+                DaemonClient(self.socket_path).ping()
+            except DaemonUnavailableError:
+                # Left behind by a daemon which did not exit cleanly
+                self.socket_path.unlink()
+            else:
+                raise DaemonError(0, f"A daemon is already serving on {self.socket_path}")
+
+        self.socket_path.parent.mkdir(mode=0o755, parents=True, exist_ok=True)
+        umask = os.umask(0o077)
+        try:
+            self.__server = _UnixServer(self.socket_path, self)
+        finally:
+            os.umask(umask)
+
+    def serve_forever(self) -> None:
+        if self.__server is None:
+            self.bind()
+        assert self.__server is not None
+
+        self.watcher.start()
+        self.__logger.info("Serving on %s", self.socket_path)
+        try:
+            self.__server.serve_forever()
+        finally:
+            self.watcher.stop()
+            self.__server.server_close()
+            self.socket_path.unlink(missing_ok=True)
+            self.cache.save()
+
+    def shutdown(self) -> None:
+        """Stops serve_forever. Must be called from another thread."""
+        if self.__server is not None:
+            self.__server.shutdown()
+
+    def handle(self, message: dict) -> dict:
+        """Handles one request and returns the response"""
+        request_id = message.get("id")
+        method = message.get("method")
+        params = message.get("params") or {}
+        if not isinstance(method, str) or not isinstance(params, dict):
+            return error(request_id, INVALID_REQUEST, "Expected a method name and named params")
+
+        self.requests += 1
+        try:
+            if method == "ping":
+                return result(request_id, {"version": version, "pid": os.getpid()})
+            if method == "run":
+                args = params.get("args")
+                if not isinstance(args, list) or not all(isinstance(arg, str) for arg in args):
+                    return error(request_id, INVALID_PARAMS, "args must be a list of strings")
+                environment = params.get("environment") or {}
+                if not isinstance(environment, dict):
+                    return error(request_id, INVALID_PARAMS, "environment must be an object")
+                return result(
+                    request_id,
+                    self.run(
+                        args,
+                        cwd=str(params.get("cwd", "/")),
+                        color=bool(params.get("color", False)),
+                        width=width if isinstance(width := params.get("width"), int) else None,
+                        environment=environment,
+                    ),
+                )
+        except DaemonError as err:
+            return error(request_id, err.code, str(err))
+        except Exception as err:
+            self.__logger.exception("Failed to handle %s", method)
+            return error(request_id, INTERNAL_ERROR, str(err))
+
+        return error(request_id, METHOD_NOT_FOUND, f"Unknown method {method}")
+
+    @contextmanager
+    def _capture_logs(self, verbose: bool) -> Generator[StringIO, None, None]:
+        """Collects what this thread, and the workers it starts, log while the block runs,
+        to send to the client"""
+        request = next(_request_ids)
+        token = _request.set(request)
+        output = StringIO()
+        handler = StreamHandler(output)
+        handler.setLevel(DEBUG if verbose else INFO)
+        handler.setFormatter(PlainFormatter("%(name)s: %(message)s"))
+        handler.addFilter(_RequestFilter(request))
+        handler.addFilter(ContainerLogFilter())
+
+        logger = getLogger("nixos_nspawn")
+        logger.addHandler(handler)
+        try:
+            yield output
+        finally:
+            logger.removeHandler(handler)
+            _request.reset(token)
+
+    def run(
+        self,
+        args: list[str],
+        cwd: str = "/",
+        color: bool = False,
+        width: Optional[int] = None,
+        environment: Optional[dict[str, Optional[str]]] = None,
+    ) -> dict:
+        """Runs a command line, without the program name, as the CLI would.
+        environment holds the client's values of BUILD_ENVIRONMENT, unset if missing."""
+        # Imported here, since main imports the client
+        from ..main import execute, parse_args
+
+        try:
+            parsed_args = parse_args(args)
+        except SystemExit as parser_exit:
+            return {"exit_code": int(parser_exit.code or 0), "stdout": "", "stderr": ""}
+
+        handler = parsed_args.handler
+        if not getattr(handler, "remote", False):
+            raise DaemonUnavailableError(f"{handler.name} is not run by the daemon")
+        if parsed_args.unit_file_dir.resolve() != self.unit_file_dir.resolve():
+            raise DaemonUnavailableError(f"Only serving containers in {self.unit_file_dir}")
+        mutates = getattr(handler, "mutates", False)
+        if mutates:
+            # Builds read these from the process environment, which is the daemon's
+            environment = environment or {}
+            for name in BUILD_ENVIRONMENT:
+                if environment.get(name) != os.environ.get(name):
+                    raise DaemonUnavailableError(f"{name} differs from the daemon's")
+
+        absolute_arguments(parsed_args, cwd)
+        if not self.watcher.live:
+            self.machine_state.refresh()
+
+        mgr = NixosNspawnManager(
+            self.unit_file_dir,
+            show_trace=parsed_args.verbose,
+            machine_state=self.machine_state,
+            cache=self.cache,
+            locks=FileLocks(timeout=parsed_args.lock_timeout),
+        )
+        mgr.load(self.watcher.names())
+
+        command = handler(parsed_args, mgr)
+        command.output = StringIO()
+        if not getattr(parsed_args, "json", False):
+            from rich.console import Console
+
+            command.console = Console(
+                file=command.output, force_terminal=color, no_color=not color, width=width
+            )
+
+        with self._capture_logs(parsed_args.verbose) as logs:
+            try:
+                exit_code = execute(command, parsed_args.verbose)
+            finally:
+                mgr.close()
+                if mutates:
+                    # So that the next request sees the change, even if inotify hasn't yet
+                    self.watcher.rescan()
+
+        return {
+            "exit_code": exit_code,
+            "stdout": command.output.getvalue(),
+            "stderr": logs.getvalue(),
+        }
@@ -0,0 +1,207 @@
+from collections.abc import Callable
+from logging import getLogger
+from os import scandir
+from pathlib import Path
+from threading import Event, Lock, Thread
+from typing import Optional
+
+from ..constants import DECLARATIVE_CONFIG_DIR, MACHINED_STATE_DIR, NIX_PROFILE_DIR
+from ..utilities import MachineStateSnapshot, PersistentCache
+from ..utilities.inotify import (
+    IN_CREATE,
+    IN_DELETE,
+    IN_DIR_CHANGES,
+    IN_ISDIR,
+    IN_MOVED_FROM,
+    IN_MOVED_TO,
+    IN_ONLYDIR,
+    IN_Q_OVERFLOW,
+    Inotify,
+    InotifyEvent,
+    InotifyUnavailableError,
+)
+
+# How often the watcher thread checks whether it should stop
+STOP_CHECK_INTERVAL = 1.0
+
+UNIT_SUFFIX = ".nspawn"
+
+# What changed about a container, as passed to listeners
+CHANGE_UNIT = "unit"
+CHANGE_MACHINE = "machine"
+CHANGE_PROFILE = "profile"
+CHANGE_CONFIG = "config"
+# Changes were missed. Everything may have changed.
+CHANGE_ALL = "all"
+
+# Called with the kind of change and the container's name ("" for CHANGE_ALL)
+ChangeListener = Callable[[str, str], None]
+
+
+class ContainerWatcher(object):
+    """Keeps the index of containers and their cached state current with inotify.
+
+    The unit file directory is watched for containers being added and removed,
+    the profile and declarative config directories for containers changing, and
+    machined's state directory for machines starting and stopping.
+
+    Without inotify, the index is rescanned and the machine state refreshed on
+    every request instead (see live).
+    """
+
+    def __init__(
+        self,
+        unit_file_dir: Path,
+        cache: PersistentCache,
+        machine_state: MachineStateSnapshot,
+        profile_dir: Optional[Path] = None,
+        declarative_dir: Optional[Path] = None,
+        machined_dir: Optional[Path] = None,
+        listener: Optional[ChangeListener] = None,
+    ) -> None:
+        self.unit_file_dir = unit_file_dir
+        self.cache = cache
+        self.machine_state = machine_state
+        self.profile_dir = profile_dir or NIX_PROFILE_DIR
+        self.declarative_dir = declarative_dir or DECLARATIVE_CONFIG_DIR
+        self.machined_dir = machined_dir or MACHINED_STATE_DIR
+        # Called from the watching thread after each change is applied
+        self.listener = listener
+
+        self.__names: set[str] = set()
+        self.__lock = Lock()
+        self.__inotify: Optional[Inotify] = None
+        self.__thread: Optional[Thread] = None
+        self.__stop = Event()
+        self.__logger = getLogger("nixos_nspawn.daemon.watcher")
+
+    @property
+    def live(self) -> bool:
+        """True if changes are picked up as they happen"""
+        return self.__inotify is not None
+
+    def names(self) -> list[str]:
+        """Names of all containers with a unit file"""
+        if not self.live:
+            self.rescan()
+        with self.__lock:
+            return sorted(self.__names)
+
+    def rescan(self) -> None:
+        """Re-reads the unit file directory in full"""
+        names = set()
+        try:
+            with scandir(self.unit_file_dir) as entries:
+                for entry in entries:
+                    if entry.name.endswith(UNIT_SUFFIX):
+                        names.add(entry.name[: -len(UNIT_SUFFIX)])
+        except FileNotFoundError:
+            self.__logger.debug("%s does not exist", self.unit_file_dir)
+
+        with self.__lock:
+            self.__names = names
+
+    def open(self) -> None:
+        """Starts watching, without a thread. Call poll() to process changes."""
+        try:
+            self.__inotify = Inotify()
+        except InotifyUnavailableError as err:
+            self.__logger.warning("Changes will be rescanned on every request: %s", err)
+            self.rescan()
+            return
+
+        for path in (self.unit_file_dir, self.declarative_dir, self.machined_dir):
+            self._watch(path)
+        if self._watch(self.profile_dir):
+            with scandir(self.profile_dir) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        self._watch(Path(entry.path))
+
+        # After the watches are in place, so that nothing is missed in between
+        self.rescan()
+
+    def start(self) -> None:
+        """Starts watching in a background thread"""
+        self.open()
+        if self.live:
+            self.__stop.clear()
+            self.__thread = Thread(target=self._run, name="container-watcher", daemon=True)
+            self.__thread.start()
+
+    def stop(self) -> None:
+        self.__stop.set()
+        if self.__thread is not None:
+            self.__thread.join()
+            self.__thread = None
+        if self.__inotify is not None:
+            self.__inotify.close()
+            self.__inotify = None
+
+    def _watch(self, path: Path) -> bool:
+        assert self.__inotify is not None
+        try:
+            self.__inotify.add_watch(path, IN_DIR_CHANGES | IN_ONLYDIR)
+        except (FileNotFoundError, NotADirectoryError):
+            self.__logger.debug("Not watching %s, it does not exist", path)
+            return False
+        return True
+
+    def _run(self) -> None:
+        while not self.__stop.is_set():
+            try:
+                self.poll(STOP_CHECK_INTERVAL)
+            except Exception:
+                self.__logger.exception("Failed to process changes")
+
+    def poll(self, timeout: Optional[float] = 0) -> int:
+        """Processes the changes made since the last poll, and returns their number"""
+        if self.__inotify is None:
+            return 0
+
+        events = self.__inotify.read_events(timeout)
+        for event in events:
+            self._handle(event)
+        return len(events)
+
+    def _changed(self, kind: str, name: str) -> None:
+        if self.listener is not None:
+            self.listener(kind, name)
+
+    def _handle(self, event: InotifyEvent) -> None:
+        if event.mask & IN_Q_OVERFLOW:
+            self.__logger.warning("Missed some changes, refreshing everything")
+            self.rescan()
+            self.cache.invalidate()
+            self.machine_state.refresh()
+            self._changed(CHANGE_ALL, "")
+            return
+
+        removed = bool(event.mask & (IN_DELETE | IN_MOVED_FROM))
+        if event.watch == self.unit_file_dir and event.name.endswith(UNIT_SUFFIX):
+            name = event.name[: -len(UNIT_SUFFIX)]
+            with self.__lock:
+                if removed:
+                    self.__names.discard(name)
+                else:
+                    self.__names.add(name)
+            self.cache.invalidate(name)
+            self._changed(CHANGE_UNIT, name)
+        elif event.watch == self.machined_dir:
+            # Skip the unit:* links and temporary files
+            if ":" not in event.name and not event.name.startswith("."):
+                self.machine_state.refresh(event.name)
+                self._changed(CHANGE_MACHINE, event.name)
+        elif event.watch == self.declarative_dir and event.name.endswith(".json"):
+            name = event.name[: -len(".json")]
+            self.cache.invalidate(name)
+            self._changed(CHANGE_CONFIG, name)
+        elif event.watch == self.profile_dir:
+            if event.mask & IN_ISDIR and event.mask & (IN_CREATE | IN_MOVED_TO):
+                self._watch(event.path)
+            self.cache.invalidate(event.name)
+            self._changed(CHANGE_PROFILE, event.name)
+        elif event.watch.parent == self.profile_dir:
+            # A generation was added, removed or switched to
+            self.cache.invalidate(event.watch.name)
+            self._changed(CHANGE_PROFILE, event.watch.name)
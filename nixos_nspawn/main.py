@@ -1,18 +1,18 @@
 import logging
 import sys
-from argparse import ArgumentParser
+from argparse import ArgumentParser, Namespace
+from os import getenv
 from pathlib import Path
-
-from rich.logging import RichHandler
-from rich.traceback import install as install_rich
+from typing import Optional
 
 from nixos_nspawn import commands, constants, manager, metadata, models, utilities
 
 
-def create_parser() -> ArgumentParser:
+def _create_global_parser(add_help: bool = True) -> ArgumentParser:
     parser = ArgumentParser(
         prog="nixos-nspawn",
         description=f"NixOS imperative container manager v{metadata.version}",
+        add_help=add_help,
     )
 
     parser.add_argument(
@@ -28,10 +28,53 @@ def create_parser() -> ArgumentParser:
         action="store_true",
         default=False,
     )
+    parser.add_argument(
+        "--trace",
+        help="Write a Chrome trace of where the time went to this file."
+        " It can be opened in Perfetto or chrome://tracing",
+        metavar="FILE",
+        type=Path,
+        default=None,
+    )
+    parser.add_argument(
+        "--lock-timeout",
+        help="Seconds to wait for another nixos-nspawn to finish changing a container"
+        f" before giving up. Default: {utilities.DEFAULT_LOCK_TIMEOUT:g}",
+        metavar="SECONDS",
+        type=float,
+        default=utilities.DEFAULT_LOCK_TIMEOUT,
+    )
+    parser.add_argument(
+        "--timings",
+        help="Print a summary of where the time went to stderr",
+        action="store_true",
+        default=False,
+    )
+    return parser
+
+
+def _selected_command(args: list[str]) -> Optional[str]:
+    """Finds the command named on the command line, without loading any commands"""
+    _, remaining = _create_global_parser(add_help=False).parse_known_args(args)
+    for arg in remaining:
+        if not arg.startswith("-"):
+            return arg if arg in commands.COMMAND_MODULES else None
+    return None
+
+
+def create_parser(selected: Optional[str] = None) -> ArgumentParser:
+    """Builds the argument parser. If a command is selected, only that
+    command's module is imported. The others are listed by name only."""
+    parser = _create_global_parser()
     subparsers = parser.add_subparsers(dest="command", help="Command to execute", required=True)
 
     # Register all the commands
-    for command in commands.COMMANDS:
+    for name in commands.COMMAND_MODULES:
+        if selected and name != selected:
+            subparsers.add_parser(name)
+            continue
+
+        command = commands.get_command(name)
         cmd_parser = subparsers.add_parser(
             command.name, help=command.__doc__, description=command.__doc__
         )
@@ -41,33 +84,49 @@ def create_parser() -> ArgumentParser:
     return parser
 
 
-def main(args: list[str]) -> int:
-    parser = create_parser()
+def _configure_logging(verbose: bool, json: bool) -> None:
+    level = logging.DEBUG if verbose else logging.INFO
+    if json:
+        # Keep rich out of JSON runs entirely. Logs still go to stderr.
+        handler = logging.StreamHandler()
+        handler.setFormatter(utilities.PlainFormatter("%(name)s: %(message)s"))
+        handler.addFilter(utilities.ContainerLogFilter())
+        logging.basicConfig(level=level, handlers=[handler])
+        return
 
-    parsed_args = parser.parse_args(args[1:])
+    from rich.logging import RichHandler
+    from rich.traceback import install as install_rich
 
-    # Configure the logger
+    handler = RichHandler(show_time=False, show_level=False, markup=True, show_path=False)
+    handler.addFilter(utilities.ContainerLogFilter())
     logging.basicConfig(
-        level=logging.DEBUG if parsed_args.verbose else logging.INFO,
+        level=level,
         format="[dim]%(name)s:[/dim] %(message)s",
         datefmt="[%X]",
-        handlers=[RichHandler(show_time=False, show_level=False, markup=True, show_path=False)],
+        handlers=[handler],
     )
-    logger = logging.getLogger("nixos_nspawn")
 
     # Use rich for trace handling
-    install_rich(max_frames=20 if parsed_args.verbose else 3)
+    install_rich(max_frames=20 if verbose else 3)
 
-    # Prepare the manager
-    mgr = manager.NixosNspawnManager(parsed_args.unit_file_dir, show_trace=parsed_args.verbose)
 
-    # Run the command that was selected
-    handler: type[commands.Command] = parsed_args.handler
+def parse_args(args: list[str]) -> Namespace:
+    """Parses a command line, without the program name. Exits on invalid arguments."""
+    return create_parser(_selected_command(args)).parse_args(args)
+
+
+def execute(command: commands.Command, verbose: bool = False) -> int:
+    """Runs a command, and turns the errors it may raise into exit codes"""
+    logger = logging.getLogger("nixos_nspawn")
 
     try:
-        return handler(parsed_args, mgr).run()
-    except (models.ContainerError, manager.NixosNspawnManagerError) as app_err:
-        logger.fatal("[red]%s[/red]", app_err, exc_info=parsed_args.verbose)
+        return command.run()
+    except (
+        models.ContainerError,
+        manager.NixosNspawnManagerError,
+        utilities.LockTimeoutError,
+    ) as app_err:
+        logger.fatal("[red]%s[/red]", app_err, exc_info=verbose)
         # Distinguishable return code from other exceptions
         return 10
     except utilities.CommandError as cmd_err:
@@ -76,7 +135,7 @@ def main(args: list[str]) -> int:
             " ".join(cmd_err.command),
             cmd_err.exit_code,
             cmd_err,
-            exc_info=parsed_args.verbose,
+            exc_info=verbose,
         )
         return 11
     except PermissionError as perms_err:
@@ -84,11 +143,83 @@ def main(args: list[str]) -> int:
             "[red]Encountered a '%s' error whilst accessing '%s'[/red]",
             perms_err.strerror,
             perms_err.filename,
-            exc_info=parsed_args.verbose,
+            exc_info=verbose,
         )
         return 1
 
 
+def _run_in_daemon(args: list[str], handler: type[commands.Command]) -> Optional[int]:
+    """Runs the command in the daemon if one is serving, and returns its exit code.
+    Returns None if the command should be run here instead."""
+    if getenv("NIXOS_NSPAWN_DAEMON", "auto").lower() == "off":
+        return None
+    if not constants.DAEMON_SOCKET.is_socket():
+        return None
+
+    from nixos_nspawn.daemon import DaemonClient, DaemonError, DaemonUnavailableError
+
+    logger = logging.getLogger("nixos_nspawn")
+    try:
+        return DaemonClient(constants.DAEMON_SOCKET).run(args)
+    except DaemonUnavailableError as err:
+        logger.debug("Not using the daemon: %s", err)
+        return None
+    except DaemonError as err:
+        if getattr(handler, "mutates", False):
+            # It may have been partially applied, so it must not be run twice
+            logger.fatal("[red]The daemon failed to run the command: %s[/red]", err)
+            return 1
+        logger.warning("The daemon failed to run the command, running it here: %s", err)
+        return None
+
+
+def _report_trace(trace_file: Optional[Path], timings: bool) -> None:
+    if trace_file:
+        utilities.tracer.write(trace_file)
+    if timings:
+        sys.stderr.write(utilities.format_timings(utilities.tracer))
+
+
+def main(args: list[str]) -> int:
+    try:
+        parsed_args = parse_args(args[1:])
+    except SystemExit as parser_exit:
+        # --help, or invalid arguments
+        return int(parser_exit.code or 0)
+
+    _configure_logging(parsed_args.verbose, getattr(parsed_args, "json", False))
+
+    # Run the command that was selected
+    handler: type[commands.Command] = parsed_args.handler
+
+    tracing = parsed_args.trace is not None or parsed_args.timings
+    # The daemon's time isn't ours to trace, so traced commands always run here
+    if getattr(handler, "remote", False) and not tracing:
+        if (exit_code := _run_in_daemon(args[1:], handler)) is not None:
+            return exit_code
+
+    # Prepare the manager
+    mgr = manager.NixosNspawnManager(
+        parsed_args.unit_file_dir,
+        show_trace=parsed_args.verbose,
+        locks=utilities.FileLocks(timeout=parsed_args.lock_timeout),
+    )
+
+    if tracing:
+        utilities.tracer.enable()
+
+    try:
+        with utilities.span(handler.name, utilities.CATEGORY_COMMAND):
+            try:
+                return execute(handler(parsed_args, mgr), parsed_args.verbose)
+            finally:
+                mgr.close()
+    finally:
+        if tracing:
+            _report_trace(parsed_args.trace, parsed_args.timings)
+            utilities.tracer.disable()
+
+
 def main_with_args() -> int:
     return main(sys.argv)
 
@@ -1,43 +1,198 @@
+import re
+from collections.abc import Callable, Iterable, Mapping, Sequence
+from contextlib import AbstractContextManager, ExitStack
+from functools import partial
+from json import dumps, loads
 from logging import getLogger
-from os import sync
+from os import getenv, scandir
+from os.path import lexists
 from pathlib import Path
+from tempfile import TemporaryDirectory
+from time import monotonic, sleep
 from typing import Optional
 
-from ..constants import DEFAULT_NSPAWN_DIR
+from ..backends import Backend, HostActions, lazy_backend
+from ..constants import DEFAULT_BATCH_EVAL_SCRIPT, DEFAULT_NSPAWN_DIR
 from ..metadata import default_system
-from ..models import Container
+from ..models import (
+    DEFAULT_POWEROFF_TIMEOUT,
+    DEFAULT_START_TIMEOUT,
+    STATUS_FAILED,
+    STATUS_UNCHANGED,
+    Container,
+    ContainerError,
+    GcResult,
+    OperationResult,
+)
+from ..utilities import (
+    CATEGORY_FILESYSTEM,
+    DEFAULT_COPY_JOBS,
+    STATE_POWERED_OFF,
+    CommandError,
+    FileLocks,
+    LockTimeoutError,
+    MachineStateSnapshot,
+    PersistentCache,
+    Trash,
+    command_stats,
+    run_command,
+    traced,
+)
+
+# Summary printed by nix-store --gc, e.g. "12 store paths deleted, 345.67 MiB freed"
+STORE_GC_PATTERN = re.compile(r"(\d+) store paths deleted, ([\d.]+) (\w+) freed")
+
+BYTE_UNITS = {"bytes": 1, "KiB": 1 << 10, "MiB": 1 << 20, "GiB": 1 << 30, "TiB": 1 << 40}
+
+# Flake references pinned to an exact revision or content hash
+LOCKED_FLAKE_PATTERN = re.compile(
+    r"[?&](rev|narHash)=|^(github|gitlab|sourcehut):[^/]+/[^/?]+/[0-9a-f]{40}"
+)
+
+ACTION_START = "start"
+ACTION_STOP = "stop"
+ACTION_REBOOT = "reboot"
+POWER_ACTIONS = (ACTION_START, ACTION_STOP, ACTION_REBOOT)
+
+# Containers started, stopped or rebooted at once. Most of the time is spent waiting.
+DEFAULT_POWER_JOBS = 32
+
+DEFAULT_POWER_RETRIES = 2
+
+# Seconds before the first retry of a failed power action. Doubles for each retry.
+POWER_RETRY_BACKOFF = 1.0
 
 
 class NixosNspawnManagerError(BaseException): ...
 
 
 class NixosNspawnManager(object):
-    def __init__(self, unit_file_dir: Path = DEFAULT_NSPAWN_DIR, show_trace: bool = False) -> None:
+    def __init__(
+        self,
+        unit_file_dir: Path = DEFAULT_NSPAWN_DIR,
+        show_trace: bool = False,
+        backend: Optional[Backend] = None,
+        machine_state: Optional[MachineStateSnapshot] = None,
+        cache: Optional[PersistentCache] = None,
+        locks: Optional[FileLocks] = None,
+        trash: Optional[Trash] = None,
+    ) -> None:
         self.unit_file_dir = unit_file_dir
         self.show_trace = show_trace
+        # One backend, and therefore one bus connection, for all containers
+        self.backend = backend or lazy_backend()
+        # Held while changing a container, or reloading host-wide services
+        self.locks = locks or FileLocks()
+        # Every change made to the host on behalf of any container
+        self.host_actions = HostActions(self.backend, self.locks)
+        # State directories of removed containers, deleted after remove() returns
+        self.trash = trash or Trash()
 
-        self.__containers: list[Container] = []
+        # Containers by name. Entries are None until the Container is first used.
+        self.__containers: dict[str, Optional[Container]] = {}
+        self.__indexed = False
+        # Runtime state of all machines, collected at most once per refresh
+        self.machine_state = machine_state or MachineStateSnapshot()
+        # Parsed profile data and unit files, persisted across invocations
+        self.cache = cache or PersistentCache()
+        # Wall time, exit code and output size of every command run
+        self.command_stats = command_stats
         self.__logger = getLogger("nixos_nspawn.manager")
-        self.load()
 
-    def load(self) -> None:
-        """Load existing containers from the filesystem. Required to initialise this class"""
-        self.__containers = [
-            Container.from_unit_file(unit_file) for unit_file in self.unit_file_dir.glob("*.nspawn")
-        ]
+    @traced()
+    def load(self, names: Optional[Iterable[str]] = None) -> None:
+        """Index existing containers from the filesystem.
+
+        Called automatically the first time all containers are needed.
+        Call it again to pick up containers added or removed by other processes.
+        If names are given, they are indexed instead of scanning the unit file directory.
+        """
+        previous = self.__containers
+        self.__containers = {}
+        if names is not None:
+            self.__containers = {name: previous.get(name) for name in names}
+            self.__indexed = True
+            return
+
+        try:
+            with scandir(self.unit_file_dir) as entries:
+                for entry in entries:
+                    if entry.name.endswith(".nspawn"):
+                        name = entry.name[: -len(".nspawn")]
+                        self.__containers[name] = previous.get(name)
+        except FileNotFoundError:
+            self.__logger.debug("%s does not exist", self.unit_file_dir)
+
+        self.__indexed = True
         self.__logger.debug(
-            "Loaded %s containers from %s", len(self.__containers), self.unit_file_dir
+            "Indexed %s containers from %s", len(self.__containers), self.unit_file_dir
         )
 
+    def _unit_file(self, name: str) -> Path:
+        return self.unit_file_dir / f"{name}.nspawn"
+
+    def _materialise(self, name: str) -> Container:
+        if (container := self.__containers.get(name)) is None:
+            container = Container.from_unit_file(
+                self._unit_file(name),
+                machine_state=self.machine_state,
+                backend=self.backend,
+                cache=self.cache,
+                host=self.host_actions,
+            )
+            self.__containers[name] = container
+        return container
+
+    def batch(self) -> AbstractContextManager[None]:
+        """Coalesces the host-wide syncs and reloads of everything done within it.
+        Each is performed once, right before the first start or reload which needs it."""
+        return self.host_actions.batch()
+
+    def names(self) -> list[str]:
+        """Names of all containers, without loading any of them"""
+        if not self.__indexed:
+            self.load()
+        return sorted(self.__containers)
+
+    def close(self) -> None:
+        """Persists anything worth keeping for the next invocation, and closes
+        the backend's connections"""
+        self.cache.save()
+        self.backend.close()
+        for program, totals in self.command_stats.totals.items():
+            self.__logger.debug(
+                "Ran %s %d times in %.3fs, %d failed",
+                program,
+                totals["count"],
+                totals["elapsed"],
+                totals["failed"],
+            )
+        for kind, totals in self.locks.stats.totals.items():
+            self.__logger.debug(
+                "Took %d %s locks, waiting %.3fs for %d of them, %d timed out",
+                totals["count"],
+                kind,
+                totals["waited"],
+                totals["contended"],
+                totals["timeouts"],
+            )
+
+    def refresh_state(self) -> None:
+        """Discard the runtime state snapshot so that it is re-read on next access"""
+        self.machine_state.refresh()
+
     def get(self, name: str) -> Optional[Container]:
-        for container in self.__containers:
-            if container.name == name:
-                return container
+        # Single lookups check for the unit file directly rather than scanning the directory
+        if name not in self.__containers:
+            if "/" in name or not lexists(self._unit_file(name)):
+                return None
+
+        return self._materialise(name)
 
     def list(self) -> list[Container]:
-        # Avoid a reference pass of our internal containers list
-        return list(self.__containers)
+        return [self._materialise(name) for name in self.names()]
 
+    @traced(CATEGORY_FILESYSTEM)
     def _check_network_zone(self, container: Container) -> None:
         # Check that the virtual network zone exists
         if (zone := container.profile_data.get("zone")) and not (
@@ -46,6 +201,50 @@ class NixosNspawnManager(object):
             self.__logger.debug("Could not find %s", zone_path)
             raise NixosNspawnManagerError(f"Virtual zone '{zone}' does not exist!")
 
+    def _build_fingerprint(
+        self,
+        profile: Optional[Path] = None,
+        flake: Optional[str] = None,
+        system: str = default_system,
+    ) -> Optional[str]:
+        """Identifies build inputs which always produce the same system.
+
+        Only pre-built profiles and locked flake references qualify. Anything
+        else may change without its reference changing, so it must be built.
+        """
+        if profile:
+            return f"profile:{profile.resolve()}"
+        if flake and LOCKED_FLAKE_PATTERN.search(flake.split("#")[0]):
+            return f"flake:{Container.flake_installable(flake, system)}"
+        return None
+
+    def _expected_system(self, container: Container, fingerprint: Optional[str]) -> Optional[Path]:
+        """The system a build with the given fingerprint will produce, if known beforehand"""
+        if fingerprint is None:
+            return None
+        if fingerprint.startswith("profile:"):
+            return Path(fingerprint[len("profile:") :])
+        if built := self.cache.get(container.name, "build_input", fingerprint):
+            return Path(built)
+        return None
+
+    def _remember_build(self, container: Container, fingerprint: Optional[str]) -> None:
+        if fingerprint and (system_path := container.system_path):
+            self.cache.put(container.name, "build_input", fingerprint, str(system_path))
+
+    def is_unchanged(
+        self,
+        container: Container,
+        profile: Optional[Path] = None,
+        flake: Optional[str] = None,
+        system: str = default_system,
+    ) -> bool:
+        """True if building the given inputs is known to reproduce the current system"""
+        current = container.system_path
+        expected = self._expected_system(container, self._build_fingerprint(profile, flake, system))
+        return current is not None and current == expected
+
+    @traced()
     def build(
         self,
         container: Container,
@@ -62,12 +261,15 @@ class NixosNspawnManager(object):
                 flake, system=system, update=update, show_trace=self.show_trace
             )
         elif profile:
+            # Built elsewhere, possibly moments ago and not yet on disk
+            self.host_actions.durable.add_filesystem(profile)
             return container.build_from_profile(profile, update=update)
 
         raise AssertionError(
             "Either a config, flake, or profile must be specified when calling build()"
         )
 
+    @traced()
     def create(
         self,
         name: str,
@@ -75,81 +277,636 @@ class NixosNspawnManager(object):
         profile: Optional[Path] = None,
         flake: Optional[str] = None,
         system: str = default_system,
+        exist_ok: bool = False,
     ) -> Container:
-        container = Container(unit_file=self.unit_file_dir / f"{name}.nspawn")
+        """Creates a container. With exist_ok, an existing container whose system is
+        known to be identical to the requested one is returned untouched."""
+        with self.locks.container(name):
+            if existing := self.get(name):
+                if exist_ok and self.is_unchanged(existing, profile, flake, system):
+                    self.__logger.info("Container [bold]%s[/bold] is unchanged", name)
+                    return existing
+                raise NixosNspawnManagerError(f"Container [bold]{name}[/bold] already exists!")
+
+            container = Container(
+                unit_file=self._unit_file(name),
+                machine_state=self.machine_state,
+                backend=self.backend,
+                cache=self.cache,
+                host=self.host_actions,
+            )
+
+            self.__logger.debug(
+                "Creating container [bold]%s[/bold] with config '%s'",
+                name,
+                config or flake or profile,
+            )
+
+            try:
+                self.build(container, config, profile, flake, system)
+                self._remember_build(container, self._build_fingerprint(profile, flake, system))
+                self._check_network_zone(container)
+                container.write_config_files()
+                container.create_state_directories()
+                self.host_actions.sync(container.name)
+                container.start()
+
+            except (Exception, ContainerError) as err:
+                # If the build or start fails, ensure nothing is left behind.
+                self._discard(container)
+                raise err
+
+            self.__containers[name] = container
+
+            return container
+
+    def _discard(self, container: Container, delete_state: bool = False) -> None:
+        """Undoes a create or clone which failed part way, including one which started
+        the container but timed out waiting for it."""
+        try:
+            self.machine_state.refresh(container.name)
+            if container.state != STATE_POWERED_OFF:
+                container.poweroff()
+        except (Exception, ContainerError) as err:
+            self.__logger.warning(
+                "Cannot power off [bold]%s[/bold] after it failed: %s", container.name, err
+            )
+        container.destroy(delete_state=delete_state)
+
+    @traced()
+    def clone(
+        self,
+        source: Container,
+        name: str,
+        config: Optional[Path] = None,
+        profile: Optional[Path] = None,
+        flake: Optional[str] = None,
+        system: str = default_system,
+        jobs: int = DEFAULT_COPY_JOBS,
+    ) -> tuple[Container, Optional[str]]:
+        """Creates a container from the given configuration, starting from a copy of the
+        state of source. Returns the container, and how its state was copied.
+
+        Systems embed the name of their container, in their unit files, hostname and
+        state directory, so source's own system can't be reused.
+        """
+        # Always in the same order, so that two clones can't each wait for the other
+        with ExitStack() as held:
+            for locked in sorted({source.name, name}):
+                held.enter_context(self.locks.container(locked))
+
+            if self.get(name):
+                raise NixosNspawnManagerError(f"Container [bold]{name}[/bold] already exists!")
+            if source.state != STATE_POWERED_OFF:
+                self.__logger.warning(
+                    "Container [bold]%s[/bold] is running, so its state may be copied"
+                    " part way through a change",
+                    source.name,
+                )
+
+            container = Container(
+                unit_file=self._unit_file(name),
+                machine_state=self.machine_state,
+                backend=self.backend,
+                cache=self.cache,
+                host=self.host_actions,
+            )
+            self.__logger.debug(
+                "Cloning container [bold]%s[/bold] to [bold]%s[/bold] with config '%s'",
+                source.name,
+                name,
+                config or flake or profile,
+            )
+
+            copied = False
+            try:
+                self.build(container, config, profile, flake, system)
+                self._remember_build(container, self._build_fingerprint(profile, flake, system))
+                start = monotonic()
+                method = container.copy_state_from(source, jobs)
+                copied = True
+                if method:
+                    self.__logger.info(
+                        "Copied the state of [bold]%s[/bold] by %s in %.2fs",
+                        source.name,
+                        method,
+                        monotonic() - start,
+                    )
+                self._check_network_zone(container)
+                container.write_config_files()
+                container.create_state_directories()
+                self.host_actions.sync(container.name)
+                container.start()
+
+            except (Exception, ContainerError) as err:
+                # Only a state directory this copied is removed
+                self._discard(container, delete_state=copied)
+                raise err
 
-        if container in self.__containers:
-            raise NixosNspawnManagerError(f"Container [bold]{name}[/bold] already exists!")
+            self.__containers[name] = container
+            return container, method
 
+    @traced()
+    def update(
+        self,
+        container: Container,
+        config: Optional[Path] = None,
+        profile: Optional[Path] = None,
+        flake: Optional[str] = None,
+        system: str = default_system,
+        activation_strategy: Optional[str] = None,
+    ) -> bool:
+        """Updates a container. Returns False if its system was unchanged,
+        in which case nothing on the host was touched."""
         self.__logger.debug(
-            "Creating container [bold]%s[/bold] with config '%s'",
-            name,
+            "Updating container [bold]%s[/bold] with config '%s'. Activation strategy override: %s",
+            container.name,
             config or flake or profile,
+            activation_strategy,
         )
 
-        try:
-            self.build(container, config, profile, flake, system)
+        with self.locks.container(container.name):
+            previous = container.system_path
+            fingerprint = self._build_fingerprint(profile, flake, system)
+            if previous is None or previous != self._expected_system(container, fingerprint):
+                self.build(container, config, profile, flake, system, update=True)
+                self._remember_build(container, fingerprint)
+
+            if container.system_path == previous:
+                self.__logger.info("Container [bold]%s[/bold] is unchanged", container.name)
+                return False
+
             self._check_network_zone(container)
             container.write_config_files()
             container.create_state_directories()
-            sync()
-            container.start()
+            self.host_actions.sync(container.name)
 
-        except Exception as err:
-            # If the build fails, ensure nothing is left behind.
-            container.destroy()
-            raise err
+            container.activate_config(activation_strategy, previous=previous)
+            return True
 
-        self.__containers.append(container)
+    def _build_flakes(
+        self,
+        containers: Sequence[Container],
+        flake: str,
+        system: str,
+        out_link: Optional[Path] = None,
+    ) -> dict[str, Path]:
+        """Realises many flake installables with a single nix build"""
+        installables = [
+            Container.flake_installable(flake if "#" in flake else f"{flake}#{c.name}", system)
+            for c in containers
+        ]
+        link_args = ["--out-link", str(out_link)] if out_link else ["--no-link"]
+        args = ["nix", "build", *link_args, "--keep-going", "--json", *installables]
+        if self.show_trace:
+            args.append("--show-trace")
 
-        return container
+        _, stdout = run_command(args, capture_stdout=True)
+        # Results are listed in the same order as the installables
+        return {
+            container.name: Path(result["outputs"]["out"])
+            for container, result in zip(containers, loads(stdout), strict=True)
+        }
 
-    def update(
+    def _build_configs(
         self,
-        container: Container,
+        containers: Sequence[Container],
+        config: Path,
+        system: str,
+        out_link: Optional[Path] = None,
+    ) -> dict[str, Path]:
+        """Realises many NixOS configurations with a single nix-build, sharing nixpkgs"""
+        eval_code = getenv("NIXOS_NSPAWN_BATCH_EVAL", str(DEFAULT_BATCH_EVAL_SCRIPT))
+        nixpkgs = getenv("NIXOS_NSPAWN_NIXPKGS", "<nixpkgs>")
+        # A directory holds one <name>.nix per container, otherwise all share the file
+        batch = [
+            {
+                "name": c.name,
+                "config": str((config / f"{c.name}.nix" if config.is_dir() else config).absolute()),
+            }
+            for c in containers
+        ]
+        args = [
+            "nix-build",
+            eval_code,
+            *(["--out-link", str(out_link)] if out_link else ["--no-out-link"]),
+            "--keep-going",
+            "--arg",
+            "nixpkgs",
+            nixpkgs,
+            "--argstr",
+            "containers",
+            dumps(batch),
+            "--argstr",
+            "system",
+            system,
+        ]
+        if self.show_trace:
+            args.append("--show-trace")
+
+        _, stdout = run_command(args, capture_stdout=True)
+        # mkContainer names each system after its container: /nix/store/<hash>-<name>.
+        # Containers whose system is named otherwise are left out, and reported as failed.
+        paths = {Path(line).name.partition("-")[2]: Path(line) for line in stdout.split()}
+        return {c.name: paths[c.name] for c in containers if c.name in paths}
+
+    @traced()
+    def build_many(
+        self,
+        containers: Sequence[Container],
+        config: Optional[Path] = None,
+        flake: Optional[str] = None,
+        system: str = default_system,
+        gc_roots: Optional[Path] = None,
+    ) -> tuple[dict[str, Path], dict[str, str]]:
+        """Realises the systems of many containers in one Nix invocation.
+
+        Nix evaluates shared inputs once and schedules the builds in parallel.
+        Returns the built store paths and the build errors, both by container name.
+        If gc_roots is given, the systems are linked there so that a garbage collection
+        can't delete them until the caller removes the directory.
+        """
+        if config:
+            builder = partial(self._build_configs, config=config, system=system)
+        elif flake:
+            builder = partial(self._build_flakes, flake=flake, system=system)
+        else:
+            raise AssertionError(
+                "Either a config or flake must be specified when calling build_many()"
+            )
+
+        def build(batch: Sequence[Container], link_name: str) -> dict[str, Path]:
+            return builder(batch, out_link=gc_roots / link_name if gc_roots else None)
+
+        def missing(batch: Sequence[Container], paths: dict[str, Path]) -> dict[str, str]:
+            return {
+                c.name: f"The build did not produce a system named {c.name}"
+                for c in batch
+                if c.name not in paths
+            }
+
+        self.__logger.info("Building %d containers", len(containers))
+        try:
+            paths = build(containers, "batch")
+            return paths, missing(containers, paths)
+        except (CommandError, ContainerError) as err:
+            if len(containers) == 1:
+                return {}, {containers[0].name: str(err)}
+
+        # Something failed. Thanks to --keep-going everything else has been built,
+        # so building one at a time now mostly re-evaluates to find the culprits.
+        self.__logger.info("Batch build failed, building containers individually")
+        paths: dict[str, Path] = {}
+        errors: dict[str, str] = {}
+        for container in containers:
+            try:
+                built = build([container], container.name)
+                paths.update(built)
+                errors.update(missing([container], built))
+            except (CommandError, ContainerError) as err:
+                errors[container.name] = str(err) or f"Failed to build {container.name}"
+
+        return paths, errors
+
+    @traced()
+    def update_many(
+        self,
+        containers: Sequence[Container],
         config: Optional[Path] = None,
         profile: Optional[Path] = None,
         flake: Optional[str] = None,
         system: str = default_system,
         activation_strategy: Optional[str] = None,
-    ) -> None:
+    ) -> Sequence[OperationResult]:
+        """Updates many containers, building all of them at once.
+
+        Each container needs its own configuration, so a profile, a single config file
+        or a flake attribute can only be given for a single container.
+        Failures are reported per container rather than aborting the whole update.
+        """
+        if len(containers) > 1 and (
+            profile or (config and not config.is_dir()) or (flake and "#" in flake)
+        ):
+            raise NixosNspawnManagerError(
+                "Updating many containers would install the same system in all of them."
+                " Use a --config directory of <name>.nix files, or a --flake without an"
+                " attribute so that each container's name is used."
+            )
+
         self.__logger.debug(
-            "Updating container [bold]%s[/bold] with config '%s'. Activation strategy override: %s",
-            container.name,
+            "Updating %d containers with config '%s'. Activation strategy override: %s",
+            len(containers),
             config or flake or profile,
             activation_strategy,
         )
 
-        self.build(container, config, profile, flake, system, update=True)
-        self._check_network_zone(container)
-        container.write_config_files()
-        container.create_state_directories()
-        sync()
+        # Network reloads and syncs are performed once for all of the containers.
+        # As in update(), each container is locked for the whole of its update.
+        with self.batch(), ExitStack() as held:
+            results: dict[str, OperationResult] = {}
+            # Always in the same order, so that two batches can't each wait for the other
+            for name in sorted({container.name for container in containers}):
+                try:
+                    held.enter_context(self.locks.container(name))
+                except LockTimeoutError as err:
+                    results[name] = OperationResult(name, "update", STATUS_FAILED, str(err))
+
+            fingerprint = self._build_fingerprint(profile, flake, system)
+            to_build: list[Container] = []
+            for container in containers:
+                if container.name in results:
+                    continue
+                if self.is_unchanged(container, profile, flake, system):
+                    results[container.name] = OperationResult(
+                        container.name, "update", STATUS_UNCHANGED
+                    )
+                else:
+                    to_build.append(container)
+
+            if profile:
+                paths, errors = {c.name: profile.resolve() for c in to_build}, {}
+            elif to_build:
+                # Removed once every profile has switched to its system
+                gc_roots = Path(held.enter_context(TemporaryDirectory(prefix="nixos-nspawn-")))
+                paths, errors = self.build_many(to_build, config, flake, system, gc_roots)
+            else:
+                paths, errors = {}, {}
+
+            # Synced once, before the first container's units are linked to them
+            for path in paths.values():
+                self.host_actions.durable.add_filesystem(path)
+
+            for name, error in errors.items():
+                results[name] = OperationResult(name, "update", STATUS_FAILED, error)
 
-        container.activate_config(activation_strategy)
+            timings: dict[str, float] = {}
+            previous: dict[str, Optional[Path]] = {}
+            prepared: list[Container] = []
+            for container in containers:
+                if container.name in results:
+                    continue
 
-    def rollback(self, container: Container, activation_strategy: Optional[str] = None) -> None:
+                if paths[container.name] == container.system_path:
+                    self.__logger.info("Container [bold]%s[/bold] is unchanged", container.name)
+                    self._remember_build(container, fingerprint)
+                    results[container.name] = OperationResult(
+                        container.name, "update", STATUS_UNCHANGED
+                    )
+                    continue
+
+                start = monotonic()
+                previous[container.name] = container.system_path
+                try:
+                    container.build_from_profile(paths[container.name], update=True)
+                    self._remember_build(container, fingerprint)
+                    self._check_network_zone(container)
+                    container.write_config_files()
+                    container.create_state_directories()
+                    self.host_actions.sync(container.name)
+                    prepared.append(container)
+                except (CommandError, ContainerError, NixosNspawnManagerError, OSError) as err:
+                    results[container.name] = OperationResult(
+                        container.name, "update", STATUS_FAILED, str(err)
+                    )
+                timings[container.name] = monotonic() - start
+
+            for container in prepared:
+                start = monotonic()
+                try:
+                    container.activate_config(
+                        activation_strategy, previous=previous[container.name]
+                    )
+                    status, error = "updated", None
+                except (CommandError, ContainerError, OSError) as err:
+                    status, error = STATUS_FAILED, str(err)
+
+                elapsed = timings[container.name] + monotonic() - start
+                host_actions = [
+                    str(action) for action in self.host_actions.for_container(container.name)
+                ]
+                results[container.name] = OperationResult(
+                    container.name, "update", status, error, elapsed, host_actions
+                )
+
+        return [results[container.name] for container in containers]
+
+    @traced()
+    def rollback(
+        self,
+        container: Container,
+        activation_strategy: Optional[str] = None,
+        generation_id: Optional[int] = None,
+    ) -> None:
         self.__logger.debug(
             "Rolling back container [bold]%s[/bold]. Activation strategy override: %s",
             container.name,
             activation_strategy,
         )
 
-        container.rollback()
-        container.write_config_files()
-        container.create_state_directories()
-        sync()
+        with self.locks.container(container.name):
+            previous = container.system_path
+            container.rollback(generation_id)
+            container.write_config_files()
+            container.create_state_directories()
+            self.host_actions.sync(container.name)
+
+            container.activate_config(activation_strategy, previous=previous)
+
+    @traced()
+    def gc(
+        self,
+        containers: Sequence[Container],
+        keep_last: Optional[int] = None,
+        keep_newer_than: Optional[float] = None,
+        dry_run: bool = False,
+    ) -> Sequence[GcResult]:
+        """Deletes old generations of many containers according to the retention rules.
+        The current generation is always kept. See Container.prune_generations."""
+        results = []
+        for container in containers:
+            with self.locks.container(container.name):
+                removed, kept = container.prune_generations(keep_last, keep_newer_than, dry_run)
+            results.append(GcResult(container.name, removed, kept))
+
+        # One sync for every profile directory touched
+        self.host_actions.sync()
+        return results
+
+    @traced()
+    def collect_garbage(self) -> tuple[int, int]:
+        """Runs the Nix store garbage collector once. Returns the number of store paths
+        deleted and the number of bytes freed."""
+        self.__logger.info("Collecting garbage in the Nix store")
+        # The summary is logged on stderr, after a line per deleted path
+        summary: list[str] = []
+        run_command(
+            ["nix-store", "--gc"],
+            capture_stderr=True,
+            on_line=lambda _, line: summary.append(line) if "freed" in line else None,
+        )
+        if not (match := STORE_GC_PATTERN.search("\n".join(summary))):
+            self.__logger.debug("Unrecognised nix-store --gc output: %s", summary)
+            return 0, 0
+
+        paths, size, unit = match.groups()
+        return int(paths), int(float(size) * BYTE_UNITS.get(unit, 1))
+
+    @traced()
+    def _power(self, container: Container, action: str, timeout: Optional[float]) -> str:
+        """Performs one power action, and waits for it to complete. Returns the status."""
+        with self.locks.container(container.name):
+            # The snapshot may predate a previous attempt, or another worker's action
+            self.machine_state.refresh(container.name)
+            running = container.state != STATE_POWERED_OFF
 
-        container.activate_config(activation_strategy)
+            if action == ACTION_STOP:
+                if not running:
+                    return STATUS_UNCHANGED
+                container.poweroff(timeout or DEFAULT_POWEROFF_TIMEOUT)
+                return "stopped"
 
-    def remove(self, container: Container, delete_state: bool = True) -> None:
+            if not running:
+                # Rebooting a stopped container starts it
+                container.start(timeout or DEFAULT_START_TIMEOUT)
+                return "started"
+            if action == ACTION_START:
+                return STATUS_UNCHANGED
+
+            container.reboot(timeout or DEFAULT_START_TIMEOUT)
+            return "rebooted"
+
+    def _power_with_retries(
+        self, container: Container, action: str, retries: int, timeout: Optional[float]
+    ) -> OperationResult:
+        start = monotonic()
+        for attempt in range(retries + 1):
+            try:
+                status = self._power(container, action, timeout)
+                return OperationResult(container.name, action, status, elapsed=monotonic() - start)
+            except LockTimeoutError as err:
+                # Already waited for as long as it's worth waiting
+                return OperationResult(
+                    container.name, action, STATUS_FAILED, str(err), monotonic() - start
+                )
+            except (CommandError, ContainerError, OSError) as err:
+                error = str(err) or f"Failed to {action} {container.name}"
+                if attempt < retries:
+                    delay = POWER_RETRY_BACKOFF * 2**attempt
+                    self.__logger.warning(
+                        "Failed to %s %s, retrying in %.0fs (%d/%d): %s",
+                        action,
+                        container.name,
+                        delay,
+                        attempt + 1,
+                        retries,
+                        error,
+                    )
+                    sleep(delay)
+
+        return OperationResult(container.name, action, STATUS_FAILED, error, monotonic() - start)
+
+    @traced()
+    def power_many(
+        self,
+        containers: Sequence[Container],
+        action: str,
+        jobs: int = DEFAULT_POWER_JOBS,
+        retries: int = DEFAULT_POWER_RETRIES,
+        timeout: Optional[float] = None,
+        on_result: Optional[Callable[[OperationResult], None]] = None,
+        after: Optional[Mapping[str, Iterable[str]]] = None,
+    ) -> Sequence[OperationResult]:
+        """Starts, stops or reboots many containers, up to `jobs` of them at once.
+
+        Each action waits until the container is ready or has gone, and is retried
+        with backoff if it fails. Results are passed to on_result as each finishes,
+        and returned in the order of the containers.
+
+        after maps containers to those among them which must be acted on first. If any
+        of those fail, or depend on each other in a cycle, the container fails too.
+        """
+        if action not in POWER_ACTIONS:
+            raise AssertionError(f"Unknown power action '{action}'")
+
+        # Imported here, since most commands never need it
+        from concurrent.futures import FIRST_COMPLETED, Future, wait
+
+        from ..utilities.pool import ContextThreadPoolExecutor
+
+        self.__logger.debug("%s %d containers, %d at a time", action, len(containers), jobs)
+        by_name = {container.name: container for container in containers}
+        # Dependencies outside of this batch are not waited for
+        waiting = {
+            name: {dep for dep in (after or {}).get(name, ()) if dep in by_name and dep != name}
+            for name in by_name
+        }
+        results: dict[str, OperationResult] = {}
+
+        def finish(result: OperationResult) -> None:
+            results[result.name] = result
+            if on_result:
+                on_result(result)
+
+        def fail_dependents(name: str) -> None:
+            failed = [name]
+            while failed:
+                dependency = failed.pop()
+                for dependent in [n for n, deps in waiting.items() if dependency in deps]:
+                    del waiting[dependent]
+                    error = f"Not attempted, since {dependency} failed to {action}"
+                    finish(OperationResult(dependent, action, STATUS_FAILED, error))
+                    failed.append(dependent)
+
+        workers = max(1, min(jobs, len(containers)))
+        with ContextThreadPoolExecutor(
+            workers, thread_name_prefix=f"nixos-nspawn-{action}"
+        ) as pool:
+            running: dict[Future[OperationResult], str] = {}
+            while waiting or running:
+                for name in [n for n, deps in waiting.items() if not deps]:
+                    del waiting[name]
+                    future = pool.submit(
+                        self._power_with_retries, by_name[name], action, retries, timeout
+                    )
+                    running[future] = name
+
+                if not running:
+                    # Everything left is waiting on something else that is waiting
+                    error = f"Dependency cycle between {', '.join(sorted(waiting))}"
+                    for name in sorted(waiting):
+                        finish(OperationResult(name, action, STATUS_FAILED, error))
+                    break
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    del running[future]
+                    finish(result := future.result())
+                    if result.ok:
+                        for deps in waiting.values():
+                            deps.discard(result.name)
+                    else:
+                        fail_dependents(result.name)
+
+        return [results[container.name] for container in containers]
+
+    def remove(self, container: Container, delete_state: bool = True, wait: bool = False) -> None:
+        """Removes a container. Its state directory is moved to the trash, and deleted
+        by a reaper in the background unless wait is set."""
         self.__logger.debug(
             "Removing container [bold]%s[/bold]",
             container.name,
         )
 
-        if container.get_runtime_property("State", ignore_error=True):
-            container.poweroff()
-        container.destroy(delete_state=delete_state)
+        with self.locks.container(container.name):
+            if container.state != STATE_POWERED_OFF:
+                container.poweroff()
+            container.destroy(delete_state=delete_state, trash=self.trash)
+            self.cache.invalidate(container.name)
+
+        self.__containers.pop(container.name, None)
 
-        self.__containers.remove(container)
+        if delete_state and self.trash.entries():
+            if wait:
+                self.trash.reap(wait=True)
+            else:
+                self.trash.reap_in_background()
@@ -1,10 +1,25 @@
 from ._printable import Printable
-from .container import Container, ContainerError
+from .container import (
+    DEFAULT_POWEROFF_TIMEOUT,
+    DEFAULT_START_TIMEOUT,
+    FIELDS,
+    Container,
+    ContainerError,
+)
+from .gc_result import GcResult
 from .nix_generation import NixGeneration
+from .operation_result import STATUS_FAILED, STATUS_UNCHANGED, OperationResult
 
 __all__ = [
     "Container",
     "ContainerError",
+    "DEFAULT_POWEROFF_TIMEOUT",
+    "DEFAULT_START_TIMEOUT",
+    "FIELDS",
+    "GcResult",
     "NixGeneration",
+    "OperationResult",
+    "STATUS_FAILED",
+    "STATUS_UNCHANGED",
     "Printable",
 ]
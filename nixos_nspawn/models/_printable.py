@@ -5,6 +5,8 @@ from typing import Protocol
 class Printable(Protocol):
     """Any dataclass that can be shown on the CLI should implement this"""
 
+    __slots__ = ()
+
     @abstractmethod
     def render(self) -> str:
         """Generate a [rich] text human readable representation of this object"""
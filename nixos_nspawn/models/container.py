@@ -1,57 +1,166 @@
-import shutil
-from collections.abc import Generator
+from collections.abc import Callable, Generator
 from json import load
-from logging import getLogger
-from os import getenv
+from logging import LoggerAdapter, getLogger
+from os import getenv, readlink
+from os.path import realpath
 from pathlib import Path
 from shutil import rmtree
-from time import sleep
+from time import monotonic
 from typing import Any, Optional, Union
 
+from ..backends import RELOAD_NETWORKD, SYNC, Backend, HostActions, lazy_backend
 from ..constants import (
     DECLARATIVE_CONFIG_DIR,
     DEFAULT_EVAL_SCRIPT,
     FLAKE_KEY,
     MACHINE_STATE_DIR,
     NIX_PROFILE_DIR,
+    NIX_STORE_DIR,
     NSENTER_ARGS,
+    RUNTIME_UNIT_DIR,
 )
 from ..metadata import default_system
-from ..utilities import CommandError, SystemdUnitParser, run_command
+from ..utilities import (
+    CATEGORY_FILESYSTEM,
+    DEFAULT_COPY_JOBS,
+    CommandError,
+    MachineStateSnapshot,
+    PersistentCache,
+    SystemdUnitParser,
+    Trash,
+    WaitResult,
+    copy_tree,
+    path_cache_key,
+    run_command,
+    traced,
+    wait_for,
+)
 from ._printable import Printable
-from .nix_generation import NixGeneration
+from .nix_generation import (
+    NixGeneration,
+    current_generation_id,
+    generation_ids,
+    generation_link,
+    read_generations,
+)
+
+DEFAULT_START_TIMEOUT = 90.0
+
+DEFAULT_POWEROFF_TIMEOUT = 10.0
+
+
+# Settings which change with every new system, but are applied by a reload
+DYNAMIC_IGNORED_NSPAWN_SETTINGS = frozenset({("Exec", "Parameters")})
+
+DYNAMIC_IGNORED_OVERRIDE_SETTINGS = frozenset({("Service", "ExecReload")})
+
+# Files in a state directory identifying the machine it belongs to, relative to it.
+# Each is regenerated on boot when missing.
+IDENTITY_FILES = (
+    "var/lib/systemd/random-seed",
+    "var/lib/systemd/credential.secret",
+    "var/lib/dbus/machine-id",
+)
+
+_logger = getLogger("nixos_nspawn.container")
 
 
 class ContainerError(BaseException): ...
 
 
-class Container(Printable):
-    unit_file: Path
-    __profile_data: Optional[dict] = None
-    __unit_parser: Optional[SystemdUnitParser] = None
+def _is_running(machine: Optional[dict[str, str]]) -> bool:
+    return machine is not None and machine["State"] == "running"
+
 
-    def __init__(self, unit_file: Path) -> None:
+def _read_unit_settings(
+    unit: Path, ignored: frozenset[tuple[str, str]]
+) -> dict[str, dict[str, Union[str, list[str]]]]:
+    parser = SystemdUnitParser()
+    parser.read(unit)
+    return {
+        section: {
+            key: value
+            for key, value in parser.items(section, raw=True)
+            if (section, key) not in ignored
+        }
+        for section in parser.sections()
+    }
+
+
+class Container(Printable):
+    # Managers may hold thousands of these, so keep them small. Everything that
+    # can be derived from the name is computed on demand rather than stored.
+    __slots__ = (
+        "unit_file",
+        "name",
+        "machine_state",
+        "backend",
+        "cache",
+        "host",
+        "__logger",
+        "__profile_data",
+        "__unit_parser",
+        "__overrides_changed",
+    )
+
+    def __init__(
+        self,
+        unit_file: Path,
+        machine_state: Optional[MachineStateSnapshot] = None,
+        backend: Optional[Backend] = None,
+        cache: Optional[PersistentCache] = None,
+        host: Optional[HostActions] = None,
+    ) -> None:
         self.unit_file = unit_file
+        # These are shared with the manager's other containers so that runtime
+        # state is collected once for the whole fleet, bus connections are reused
+        # and parsed files are cached across invocations.
+        self.machine_state = machine_state or MachineStateSnapshot()
+        self.backend = backend or lazy_backend()
+        self.cache = cache
+        self.host = host or HostActions(self.backend)
 
         self.name = self.unit_file.name[: -len(".nspawn")]
 
-        self.__logger = getLogger(f"nixos_nspawn.container.{self.name}")
-        self.__state_dir = MACHINE_STATE_DIR / self.name
-        self.__profile_dir = NIX_PROFILE_DIR / self.name
-        self.__nix_path = self.__profile_dir / "system"
-        self.__nspawn_data_dir = self.__nix_path / "nixos-nspawn"
-        self.__network_unit_dir = self.unit_file.parent.parent / "network"
-        self.__service_overrides = self.__nspawn_data_dir / "service-overrides.conf"
-        self.__service_name = f"systemd-nspawn@{self.name}.service"
+        # All containers share one logger. The name is attached to each record
+        # instead, so that loggers don't accumulate in the logging registry.
+        self.__logger = LoggerAdapter(_logger, {"container": self.name})
+        self.__profile_data: Optional[dict] = None
+        self.__unit_parser: Optional[SystemdUnitParser] = None
+        self.__overrides_changed = False
 
         super().__init__()
 
-    def __eq__(self, other: Union["Container", Any]) -> bool:
-        return isinstance(other, Container) and self.unit_file == other.unit_file
+    @property
+    def __state_dir(self) -> Path:
+        return MACHINE_STATE_DIR / self.name
+
+    @property
+    def __profile_dir(self) -> Path:
+        return NIX_PROFILE_DIR / self.name
 
     @property
-    def __network_units(self) -> Generator[Path, None, None]:
-        return self.__nspawn_data_dir.glob("*.network")
+    def __nix_path(self) -> Path:
+        return self.__profile_dir / "system"
+
+    @property
+    def __nspawn_data_dir(self) -> Path:
+        return self.__nix_path / "nixos-nspawn"
+
+    @property
+    def __network_unit_dir(self) -> Path:
+        return self.unit_file.parent.parent / "network"
+
+    @property
+    def __service_overrides(self) -> Path:
+        return self.__nspawn_data_dir / "service-overrides.conf"
+
+    @property
+    def __service_name(self) -> str:
+        return f"systemd-nspawn@{self.name}.service"
+
+    def __eq__(self, other: Union["Container", Any]) -> bool:
+        return isinstance(other, Container) and self.unit_file == other.unit_file
 
     @property
     def _unit_parser(self) -> SystemdUnitParser:
@@ -65,6 +174,14 @@ class Container(Printable):
 
         return self.__unit_parser
 
+    @property
+    def system_path(self) -> Optional[Path]:
+        """The store path of the container's current system, if it has one"""
+        try:
+            return Path(realpath(self.__nix_path, strict=True))
+        except OSError:
+            return None
+
     @property
     def is_managed(self) -> bool:
         return self.profile_data != {}
@@ -73,19 +190,45 @@ class Container(Printable):
     def profile_data(self) -> dict:
         if not self.__profile_data:
             self.__profile_data = {}
-            cfg = self.__nspawn_data_dir / "data.json"
-            if (decl_cfg := DECLARATIVE_CONFIG_DIR / f"{self.name}.json").exists():
-                cfg = decl_cfg
+            cfg = DECLARATIVE_CONFIG_DIR / f"{self.name}.json"
+            if (key := path_cache_key(cfg)) is None:
+                cfg = self.__nspawn_data_dir / "data.json"
+                key = path_cache_key(cfg)
+
+            if key is None:
+                # Not (or no longer) managed by nixos-nspawn
+                return self.__profile_data
+
+            if self.cache and (cached := self.cache.get(self.name, "profile_data", key)):
+                self.__profile_data = cached
+                return self.__profile_data
 
             self.__logger.debug("Loading %s", cfg)
             with cfg.open() as profile_data_fd:
                 self.__profile_data = load(profile_data_fd)
 
+            if self.cache:
+                self.cache.put(self.name, "profile_data", key, self.__profile_data)
+
         return self.__profile_data
 
+    @property
+    def unit_settings(self) -> dict[str, dict[str, Union[str, list[str]]]]:
+        """The settings of the .nspawn unit file, by section"""
+        key = path_cache_key(self.unit_file)
+        if self.cache and (cached := self.cache.get(self.name, "unit_settings", key)):
+            return cached
+
+        parser = self._unit_parser
+        settings = {section: dict(parser.items(section, raw=True)) for section in parser.sections()}
+        if self.cache:
+            self.cache.put(self.name, "unit_settings", key, settings)
+
+        return settings
+
     @property
     def state(self) -> str:
-        return self.get_runtime_property("State", ignore_error=True) or "powered off"
+        return self.machine_state.state(self.name)
 
     @property
     def is_imperative(self) -> bool:
@@ -100,9 +243,25 @@ class Container(Printable):
         # Default to True for older containers/those which predate the option.
         return self.profile_data.get("activation", {}).get("autoStart", True)
 
+    @property
+    def start_after(self) -> list[str]:
+        """Names of the containers which must have started before this one"""
+        return self.profile_data.get("activation", {}).get("after", [])
+
     @classmethod
-    def from_unit_file(cls, unit_file: Path) -> "Container":
-        return cls(unit_file)
+    def from_unit_file(
+        cls,
+        unit_file: Path,
+        machine_state: Optional[MachineStateSnapshot] = None,
+        backend: Optional[Backend] = None,
+        cache: Optional[PersistentCache] = None,
+        host: Optional[HostActions] = None,
+    ) -> "Container":
+        return cls(unit_file, machine_state=machine_state, backend=backend, cache=cache, host=host)
+
+    def field(self, name: str) -> Any:  # noqa: ANN401
+        """Computes one of the FIELDS of this container, and only that"""
+        return FIELDS[name](self)
 
     def to_dict(self) -> dict:
         return {
@@ -121,6 +280,20 @@ class Container(Printable):
             )
         )
 
+    def invalidate(self) -> None:
+        """Forgets all parsed profile data. Called whenever the profile changes."""
+        self.__profile_data = None
+        self.__unit_parser = None
+        if self.cache:
+            self.cache.invalidate(self.name)
+
+    def _built(self, output: Optional[Path] = None) -> None:
+        """Called after the profile was changed by Nix, with the path of anything it built"""
+        self.host.durable.add_directory(self.__profile_dir)
+        if output:
+            self.host.durable.add_filesystem(output)
+        self.invalidate()
+
     def _create_profile_directory(self) -> None:
         # If it already exists, that's a problem. This is a new container.
         if self.__profile_dir.exists():
@@ -131,6 +304,7 @@ class Container(Printable):
         self.__profile_dir.mkdir(mode=0o755, parents=True)
         self.__profile_dir.chmod(mode=0o755)
 
+    @traced()
     def build_nixos_config(
         self, config: Path, update: bool = False, show_trace: bool = False
     ) -> Path:
@@ -162,9 +336,25 @@ class Container(Printable):
             args.append("--show-trace")
 
         run_command(args)
+        self._built(self.__nix_path)
 
         return self.__nix_path
 
+    @staticmethod
+    def flake_installable(flake: str, system: str = default_system) -> str:
+        """Expands a flake reference into the installable of a container's system"""
+        # Same thing as nixos-rebuild. Prepend our own key in the flake.
+        flake_split = flake.split("#")
+        if len(flake_split) != 2:
+            raise ContainerError(f"'{flake}' is not a valid flake path.")
+
+        flake_src, flake_attr = flake_split
+        if FLAKE_KEY not in flake_attr:
+            flake_attr = f"{FLAKE_KEY}.{system}.{flake_attr}"
+
+        return f"{flake_src}#{flake_attr}"
+
+    @traced()
     def build_flake_config(
         self,
         flake: str,
@@ -176,14 +366,7 @@ class Container(Printable):
         if not update:
             self._create_profile_directory()
 
-        # Same thing as nixos-rebuild. Prepend our own key in the flake.
-        flake_split = flake.split("#")
-        if len(flake_split) != 2:
-            raise ContainerError(f"'{flake}' is not a valid flake path.")
-
-        flake_src, flake_attr = flake_split
-        if FLAKE_KEY not in flake_attr:
-            flake_attr = f"{FLAKE_KEY}.{system}.{flake_attr}"
+        installable = self.flake_installable(flake, system)
 
         self.__logger.info("Building configuration from flake %s", flake)
         args = [
@@ -192,16 +375,18 @@ class Container(Printable):
             "--no-link",
             "--profile",
             str(self.__nix_path),
-            f"{flake_src}#{flake_attr}",
+            installable,
         ]
 
         if show_trace:
             args.append("--show-trace")
 
         run_command(args)
+        self._built(self.__nix_path)
 
         return self.__nix_path
 
+    @traced()
     def build_from_profile(self, profile: Path, update: bool = False) -> Path:
         """Installs a pre-built system profile to the container's profile."""
         # Create the profile directory if necessary
@@ -226,63 +411,124 @@ class Container(Printable):
         ]
 
         run_command(args)
+        # Whoever built the profile is responsible for syncing its contents
+        self._built()
 
         return self.__nix_path
 
+    @traced(CATEGORY_FILESYSTEM)
     def _apply_service_overrides(self) -> None:
         # In the future, we can use systemctl edit --stdin.
         # --stdin was added in v256, which isn't broadly in use yet.
         overrides = self.__service_overrides
-        override_file = Path("/run/systemd/system", self.__service_name + ".d", "override.conf")
+        override_file = RUNTIME_UNIT_DIR / (self.__service_name + ".d") / "override.conf"
+
+        contents = overrides.read_bytes()
+        try:
+            if override_file.read_bytes() == contents:
+                self.__logger.debug("Systemd service overrides are unchanged")
+                return
+        except FileNotFoundError:
+            pass
 
         self.__logger.debug(
             "Applying Systemd services overrides from %s to %s", overrides, override_file
         )
         override_file.parent.mkdir(mode=0o755, exist_ok=True, parents=True)
-        shutil.copyfile(overrides, override_file)
-        # There's no need to do a daemon-reload unless we are trying to reload the container.
+        self.host.durable.write_bytes(override_file, contents)
+        self.__overrides_changed = True
+        self.host.record("copy", str(override_file), self.name)
+        # The daemon-reload is only performed if we go on to reload the container.
         # Start/stop/restart will all automatically reload the file.
+        self.host.daemon_reload(self.name)
 
     def _revert_service_overrides(self) -> None:
-        run_command(
-            [
-                "systemctl",
-                "revert",
-                self.__service_name,
-            ],
-        )
+        self.backend.revert_unit(self.__service_name)
 
+    def _owns_link(self, link: Path) -> bool:
+        """Whether a symlink points into one of this container's systems"""
+        try:
+            target = Path(readlink(link))
+        except OSError:
+            return False
+        if target.parent.name != "nixos-nspawn":
+            return False
+        system = target.parent.parent
+        # Links are made to the system's store path, which is named after the container.
+        # Older versions linked through the profile instead.
+        if system.parent == NIX_STORE_DIR:
+            return system.name.split("-", 1)[-1] == self.name
+        return system == self.__nix_path
+
+    def _link(self, link: Path, target: Path) -> bool:
+        """Points a symlink at target. Returns False if it already did."""
+        try:
+            if readlink(link) == str(target):
+                return False
+        except OSError:
+            pass
+
+        self.__logger.debug("%s -> %s", link, target)
+        # Atomically, so that there's never a moment without the unit
+        self.host.durable.symlink(link, target)
+        self.host.record("link", str(link), self.name)
+        return True
+
+    @traced(CATEGORY_FILESYSTEM)
     def _write_network_unit_file(self) -> None:
-        if not self.__network_units:
-            return
-
-        self.__logger.debug("Linking network unit file(s)")
-
-        self.__network_unit_dir.mkdir(mode=0o755, exist_ok=True)
-        self.__network_unit_dir.chmod(mode=0o755)
-
-        for unit in self.__network_units:
-            link = self.__network_unit_dir / unit.name
-            self.__logger.debug("%s -> %s", link, unit)
-            link.unlink(missing_ok=True)
-            link.symlink_to(unit)
-
-        run_command(["systemctl", "reload", "systemd-networkd"])
+        # Link straight to the store, so that an unchanged unit keeps an identical link
+        nspawn_data_dir = (self.system_path or self.__nix_path) / "nixos-nspawn"
+        units = {unit.name: unit for unit in nspawn_data_dir.glob("*.network")}
+        network_unit_dir = self.__network_unit_dir
+        changed = False
+
+        if units:
+            self.__logger.debug("Linking network unit file(s)")
+            network_unit_dir.mkdir(mode=0o755, exist_ok=True)
+            network_unit_dir.chmod(mode=0o755)
+
+            for name, unit in units.items():
+                changed |= self._link(network_unit_dir / name, unit)
+
+        # Remove units that older generations had but this one doesn't
+        if network_unit_dir.is_dir():
+            for link in network_unit_dir.glob("*.network"):
+                if link.name not in units and link.is_symlink() and self._owns_link(link):
+                    self.__logger.debug("Removing stale %s", link)
+                    self.host.durable.unlink(link)
+                    self.host.record("unlink", str(link), self.name)
+                    changed = True
+
+        if changed:
+            self.host.reload_networkd(self.name)
+        else:
+            self.__logger.debug("Network units are unchanged")
 
+    @traced(CATEGORY_FILESYSTEM)
     def _write_nspawn_unit_file(self) -> None:
-        self.__logger.info("Linking nspawn unit file")
         # The unit is generated by Nix and added to the profile
+        nspawn_data_dir = (self.system_path or self.__nix_path) / "nixos-nspawn"
+        unit = nspawn_data_dir / self.unit_file.name
+        if not unit.exists():
+            # Such as a system built for another container, which embeds that one's name
+            raise ContainerError(
+                f"The system {nspawn_data_dir.parent} has no {unit.name}."
+                f" Was it built for a container named {self.name}?"
+            )
         self.unit_file.parent.mkdir(mode=0o755, exist_ok=True)
         self.unit_file.parent.chmod(mode=0o755)
-        self.unit_file.unlink(missing_ok=True)
-        self.unit_file.symlink_to(self.__nspawn_data_dir / self.unit_file.name)
+        if self._link(self.unit_file, unit):
+            self.__logger.info("Linked nspawn unit file")
+            self.__unit_parser = None
 
+    @traced(CATEGORY_FILESYSTEM)
     def write_config_files(self) -> None:
         # Write network units first
         self._write_network_unit_file()
         self._write_nspawn_unit_file()
         self._apply_service_overrides()
 
+    @traced(CATEGORY_FILESYSTEM)
     def create_state_directories(self) -> None:
         self.__logger.debug("Creating state directories")
         etc = self.__state_dir / "etc"
@@ -292,6 +538,8 @@ class Container(Printable):
         (self.__state_dir / "usr").mkdir(mode=0o755, exist_ok=True)
         if not (os_release := etc / "os-release").exists():
             os_release.touch(mode=0o644, exist_ok=True)
+        for directory in (self.__state_dir.parent, self.__state_dir, etc):
+            self.host.durable.add_directory(directory)
 
         # Create non-existent directories for bind mounts also
         mount: str = ""
@@ -300,14 +548,44 @@ class Container(Printable):
             if not src_dir.exists():
                 src_dir.mkdir(mode=755, parents=True)
 
+    @traced(CATEGORY_FILESYSTEM)
+    def copy_state_from(self, source: "Container", jobs: int = DEFAULT_COPY_JOBS) -> Optional[str]:
+        """Copies the state directory of source to this container's, which must not
+        exist yet, and resets its identity. Returns how it was copied, or None if
+        source has no state yet."""
+        if self.__state_dir.exists():
+            raise ContainerError(f"State directory {self.__state_dir} already exists!")
+        if not source.__state_dir.is_dir():
+            return None
+
+        self.__logger.debug("Copying state directory from %s", source.name)
+        try:
+            method = copy_tree(source.__state_dir, self.__state_dir, jobs)
+        except BaseException:
+            # Never leave half a copy behind
+            rmtree(self.__state_dir, ignore_errors=True)
+            raise
+        self.host.durable.add_filesystem(self.__state_dir)
+        self.reset_identity()
+        return method
+
+    @traced(CATEGORY_FILESYSTEM)
+    def reset_identity(self) -> None:
+        """Forgets the machine ID, host keys and seeds copied from another container,
+        so that this one boots as a new machine"""
+        machine_id = self.__state_dir / "etc" / "machine-id"
+        if machine_id.exists():
+            # Empty, so that systemd generates a new one on the next boot
+            machine_id.write_bytes(b"")
+        for name in IDENTITY_FILES:
+            (self.__state_dir / name).unlink(missing_ok=True)
+        for key in (self.__state_dir / "etc" / "ssh").glob("ssh_host_*"):
+            key.unlink()
+
     def get_runtime_property(self, key: str, ignore_error: bool = False) -> str:
         self.__logger.debug("Reading runtime property '%s'", key)
         try:
-            _, stdout = run_command(
-                ["machinectl", "show", self.name, "--property", key, "--value"],
-                capture_stdout=True,
-                capture_stderr=ignore_error,
-            )
+            stdout = self.backend.get_machine_property(self.name, key)
             self.__logger.debug("Value of runtime property %s: '%s'", key, stdout)
             return stdout
         except CommandError as err:
@@ -323,55 +601,229 @@ class Container(Printable):
             ["nsenter", "-t", leader_pid, *NSENTER_ARGS, "--", *args], capture_stdout=capture_stdout
         )
 
-    def start(self) -> None:
-        self.__logger.info("Starting")
-        run_command(["machinectl", "start", self.name])
+    @traced()
+    def wait_for_machine(
+        self, predicate: Callable[[Optional[dict[str, str]]], bool], timeout: float
+    ) -> WaitResult:
+        """Waits until predicate holds for the machine's registration (None when not running).
 
-    def reboot(self) -> None:
-        self.__logger.info("Rebooting")
-        run_command(["machinectl", "reboot", self.name])
+        Wakes up on every change to machined's state directory rather than polling.
+        """
+
+        def check() -> bool:
+            self.machine_state.refresh(self.name)
+            return predicate(self.machine_state.get(self.name))
+
+        return wait_for(check, timeout, watch_dir=self.machine_state.state_dir)
 
-    def poweroff(self, wait: int = 10) -> None:
+    @traced()
+    def start(self, wait: float = DEFAULT_START_TIMEOUT) -> float:
+        """Starts the container and waits until it is ready. Returns the time taken."""
+        self.__logger.info("Starting")
+        start = monotonic()
+        # Anything batched up so far must be in place before the container reads it.
+        # The service reads its overrides by itself when it starts.
+        self.host.flush(SYNC, RELOAD_NETWORKD)
+        # The start job only completes once the container has signalled readiness,
+        # since the unit sets NotifyReady. All that's left is machined's registration.
+        self.backend.start_machine(self.name)
+        if not self.wait_for_machine(_is_running, max(0, wait - (monotonic() - start))):
+            raise ContainerError(f"Container {self.name} did not start within {wait} seconds")
+
+        elapsed = monotonic() - start
+        self.__logger.info("Started in %.2fs", elapsed)
+        return elapsed
+
+    @traced()
+    def reboot(self, wait: Optional[float] = None) -> float:
+        """Reboots the container, optionally waiting until it is running again.
+        Returns the time taken."""
+        self.__logger.info("Rebooting")
+        start = monotonic()
+        previous = self.machine_state.get(self.name) or {}
+        self.host.flush(SYNC, RELOAD_NETWORKD)
+        self.backend.reboot_machine(self.name)
+        self.machine_state.refresh(self.name)
+        if wait is None:
+            return 0.0
+
+        # A reboot restarts the nspawn service, which registers a new leader process
+        leader = previous.get("LEADER")
+        if not self.wait_for_machine(
+            lambda machine: (
+                _is_running(machine) and (leader is None or machine.get("LEADER") != leader)
+            ),
+            max(0, wait - (monotonic() - start)),
+        ):
+            raise ContainerError(f"Container {self.name} did not reboot within {wait} seconds")
+
+        elapsed = monotonic() - start
+        self.__logger.info("Rebooted in %.2fs", elapsed)
+        return elapsed
+
+    @traced()
+    def poweroff(self, wait: float = DEFAULT_POWEROFF_TIMEOUT) -> float:
+        """Powers off the container and waits until it has gone. Returns the time taken."""
         self.__logger.info("Powering off")
-        run_command(["machinectl", "poweroff", self.name])
-        while wait > 0 and self.state != "powered off":
-            wait -= 1
-            sleep(1)
+        start = monotonic()
+        self.backend.poweroff_machine(self.name)
+        if not self.wait_for_machine(lambda machine: machine is None, wait):
+            raise ContainerError(f"Container {self.name} did not power off within {wait} seconds")
+
+        elapsed = monotonic() - start
+        self.__logger.info("Powered off in %.2fs", elapsed)
+        return elapsed
 
+    @traced()
     def reload(self) -> None:
         self.__logger.info("Reloading")
-        # The unit overrides file will have been modified. We need
-        # to reload systemd to ensure it has been picked up.
-        run_command(["systemctl", "daemon-reload"])
-        run_command(["systemctl", "reload", self.__service_name])
-
-    def rollback(self) -> None:
+        # If the unit overrides file was modified, systemd has to be reloaded to pick
+        # it up. That was requested when the file was written. Within a batch, one
+        # daemon-reload covers every container whose overrides were written before it.
+        if not self.__overrides_changed and self.backend.unit_needs_daemon_reload(
+            self.__service_name
+        ):
+            self.host.daemon_reload(self.name)
+        self.__overrides_changed = False
+        self.host.flush()
+        self.backend.reload_unit(self.__service_name)
+
+    def generation_ids(self) -> list[int]:
+        return generation_ids(self.__nix_path)
+
+    def current_generation_id(self) -> Optional[int]:
+        return current_generation_id(self.__nix_path)
+
+    def previous_generation_id(self) -> Optional[int]:
+        """The generation a rollback would switch to, if there is one"""
+        current = current_generation_id(self.__nix_path)
+        earlier = [i for i in self.generation_ids() if current is None or i < current]
+        return earlier[-1] if earlier else None
+
+    @traced()
+    def switch_generation(self, generation_id: int) -> None:
+        link = generation_link(self.__nix_path, generation_id)
+        if not link.is_symlink():
+            raise ContainerError(f"Generation {generation_id} of {self.name} does not exist")
+
+        self.__logger.info("Switching to generation %d", generation_id)
+        # Relative, like the links nix-env makes. Replaced atomically, unlike nix-env.
+        self.host.durable.symlink(self.__nix_path, link.name)
+        self._built()
+
+    @traced()
+    def rollback(self, generation_id: Optional[int] = None) -> None:
+        """Switches to the given generation, or to the one before the current one"""
         self.__logger.info("Rolling back")
-        run_command(["nix-env", "-p", str(self.__nix_path), "--rollback"])
+        if generation_id is None and (generation_id := self.previous_generation_id()) is None:
+            raise ContainerError(f"Container {self.name} has no previous generations")
 
-    def get_generations(self) -> list[NixGeneration]:
-        _, stdout = run_command(
-            ["nix-env", "-p", str(self.__nix_path), "--list-generations"], capture_stdout=True
-        )
-        return [NixGeneration.from_list_output(gen) for gen in stdout.split("\n")]
+        self.switch_generation(generation_id)
+
+    def get_generations(self) -> Generator[NixGeneration, None, None]:
+        return read_generations(self.__nix_path)
 
-    def activate_config(self, strategy: Optional[str] = None) -> None:
+    @traced()
+    def prune_generations(
+        self,
+        keep_last: Optional[int] = None,
+        keep_newer_than: Optional[float] = None,
+        dry_run: bool = False,
+    ) -> tuple[list[int], list[int]]:
+        """Deletes the generations which no retention rule keeps. A generation is kept
+        if it is current, among the last keep_last, or modified at or after the
+        keep_newer_than timestamp. Returns the removed and kept generation ids."""
+        ids = self.generation_ids()
+        keep = {current_generation_id(self.__nix_path)}
+        if keep_last is not None:
+            # Not ids[-keep_last:], which is every generation when keep_last is 0
+            keep.update(ids[max(0, len(ids) - keep_last) :])
+
+        removed: list[int] = []
+        for generation_id in ids:
+            if generation_id in keep:
+                continue
+            link = generation_link(self.__nix_path, generation_id)
+            if keep_newer_than is not None:
+                try:
+                    if link.lstat().st_mtime >= keep_newer_than:
+                        keep.add(generation_id)
+                        continue
+                except FileNotFoundError:
+                    continue
+            removed.append(generation_id)
+            if not dry_run:
+                self.host.durable.unlink(link)
+
+        if removed:
+            self.__logger.info(
+                "%s %d generations", "Would remove" if dry_run else "Removed", len(removed)
+            )
+        return removed, [i for i in ids if i in keep]
+
+    def needs_restart(self, previous: Optional[Path]) -> bool:
+        """Whether the host-side configuration of the previous system differs from the
+        current one in a way that a reload cannot apply.
+
+        Compares the .nspawn unit, network units and service overrides of both
+        generations, ignoring the init and switch-to-configuration paths which
+        change with every new system.
+        """
+        current = self.system_path
+        if previous is None or current is None:
+            return True
+
+        old_data, new_data = previous / "nixos-nspawn", current / "nixos-nspawn"
+        for unit_name, ignored in (
+            (self.unit_file.name, DYNAMIC_IGNORED_NSPAWN_SETTINGS),
+            ("service-overrides.conf", DYNAMIC_IGNORED_OVERRIDE_SETTINGS),
+        ):
+            if _read_unit_settings(old_data / unit_name, ignored) != _read_unit_settings(
+                new_data / unit_name, ignored
+            ):
+                self.__logger.debug("%s differs from the previous generation", unit_name)
+                return True
+
+        old_networks = {unit.name: unit.read_bytes() for unit in old_data.glob("*.network")}
+        new_networks = {unit.name: unit.read_bytes() for unit in new_data.glob("*.network")}
+        if old_networks != new_networks:
+            self.__logger.debug("Network units differ from the previous generation")
+            return True
+
+        return False
+
+    @traced()
+    def activate_config(
+        self,
+        strategy: Optional[str] = None,
+        wait: Optional[float] = None,
+        previous: Optional[Path] = None,
+    ) -> None:
+        """Applies the current system to the running container.
+        The previous system is needed by the dynamic strategy."""
         self.__logger.info("Activating configuration. Strategy override: %s", strategy)
         if strategy is None:
             strategy = self.activation_strategy
 
+        strategy = strategy.lower().strip()
+        if strategy == "dynamic":
+            strategy = "restart" if self.needs_restart(previous) else "reload"
+
         self.__logger.debug("Using activation strategy [bold]%s[/bold]", strategy)
-        if strategy.lower().strip() == "restart":
-            self.reboot()
+        if strategy == "restart":
+            self.reboot(wait=wait)
         else:
             self.reload()
 
-    def destroy(self, delete_state: bool = False) -> None:
-        """Removes all files associated with the contanier."""
+    @traced(CATEGORY_FILESYSTEM)
+    def destroy(self, delete_state: bool = False, trash: Optional[Trash] = None) -> None:
+        """Removes all files associated with the contanier.
+        If a trash is given, the state directory is moved there to be deleted later."""
         self.__logger.info("Destroying files")
-        for unit in self.__network_units:
-            link = self.__network_unit_dir / unit.name
-            link.unlink(missing_ok=True)
+        if self.__network_unit_dir.is_dir():
+            for link in self.__network_unit_dir.glob("*.network"):
+                if link.is_symlink() and self._owns_link(link):
+                    link.unlink()
         self.unit_file.unlink(missing_ok=True)
         if self.__profile_dir.exists():
             rmtree(str(self.__profile_dir))
@@ -380,6 +832,28 @@ class Container(Printable):
             empty_dir = self.__state_dir / "var" / "empty"
             if empty_dir.exists():
                 run_command(["chattr", "-i", str(empty_dir)])
-            rmtree(str(self.__state_dir))
+            if not (trash and trash.put(self.__state_dir, self.name)):
+                rmtree(str(self.__state_dir))
 
         self._revert_service_overrides()
+
+
+def _system(container: Container) -> Optional[str]:
+    system_path = container.system_path
+    return str(system_path) if system_path else None
+
+
+# Properties which can be listed, and how to compute each. Only state queries machined.
+FIELDS: dict[str, Callable[[Container], Any]] = {
+    "name": lambda container: container.name,
+    "unit_file": lambda container: str(container.unit_file),
+    "is_imperative": lambda container: container.is_imperative,
+    "type": lambda container: "imperative" if container.is_imperative else "declarative",
+    "state": lambda container: container.state,
+    "generation": lambda container: container.current_generation_id(),
+    "system": _system,
+    "activation_strategy": lambda container: container.activation_strategy,
+    "autostart": lambda container: container.autostart,
+    "start_after": lambda container: container.start_after,
+    "zone": lambda container: container.profile_data.get("zone"),
+}
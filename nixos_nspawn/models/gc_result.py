@@ -0,0 +1,22 @@
+from dataclasses import asdict, dataclass
+
+from ._printable import Printable
+
+
+@dataclass
+class GcResult(Printable):
+    """Generations removed from, and kept in, one container's profile"""
+
+    name: str
+    removed: list[int]
+    kept: list[int]
+
+    def render(self) -> str:
+        removed = ", ".join(map(str, self.removed)) or "none"
+        return (
+            f"[bold]{self.name}[/bold]: removed {len(self.removed)} generations ({removed}),"
+            f" kept {len(self.kept)}"
+        )
+
+    def to_dict(self) -> dict:
+        return asdict(self)
@@ -1,7 +1,74 @@
+import re
+from collections.abc import Generator
 from dataclasses import asdict, dataclass
+from os import readlink, scandir
+from pathlib import Path
+from time import localtime, strftime
+from typing import Optional
 
 from ._printable import Printable
 
+# Same format as nix-env --list-generations
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+CURRENT_LABEL = "(current)"
+
+
+def _link_pattern(profile_name: str) -> re.Pattern:
+    return re.compile(rf"^{re.escape(profile_name)}-(\d+)-link$")
+
+
+def generation_link(profile: Path, generation_id: int) -> Path:
+    """The link of one generation of a Nix profile, such as system-4-link"""
+    return profile.with_name(f"{profile.name}-{generation_id}-link")
+
+
+def current_generation_id(profile: Path) -> Optional[int]:
+    """The generation a Nix profile link currently points to"""
+    try:
+        target = readlink(profile)
+    except OSError:
+        return None
+
+    if match := _link_pattern(profile.name).match(Path(target).name):
+        return int(match.group(1))
+    return None
+
+
+def generation_ids(profile: Path) -> list[int]:
+    """All generation numbers of a Nix profile, in ascending order"""
+    pattern = _link_pattern(profile.name)
+    try:
+        with scandir(profile.parent) as entries:
+            return sorted(
+                int(match.group(1))
+                for entry in entries
+                if (match := pattern.match(entry.name)) and entry.is_symlink()
+            )
+    except FileNotFoundError:
+        return []
+
+
+def read_generations(profile: Path) -> Generator["NixGeneration", None, None]:
+    """Yields the generations of a Nix profile, oldest first.
+
+    Reads the profile's generation links directly, as nix-env does. Only the link
+    names are read up front. Each link is only inspected when its generation is reached.
+    """
+    current = current_generation_id(profile)
+    for generation_id in generation_ids(profile):
+        try:
+            mtime = generation_link(profile, generation_id).lstat().st_mtime
+        except FileNotFoundError:
+            # Deleted while we were reading
+            continue
+        yield NixGeneration(
+            generation_id=generation_id,
+            date=strftime(DATE_FORMAT, localtime(mtime)),
+            label=CURRENT_LABEL if generation_id == current else "",
+            current=generation_id == current,
+        )
+
 
 @dataclass
 class NixGeneration(Printable):
@@ -22,10 +89,12 @@ class NixGeneration(Printable):
 
     @classmethod
     def from_list_output(cls, line: str) -> "NixGeneration":
+        # For example: "  12   2024-05-01 10:20:30   (current)"
         data = line.split()
+        label = data[3] if len(data) > 3 else ""
         return cls(
-            generation_id=int(data[0].strip()),
-            date=data[1].strip(),
-            label=data[2].strip(),
-            current=data[2].strip() == "(current)",
+            generation_id=int(data[0]),
+            date=f"{data[1]} {data[2]}",
+            label=label,
+            current=label == CURRENT_LABEL,
         )
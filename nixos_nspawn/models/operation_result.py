@@ -0,0 +1,39 @@
+from dataclasses import asdict, dataclass, field
+from typing import Optional
+
+from ._printable import Printable
+
+STATUS_FAILED = "failed"
+
+STATUS_UNCHANGED = "unchanged"
+
+
+@dataclass
+class OperationResult(Printable):
+    """Outcome of an operation on one container out of many"""
+
+    name: str
+    action: str
+    status: str
+    error: Optional[str] = None
+    elapsed: float = 0.0
+    # Changes made to the host, such as links written and units reloaded
+    host_actions: list[str] = field(default_factory=list)
+
+    @property
+    def ok(self) -> bool:
+        return self.status != STATUS_FAILED
+
+    def render(self) -> str:
+        colour = "green" if self.ok else "red"
+        output = f"[bold]{self.name}[/bold]: [{colour}]{self.status}[/{colour}]"
+        output += f" ({self.elapsed:.2f}s)"
+        if self.host_actions:
+            output += f"\n  Host: {', '.join(self.host_actions)}"
+        if self.error:
+            output += f"\n  [red]{self.error}[/red]"
+
+        return output
+
+    def to_dict(self) -> dict:
+        return asdict(self)
@@ -58,6 +58,10 @@ in
     services."systemd-nspawn@${name}" = {
       overrideStrategy = "asDropin";
 
+      # Not started if a dependency fails to, as nixos-nspawn autostart does
+      after = map (dep: "systemd-nspawn@${dep}.service") activation.after;
+      requires = map (dep: "systemd-nspawn@${dep}.service") activation.after;
+
       # Force cgroupv2
       # https://github.com/NixOS/nixpkgs/pull/198526
       environment.SYSTEMD_NSPAWN_UNIFIED_HIERARCHY = "1";
@@ -164,6 +164,17 @@ in
     autoStart = (mkEnableOption "starting the container on hypervisor boot") // {
       default = true;
     };
+
+    after = mkOption {
+      default = [ ];
+      type = types.listOf types.str;
+      example = [ "database" ];
+      description = ''
+        Names of other containers which must have started before this one is.
+        Starting this container starts them too. If one of them fails to start,
+        or doesn't exist, this container is not started either.
+      '';
+    };
   };
 
   hostNetworkConfig = mkOption {
@@ -87,6 +87,10 @@ in
     enableAutostartService = (lib.mkEnableOption "autostarting of imperative containers") // {
       default = true;
     };
+
+    enableReapService = (lib.mkEnableOption "deleting state directories left in the trash on boot") // {
+      default = true;
+    };
   };
 
   config = lib.mkMerge [
@@ -106,6 +110,25 @@ in
       };
     })
 
+    (mkIf (config.nixos.containers.enableReapService) {
+      # Finishes deleting state directories whose reaper was stopped by a shutdown
+      systemd.services.nixos-nspawn-reap = {
+        description = "Deletes the state directories of removed imperative containers";
+        wantedBy = [ "multi-user.target" ];
+        after = [ "machines.target" ];
+        unitConfig = {
+          RequiresMountsFor = "/var/lib/machines";
+          ConditionDirectoryNotEmpty = "/var/lib/machines/.nixos-nspawn-trash";
+        };
+        serviceConfig = {
+          Type = "oneshot";
+          Nice = 19;
+          IOSchedulingClass = "idle";
+          ExecStart = "${pkgs.nixos-nspawn}/bin/nixos-nspawn reap";
+        };
+      };
+    })
+
     (mkIf (cfg.instances != { } || cfg.zones != { }) {
 
       assertions = assertions ++ [
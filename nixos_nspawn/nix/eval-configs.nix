@@ -0,0 +1,20 @@
+# Batch variant of eval-config.nix. Evaluates nixpkgs once and shares it
+# between all containers, so that a single nix-build can realise them all.
+{
+  nixpkgs,
+  # JSON list of { name, config } attribute sets
+  containers,
+  system ? builtins.currentSystem,
+}:
+let
+  pkgs = import "${nixpkgs}/pkgs/top-level/default.nix" {
+    localSystem.system = system;
+  };
+in
+map (
+  { name, config }:
+  (import ./lib.nix).mkContainer {
+    inherit pkgs name system;
+    modules = [ config ];
+  }
+) (builtins.fromJSON containers)
@@ -32,10 +32,6 @@
             assertion = containerConfig.sharedNix;
             message = "Experimental 'sharedNix'-feature isn't supported for imperative containers!";
           }
-          {
-            assertion = containerConfig.activation.strategy != "dynamic";
-            message = "'dynamic' is currently not supported for imperative containers!";
-          }
         ];
 
       containerWarnings =
@@ -1,9 +1,76 @@
-from .command import CommandError, run_command
+from .cache import PersistentCache, path_cache_key
+from .command import (
+    CommandError,
+    CommandStats,
+    CommandStatsCollector,
+    CommandTimeoutError,
+    command_stats,
+    run_command,
+    run_command_async,
+    stream_command,
+)
+from .durable import DurableWriter
+from .lock import (
+    DEFAULT_LOCK_TIMEOUT,
+    FileLocks,
+    LockStatsCollector,
+    LockTimeoutError,
+    lock_stats,
+)
+from .log import ContainerLogFilter, PlainFormatter
+from .machine_state import STATE_POWERED_OFF, MachineStateSnapshot
+from .reaper import DEFAULT_REAP_JOBS, ReapProgress, Trash
+from .trace import (
+    CATEGORY_COMMAND,
+    CATEGORY_FILESYSTEM,
+    CATEGORY_WAIT,
+    Tracer,
+    format_timings,
+    span,
+    traced,
+    tracer,
+)
+from .tree_copy import DEFAULT_COPY_JOBS, copy_tree, is_subvolume
 from .unit_parser import SystemdSettings, SystemdUnitParser
+from .wait import WaitResult, wait_for
 
 __all__ = [
     "run_command",
+    "run_command_async",
+    "stream_command",
+    "command_stats",
     "CommandError",
+    "CommandStats",
+    "CommandStatsCollector",
+    "CommandTimeoutError",
+    "ContainerLogFilter",
+    "DurableWriter",
+    "DEFAULT_LOCK_TIMEOUT",
+    "FileLocks",
+    "LockStatsCollector",
+    "LockTimeoutError",
+    "lock_stats",
+    "MachineStateSnapshot",
+    "PersistentCache",
+    "PlainFormatter",
+    "path_cache_key",
+    "STATE_POWERED_OFF",
     "SystemdSettings",
     "SystemdUnitParser",
+    "Tracer",
+    "CATEGORY_COMMAND",
+    "CATEGORY_FILESYSTEM",
+    "CATEGORY_WAIT",
+    "format_timings",
+    "span",
+    "traced",
+    "tracer",
+    "DEFAULT_COPY_JOBS",
+    "copy_tree",
+    "is_subvolume",
+    "DEFAULT_REAP_JOBS",
+    "ReapProgress",
+    "Trash",
+    "WaitResult",
+    "wait_for",
 ]
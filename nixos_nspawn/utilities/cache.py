@@ -0,0 +1,119 @@
+import marshal
+import os
+import sys
+from logging import getLogger
+from pathlib import Path
+from threading import Lock
+from typing import Any, Optional
+
+from ..constants import NIX_STORE_DIR, RUNTIME_DIR
+from .trace import CATEGORY_FILESYSTEM, traced
+
+# marshal's format is only stable within a Python version
+CACHE_FILE_NAME = f"cache-{sys.implementation.cache_tag}-{marshal.version}.marshal"
+
+
+def path_cache_key(path: Path) -> Optional[str]:
+    """Returns a key which changes whenever the content of path may have changed.
+
+    Files in the Nix store are immutable, so their resolved path is enough.
+    Anything else is identified by its inode, size and modification time.
+    """
+    try:
+        resolved = os.path.realpath(path, strict=True)
+        if resolved.startswith(f"{NIX_STORE_DIR}/"):
+            return resolved
+        stat = os.stat(resolved)
+    except OSError:
+        return None
+
+    return f"{stat.st_dev}:{stat.st_ino}:{stat.st_size}:{stat.st_mtime_ns}"
+
+
+class PersistentCache(object):
+    """An on-disk cache of parsed container files, shared across invocations.
+
+    Entries are stored per container and per kind, alongside the key of the file they
+    were parsed from. An entry is only returned while its key still matches, so a
+    stale entry can never be served. The whole cache is one marshal file under /run.
+    """
+
+    def __init__(self, path: Optional[Path] = None) -> None:
+        self.path = path or RUNTIME_DIR / CACHE_FILE_NAME
+
+        self.__entries: Optional[dict[str, dict[str, tuple[str, Any]]]] = None
+        self.__dirty = False
+        # Saves may come from several threads when shared by the daemon
+        self.__save_lock = Lock()
+        self.__logger = getLogger("nixos_nspawn.cache")
+
+    @property
+    def _entries(self) -> dict[str, dict[str, tuple[str, Any]]]:
+        if self.__entries is None:
+            self.__entries = self._load()
+        return self.__entries
+
+    def _load(self) -> dict[str, dict[str, tuple[str, Any]]]:
+        try:
+            with self.path.open("rb") as cache_fd:
+                # Never trust a cache file written by someone else
+                if os.fstat(cache_fd.fileno()).st_uid != os.geteuid():
+                    self.__logger.debug("Ignoring %s, it is owned by another user", self.path)
+                    return {}
+                entries = marshal.load(cache_fd)
+        except FileNotFoundError:
+            return {}
+        except (OSError, EOFError, ValueError, TypeError) as err:
+            self.__logger.debug("Ignoring unreadable cache %s: %s", self.path, err)
+            return {}
+
+        return entries if isinstance(entries, dict) else {}
+
+    def get(self, name: str, kind: str, key: Optional[str]) -> Optional[Any]:  # noqa: ANN401
+        if key is None:
+            return None
+
+        cached_key, value = self._entries.get(name, {}).get(kind, (None, None))
+        if cached_key != key:
+            return None
+        return value
+
+    def put(self, name: str, kind: str, key: Optional[str], value: Any) -> None:  # noqa: ANN401
+        if key is None:
+            return
+
+        self._entries.setdefault(name, {})[kind] = (key, value)
+        self.__dirty = True
+
+    def invalidate(self, name: Optional[str] = None) -> None:
+        """Drops the entries of one container, or all of them"""
+        if name is None:
+            self.__entries = {}
+        else:
+            self._entries.pop(name, None)
+        self.__dirty = True
+
+    @traced(CATEGORY_FILESYSTEM)
+    def save(self) -> None:
+        """Writes the cache back to disk if anything changed"""
+        with self.__save_lock:
+            self._save()
+
+    def _save(self) -> None:
+        if not self.__dirty or self.__entries is None:
+            return
+
+        tmp_path = self.path.with_name(f".{self.path.name}.{os.getpid()}")
+        try:
+            self.path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+            with tmp_path.open("wb") as cache_fd:
+                marshal.dump(self.__entries, cache_fd)
+            tmp_path.replace(self.path)
+        except OSError as err:
+            # Caching is an optimisation only, e.g. unprivileged users can't write to /run
+            self.__logger.debug("Could not write cache %s: %s", self.path, err)
+            tmp_path.unlink(missing_ok=True)
+            return
+
+        self.__dirty = False
+        self.__logger.debug("Saved cache of %d containers to %s", len(self.__entries), self.path)
@@ -1,6 +1,31 @@
+import os
+from collections import deque
+from collections.abc import Callable, Generator
+from dataclasses import asdict, dataclass
 from logging import getLogger
-from subprocess import PIPE, Popen
-from typing import IO, Any
+from selectors import EVENT_READ, DefaultSelector
+from signal import SIGKILL, SIGTERM
+from subprocess import PIPE, Popen, TimeoutExpired
+from threading import Lock
+from time import monotonic, perf_counter_ns
+from typing import IO, Any, Optional
+
+from .trace import CATEGORY_SUBPROCESS, tracer
+
+# Time a process is given to exit after SIGTERM, before it is killed
+KILL_GRACE_PERIOD = 5.0
+
+# Number of individual commands the stats collector remembers
+STATS_HISTORY = 1000
+
+STDOUT = "stdout"
+
+STDERR = "stderr"
+
+# Called with the stream name and each line of output, without its newline
+LineCallback = Callable[[str, str], None]
+
+_logger = getLogger("nixos_nspawn.command")
 
 
 class CommandError(Exception):
@@ -10,31 +35,357 @@ class CommandError(Exception):
         super().__init__(*args)
 
 
-def run_command(
+class CommandTimeoutError(CommandError):
+    """The command did not finish within its deadline, and was killed"""
+
+    def __init__(self, command: list[str], exit_code: int, timeout: float) -> None:
+        self.timeout = timeout
+        super().__init__(command, exit_code, f"'{command[0]}' timed out after {timeout}s")
+
+
+@dataclass
+class CommandStats:
+    """Timing and size of one finished command"""
+
+    args: list[str]
+    elapsed: float
+    exit_code: int
+    output_bytes: int
+    timed_out: bool = False
+
+    @property
+    def program(self) -> str:
+        return os.path.basename(self.args[0])
+
+
+class CommandStatsCollector(object):
+    """Collects statistics about every command run.
+
+    The most recent commands are kept individually, and totals are kept per program.
+    """
+
+    def __init__(self, history: int = STATS_HISTORY) -> None:
+        self.commands: deque[CommandStats] = deque(maxlen=history)
+        self.totals: dict[str, dict[str, float]] = {}
+        self.__lock = Lock()
+
+    def add(self, stats: CommandStats) -> None:
+        with self.__lock:
+            self.commands.append(stats)
+            totals = self.totals.setdefault(
+                stats.program, {"count": 0, "elapsed": 0.0, "output_bytes": 0, "failed": 0}
+            )
+            totals["count"] += 1
+            totals["elapsed"] += stats.elapsed
+            totals["output_bytes"] += stats.output_bytes
+            totals["failed"] += stats.exit_code != 0
+
+    def clear(self) -> None:
+        with self.__lock:
+            self.commands.clear()
+            self.totals.clear()
+
+    def to_dict(self) -> dict:
+        with self.__lock:
+            return {
+                "totals": {program: dict(totals) for program, totals in self.totals.items()},
+                "commands": [asdict(stats) for stats in self.commands],
+            }
+
+
+# Shared by every caller which doesn't bring its own collector
+command_stats = CommandStatsCollector()
+
+
+def _record(collector: CommandStatsCollector, stats: CommandStats) -> None:
+    collector.add(stats)
+    if tracer.enabled:
+        # The span ends now, and started when the command did
+        tracer.complete(
+            stats.program,
+            CATEGORY_SUBPROCESS,
+            perf_counter_ns() - int(stats.elapsed * 1e9),
+            {"args": " ".join(stats.args), "exit_code": stats.exit_code},
+        )
+
+
+def _kill(process: Popen, own_group: bool) -> None:
+    """Stops a process, and its children if it leads its own process group"""
+    if process.poll() is not None:
+        return
+
+    _logger.debug("Terminating process %d", process.pid)
+    try:
+        if own_group:
+            os.killpg(process.pid, SIGTERM)
+        else:
+            process.terminate()
+        process.wait(KILL_GRACE_PERIOD)
+    except TimeoutExpired:
+        if own_group:
+            os.killpg(process.pid, SIGKILL)
+        else:
+            process.kill()
+        process.wait()
+    except ProcessLookupError:
+        process.wait()
+
+
+def _read_lines(
+    process: Popen, deadline: Optional[float], sizes: dict[str, int]
+) -> Generator[tuple[str, str], None, None]:
+    """Yields (stream, line) from the process's pipes as soon as each line is complete.
+
+    The number of bytes read from each stream is added to sizes.
+    Raises TimeoutExpired if the deadline passes first.
+    """
+    streams = {STDOUT: process.stdout, STDERR: process.stderr}
+    pending: dict[int, bytearray] = {}
+    with DefaultSelector() as selector:
+        for name, pipe in streams.items():
+            if pipe is not None:
+                selector.register(pipe, EVENT_READ, name)
+                pending[pipe.fileno()] = bytearray()
+
+        while selector.get_map():
+            timeout = None if deadline is None else deadline - monotonic()
+            if timeout is not None and timeout <= 0:
+                raise TimeoutExpired(process.args, 0)
+
+            for key, _ in selector.select(timeout):
+                chunk = os.read(key.fd, 65536)
+                sizes[key.data] = sizes.get(key.data, 0) + len(chunk)
+                if not chunk:
+                    selector.unregister(key.fileobj)
+                    if rest := pending.pop(key.fd):
+                        yield key.data, rest.decode("utf-8", errors="replace")
+                    continue
+
+                buffer = pending[key.fd]
+                buffer += chunk
+                if b"\n" not in chunk:
+                    continue
+
+                *lines, pending[key.fd] = buffer.split(b"\n")
+                for line in lines:
+                    yield key.data, line.decode("utf-8", errors="replace")
+
+
+def stream_command(
     args: list[str],
-    capture_stdout: bool = False,
     capture_stderr: bool = False,
     stdin: IO[Any] | None = None,
-) -> tuple[int, str]:
-    """Run a command and return the exit code"""
-    logger = getLogger("nixos_nspawn.command")
-    logger.debug("Running command '%s'", " ".join(args))
+    timeout: Optional[float] = None,
+    collector: Optional[CommandStatsCollector] = None,
+) -> Generator[tuple[str, str], None, None]:
+    """Run a command, yielding (stream, line) for each line of its output.
+
+    Stderr is only captured and yielded if requested. If the generator is closed early,
+    or the timeout expires, the command is killed along with its process group.
+    Raises CommandError once the output ends, if the command failed.
+    """
+    _logger.debug("Running command '%s'", " ".join(args))
+    collector = collector or command_stats
+    # Only commands with a deadline get their own process group, so that
+    # interactive commands stay in the terminal's foreground group.
+    own_group = timeout is not None
+    start = monotonic()
+    deadline = None if timeout is None else start + timeout
+    sizes: dict[str, int] = {}
+    timed_out = False
 
-    with Popen(
+    process = Popen(
         args,
         stdin=stdin,
-        stdout=PIPE if capture_stdout else None,
+        stdout=PIPE,
         stderr=PIPE if capture_stderr else None,
-    ) as process:
-        exit_code = process.wait()
+        process_group=0 if own_group else None,
+    )
+    try:
+        yield from _read_lines(process, deadline, sizes)
+
+        remaining = None if deadline is None else max(0, deadline - monotonic())
+        exit_code = process.wait(remaining)
+    except TimeoutExpired:
+        timed_out = True
+        _kill(process, own_group)
+        exit_code = process.returncode
+    except BaseException:
+        # Including GeneratorExit and KeyboardInterrupt
+        _kill(process, own_group)
+        raise
+    finally:
+        for pipe in (process.stdout, process.stderr):
+            if pipe is not None:
+                pipe.close()
+        elapsed = monotonic() - start
+        _record(
+            collector, CommandStats(args, elapsed, process.wait(), sum(sizes.values()), timed_out)
+        )
+
+    _logger.debug("Command finished with code %d in %.3fs", exit_code, elapsed)
+
+    if timed_out:
+        raise CommandTimeoutError(args, exit_code, timeout or 0.0)
+    if exit_code != 0:
+        raise CommandError(args, exit_code, "")
+
+
+def run_command(
+    args: list[str],
+    capture_stdout: bool = False,
+    capture_stderr: bool = False,
+    stdin: IO[Any] | None = None,
+    timeout: Optional[float] = None,
+    on_line: Optional[LineCallback] = None,
+    collector: Optional[CommandStatsCollector] = None,
+) -> tuple[int, str]:
+    """Run a command and return the exit code and, if captured, its stdout.
+
+    Output is read while the command runs, so it can never fill a pipe and stall.
+    Lines are passed to on_line as they arrive. If none of capture_stdout, capture_stderr
+    and on_line are given, output goes straight to the terminal. Otherwise stdout is read,
+    and dropped unless captured, and stderr only goes to the terminal if not captured.
+    """
+    if not (capture_stdout or capture_stderr or on_line):
+        return _run_uncaptured(args, stdin, timeout, collector or command_stats)
+
+    stdout: list[str] = []
+    stderr: list[str] = []
+    lines = stream_command(args, capture_stderr, stdin, timeout, collector)
+    try:
+        for stream, line in lines:
+            if on_line:
+                on_line(stream, line)
+            if capture_stdout:
+                (stdout if stream == STDOUT else stderr).append(line)
+            elif stream == STDERR:
+                stderr.append(line)
+    except CommandTimeoutError:
+        raise
+    except CommandError as err:
+        output = "\n".join(stdout).strip() or "\n".join(stderr).strip()
+        _logger.debug("Command finished with code %d and stdout '%s'", err.exit_code, output)
+        raise CommandError(args, err.exit_code, output) from None
+
+    output = "\n".join(stdout).strip()
+    _logger.debug("Command finished with stdout '%s'", output)
+    return (0, output)
+
+
+def _run_uncaptured(
+    args: list[str],
+    stdin: IO[Any] | None,
+    timeout: Optional[float],
+    collector: CommandStatsCollector,
+) -> tuple[int, str]:
+    _logger.debug("Running command '%s'", " ".join(args))
+    own_group = timeout is not None
+    start = monotonic()
+    timed_out = False
+
+    with Popen(args, stdin=stdin, process_group=0 if own_group else None) as process:
+        try:
+            exit_code = process.wait(timeout)
+        except TimeoutExpired:
+            timed_out = True
+            _kill(process, own_group)
+            exit_code = process.returncode
+        except BaseException:
+            _kill(process, own_group)
+            raise
+
+    elapsed = monotonic() - start
+    _record(collector, CommandStats(args, elapsed, exit_code, 0, timed_out))
+    _logger.debug("Command finished with code %d in %.3fs", exit_code, elapsed)
+
+    if timed_out:
+        raise CommandTimeoutError(args, exit_code, timeout or 0.0)
+    if exit_code != 0:
+        raise CommandError(args, exit_code, "")
+
+    return (exit_code, "")
+
+
+async def run_command_async(
+    args: list[str],
+    capture_stdout: bool = False,
+    capture_stderr: bool = False,
+    timeout: Optional[float] = None,
+    on_line: Optional[LineCallback] = None,
+    collector: Optional[CommandStatsCollector] = None,
+) -> tuple[int, str]:
+    """Asyncio variant of run_command. Cancelling the task kills the command."""
+    # Imported here, since it is slow to import and most commands never need it
+    import asyncio
+
+    _logger.debug("Running command '%s'", " ".join(args))
+    collector = collector or command_stats
+    stream_output = capture_stdout or capture_stderr or on_line is not None
+    start = monotonic()
+    output: dict[str, list[str]] = {STDOUT: [], STDERR: []}
+    output_bytes = 0
+    timed_out = False
+
+    # Always in its own group here: asyncio callers are never interactive
+    process = await asyncio.create_subprocess_exec(
+        *args,
+        stdout=PIPE if stream_output else None,
+        stderr=PIPE if stream_output and capture_stderr else None,
+        process_group=0,
+    )
+
+    async def read(name: str, pipe: Optional[asyncio.StreamReader]) -> None:
+        nonlocal output_bytes
+        if pipe is None:
+            return
+        async for raw in pipe:
+            output_bytes += len(raw)
+            line = raw.decode("utf-8", errors="replace").rstrip("\n")
+            if on_line:
+                on_line(name, line)
+            output[name].append(line)
+
+    async def communicate() -> int:
+        await asyncio.gather(read(STDOUT, process.stdout), read(STDERR, process.stderr))
+        return await process.wait()
+
+    async def kill() -> None:
+        if process.returncode is not None:
+            return
+        try:
+            os.killpg(process.pid, SIGTERM)
+            try:
+                await asyncio.wait_for(process.wait(), KILL_GRACE_PERIOD)
+            except TimeoutError:
+                os.killpg(process.pid, SIGKILL)
+                await process.wait()
+        except ProcessLookupError:
+            await process.wait()
+
+    try:
+        exit_code = await asyncio.wait_for(communicate(), timeout)
+    except TimeoutError:
+        timed_out = True
+        await kill()
+        exit_code = process.returncode or 0
+    except BaseException:
+        # Including CancelledError
+        await asyncio.shield(kill())
+        raise
+    finally:
+        elapsed = monotonic() - start
+        _record(
+            collector, CommandStats(args, elapsed, process.returncode or 0, output_bytes, timed_out)
+        )
 
-        stdout = ""
-        if process.stdout:
-            stdout = process.stdout.read().strip().decode("utf-8")
+    _logger.debug("Command finished with code %d in %.3fs", exit_code, elapsed)
 
-    logger.debug("Command finished with code %d and stdout '%s'", exit_code, stdout)
+    if timed_out:
+        raise CommandTimeoutError(args, exit_code, timeout or 0.0)
 
-    if exit_code > 0:
-        raise CommandError(args, exit_code, stdout)
+    stdout = "\n".join(output[STDOUT]).strip() if capture_stdout else ""
+    if exit_code != 0:
+        raise CommandError(args, exit_code, stdout or "\n".join(output[STDERR]).strip())
 
     return (exit_code, stdout)
@@ -0,0 +1,154 @@
+import ctypes
+import os
+from collections.abc import Callable
+from functools import cache
+from logging import getLogger
+from pathlib import Path
+from threading import Lock, RLock, get_ident
+from typing import Optional, Union
+
+from .trace import CATEGORY_FILESYSTEM, traced
+
+_logger = getLogger("nixos_nspawn.durable")
+
+
+@cache
+def _load_syncfs() -> Optional[Callable[[int], int]]:
+    try:
+        # libc is among the symbols already loaded into the process
+        return ctypes.CDLL(None, use_errno=True).syncfs
+    except (OSError, AttributeError):
+        return None
+
+
+def syncfs(path: Path) -> None:
+    """Flushes the filesystem containing path, and nothing else"""
+    fd = os.open(path, os.O_RDONLY | os.O_CLOEXEC)
+    try:
+        if (libc_syncfs := _load_syncfs()) is None:
+            # Much slower, but at least as safe
+            os.sync()
+        elif libc_syncfs(fd) != 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno), str(path))
+    finally:
+        os.close(fd)
+
+
+def fsync_directory(path: Path) -> None:
+    """Makes the entries of a directory, such as renames within it, durable"""
+    fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY | os.O_CLOEXEC)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _temporary(path: Path) -> Path:
+    # Hidden, and in the same directory, so that it can be renamed over path.
+    # Unique to the thread, since worker threads may write the same path at once.
+    return path.with_name(f".{path.name}.{os.getpid()}.{get_ident()}.tmp")
+
+
+class DurableWriter(object):
+    """Atomically replaces files and links, and makes changes durable on sync().
+
+    Instead of flushing every dirty page on the host like os.sync(), only the
+    directories that were written to are fsynced, along with the filesystems of
+    anything written by other programs (such as Nix builds).
+
+    Files and links are never missing: their replacement is renamed over them.
+    The filesystems registered with add_filesystem are flushed before any link or
+    file is replaced, so that a link never survives a crash while its target doesn't.
+
+    It may be shared by threads.
+    """
+
+    def __init__(self) -> None:
+        self.__directories: set[Path] = set()
+        # Filesystems by device number, with a path on each
+        self.__filesystems: dict[int, Path] = {}
+        self.__lock = Lock()
+        # Held while flushing, so that no thread carries on while another is still
+        # flushing what it registered
+        self.__flush_lock = RLock()
+
+    @property
+    def pending(self) -> bool:
+        with self.__lock:
+            return bool(self.__directories or self.__filesystems)
+
+    def add_directory(self, path: Path) -> None:
+        """Registers a directory whose entries were changed by something else"""
+        with self.__lock:
+            self.__directories.add(path)
+
+    def add_filesystem(self, path: Path) -> None:
+        """Registers a path written by something else. Its whole filesystem is synced."""
+        try:
+            device = os.stat(path).st_dev
+        except FileNotFoundError:
+            return
+        with self.__lock:
+            self.__filesystems.setdefault(device, path)
+
+    def _pop_filesystem(self) -> Optional[Path]:
+        with self.__lock:
+            return self.__filesystems.popitem()[1] if self.__filesystems else None
+
+    @traced(CATEGORY_FILESYSTEM)
+    def _flush_filesystems(self) -> None:
+        with self.__flush_lock:
+            while (path := self._pop_filesystem()) is not None:
+                _logger.debug("Syncing the filesystem of %s", path)
+                syncfs(path)
+
+    @traced(CATEGORY_FILESYSTEM)
+    def symlink(self, link: Path, target: Union[str, Path]) -> None:
+        """Points link at target, replacing anything already there"""
+        self._flush_filesystems()
+        temporary = _temporary(link)
+        temporary.unlink(missing_ok=True)
+        os.symlink(target, temporary)
+        try:
+            os.replace(temporary, link)
+        except BaseException:
+            temporary.unlink(missing_ok=True)
+            raise
+        self.add_directory(link.parent)
+
+    @traced(CATEGORY_FILESYSTEM)
+    def write_bytes(self, path: Path, data: bytes, mode: int = 0o644) -> None:
+        """Replaces the contents of a file"""
+        self._flush_filesystems()
+        temporary = _temporary(path)
+        fd = os.open(temporary, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | os.O_CLOEXEC, mode)
+        try:
+            with os.fdopen(fd, "wb") as temporary_fd:
+                temporary_fd.write(data)
+                temporary_fd.flush()
+                os.fsync(temporary_fd.fileno())
+            os.replace(temporary, path)
+        except BaseException:
+            temporary.unlink(missing_ok=True)
+            raise
+        self.add_directory(path.parent)
+
+    @traced(CATEGORY_FILESYSTEM)
+    def unlink(self, path: Path) -> None:
+        path.unlink(missing_ok=True)
+        self.add_directory(path.parent)
+
+    @traced(CATEGORY_FILESYSTEM)
+    def sync(self) -> None:
+        """Makes everything changed so far durable"""
+        with self.__flush_lock:
+            self._flush_filesystems()
+            with self.__lock:
+                directories, self.__directories = self.__directories, set()
+            # Deepest first, so that new directories are durable before the entries for them
+            for directory in sorted(directories, key=lambda path: len(path.parts), reverse=True):
+                try:
+                    fsync_directory(directory)
+                except FileNotFoundError:
+                    pass
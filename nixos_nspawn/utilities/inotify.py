@@ -0,0 +1,122 @@
+import ctypes
+import os
+import select
+import struct
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_ISDIR = 0x40000000
+
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+
+# Any change to the set of entries in a directory, including atomic replacements
+IN_DIR_CHANGES = IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO | IN_CLOSE_WRITE
+
+_EVENT_HEADER = struct.Struct("iIII")
+
+
+class InotifyUnavailableError(OSError): ...
+
+
+@dataclass(frozen=True)
+class InotifyEvent:
+    watch: Path
+    mask: int
+    cookie: int
+    name: str
+
+    @property
+    def path(self) -> Path:
+        return self.watch / self.name if self.name else self.watch
+
+
+def _load_libc() -> ctypes.CDLL:
+    # The symbols already loaded into the process, which include libc's.
+    # Cheaper than ctypes.util.find_library, which may run ldconfig.
+    libc = ctypes.CDLL(None, use_errno=True)
+    if not hasattr(libc, "inotify_init1"):
+        raise InotifyUnavailableError("inotify is not supported on this platform")
+    return libc
+
+
+class Inotify(object):
+    """A minimal ctypes wrapper around the Linux inotify API"""
+
+    def __init__(self) -> None:
+        self.__libc = _load_libc()
+        self.__fd = self.__libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.__fd < 0:
+            errno = ctypes.get_errno()
+            raise InotifyUnavailableError(errno, os.strerror(errno))
+        self.__watches: dict[int, Path] = {}
+
+    def __enter__(self) -> "Inotify":
+        return self
+
+    def __exit__(self, *_: object) -> None:
+        self.close()
+
+    def fileno(self) -> int:
+        return self.__fd
+
+    def close(self) -> None:
+        if self.__fd >= 0:
+            os.close(self.__fd)
+            self.__fd = -1
+
+    def add_watch(self, path: Path, mask: int = IN_DIR_CHANGES) -> int:
+        wd = self.__libc.inotify_add_watch(self.__fd, os.fsencode(path), mask)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno), str(path))
+        self.__watches[wd] = path
+        return wd
+
+    def remove_watch(self, wd: int) -> None:
+        if self.__watches.pop(wd, None) is not None:
+            # The watch may already be gone if its path was deleted
+            self.__libc.inotify_rm_watch(self.__fd, wd)
+
+    def read_events(self, timeout: Optional[float] = None) -> list[InotifyEvent]:
+        """Waits up to timeout seconds (forever if None) for events and returns them"""
+        poller = select.poll()
+        poller.register(self.__fd, select.POLLIN)
+        if not poller.poll(None if timeout is None else max(0, int(timeout * 1000))):
+            return []
+
+        try:
+            data = os.read(self.__fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+
+        events: list[InotifyEvent] = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = data[offset : offset + length].rstrip(b"\0")
+            offset += length
+
+            if mask & IN_IGNORED:
+                self.__watches.pop(wd, None)
+                continue
+
+            watch = self.__watches.get(wd, Path())
+            events.append(InotifyEvent(watch, mask, cookie, os.fsdecode(name)))
+
+        return events
@@ -0,0 +1,182 @@
+import fcntl
+import os
+from collections.abc import Generator
+from contextlib import AbstractContextManager, contextmanager
+from logging import getLogger
+from pathlib import Path
+from threading import Lock, RLock
+from time import monotonic, sleep
+from typing import Optional
+
+from ..constants import RUNTIME_DIR
+from .trace import CATEGORY_WAIT, span
+
+LOCK_DIR = RUNTIME_DIR / "locks"
+
+# Seconds to wait for a lock before giving up. Long enough for another build to finish.
+DEFAULT_LOCK_TIMEOUT = 600.0
+
+# Waits longer than this are logged, rather than only counted
+LOCK_WAIT_NOTICE = 1.0
+
+# flock() can't time out, so a contended lock is polled, backing off up to the maximum
+POLL_INTERVAL = 0.005
+MAX_POLL_INTERVAL = 0.1
+
+KIND_CONTAINER = "container"
+KIND_HOST = "host"
+
+
+class LockTimeoutError(TimeoutError):
+    def __init__(self, label: str, timeout: float) -> None:
+        super().__init__(f"Timed out after {timeout:g}s waiting for the lock on {label}")
+        self.label = label
+        self.timeout = timeout
+
+
+class LockStatsCollector(object):
+    """Totals of the locks taken of each kind, and how long was spent waiting for them"""
+
+    def __init__(self) -> None:
+        self.totals: dict[str, dict[str, float]] = {}
+        self.__lock = Lock()
+
+    def add(self, kind: str, waited: float, contended: bool, timed_out: bool = False) -> None:
+        with self.__lock:
+            totals = self.totals.setdefault(
+                kind, {"count": 0, "contended": 0, "waited": 0.0, "timeouts": 0}
+            )
+            totals["count"] += 1
+            totals["contended"] += contended
+            totals["waited"] += waited
+            totals["timeouts"] += timed_out
+
+    def clear(self) -> None:
+        with self.__lock:
+            self.totals.clear()
+
+    def to_dict(self) -> dict:
+        with self.__lock:
+            return {kind: dict(totals) for kind, totals in self.totals.items()}
+
+
+# Shared by every caller which doesn't bring its own collector
+lock_stats = LockStatsCollector()
+
+
+class _HeldLock(object):
+    """A lock file as held by this process. Threads take turns through the guard."""
+
+    __slots__ = ("guard", "fd", "depth")
+
+    def __init__(self) -> None:
+        self.guard = RLock()
+        self.fd: Optional[int] = None
+        self.depth = 0
+
+
+# flock() only excludes other open files, so threads of this process share each one
+_held: dict[Path, _HeldLock] = {}
+_held_lock = Lock()
+
+
+class FileLocks(object):
+    """Advisory flock() locks shared by every nixos-nspawn process on the host.
+
+    Operations changing a container hold its lock, so that operations on unrelated
+    containers can run at the same time. The host lock is only held around changes
+    to shared state, such as reloading systemd or networkd.
+
+    Locks are re-entrant within a thread, and are released if the process dies.
+    If the lock directory can't be written, such as when not running as root,
+    nothing is locked.
+    """
+
+    def __init__(
+        self,
+        lock_dir: Optional[Path] = None,
+        timeout: float = DEFAULT_LOCK_TIMEOUT,
+        stats: Optional[LockStatsCollector] = None,
+    ) -> None:
+        self.lock_dir = lock_dir or LOCK_DIR
+        self.timeout = timeout
+        self.stats = stats or lock_stats
+        self.__logger = getLogger("nixos_nspawn.lock")
+
+    def container(self, name: str) -> AbstractContextManager[None]:
+        return self._lock(self.lock_dir / "containers" / f"{name}.lock", KIND_CONTAINER, name)
+
+    def host(self) -> AbstractContextManager[None]:
+        return self._lock(self.lock_dir / "host.lock", KIND_HOST, "the host")
+
+    def _open(self, path: Path) -> Optional[int]:
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            return os.open(path, os.O_RDWR | os.O_CREAT | os.O_CLOEXEC, 0o600)
+        except OSError as err:
+            self.__logger.debug("Not locking %s: %s", path, err)
+            return None
+
+    def _flock(self, fd: int, label: str, deadline: float) -> bool:
+        """Locks fd by deadline. Returns whether another process held it meanwhile."""
+        interval = POLL_INTERVAL
+        contended = False
+        while True:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return contended
+            except BlockingIOError:
+                if (remaining := deadline - monotonic()) <= 0:
+                    raise LockTimeoutError(label, self.timeout) from None
+                if not contended:
+                    self.__logger.debug("Waiting for the lock on %s", label)
+                    contended = True
+                sleep(min(interval, remaining))
+                interval = min(interval * 2, MAX_POLL_INTERVAL)
+
+    def _acquire(self, entry: _HeldLock, path: Path, kind: str, label: str) -> None:
+        start = monotonic()
+        # Only blocks if another thread of this process holds the lock
+        contended = not entry.guard.acquire(blocking=False)
+        if contended and not entry.guard.acquire(timeout=max(self.timeout, 0)):
+            self.stats.add(kind, monotonic() - start, True, timed_out=True)
+            raise LockTimeoutError(label, self.timeout)
+
+        try:
+            if entry.depth == 0 and (fd := self._open(path)) is not None:
+                try:
+                    contended |= self._flock(fd, label, start + self.timeout)
+                except BaseException:
+                    os.close(fd)
+                    raise
+                entry.fd = fd
+        except LockTimeoutError:
+            entry.guard.release()
+            self.stats.add(kind, monotonic() - start, True, timed_out=True)
+            raise
+        except BaseException:
+            entry.guard.release()
+            raise
+
+        entry.depth += 1
+        waited = monotonic() - start
+        self.stats.add(kind, waited, contended)
+        if waited >= LOCK_WAIT_NOTICE:
+            self.__logger.info("Waited %.1fs for the lock on %s", waited, label)
+
+    @contextmanager
+    def _lock(self, path: Path, kind: str, label: str) -> Generator[None, None, None]:
+        with _held_lock:
+            entry = _held.setdefault(path, _HeldLock())
+
+        with span(f"lock {kind}", CATEGORY_WAIT, target=label):
+            self._acquire(entry, path, kind, label)
+        try:
+            yield
+        finally:
+            entry.depth -= 1
+            if entry.depth == 0 and entry.fd is not None:
+                # Closing the file releases the lock
+                os.close(entry.fd)
+                entry.fd = None
+            entry.guard.release()
@@ -0,0 +1,26 @@
+import re
+from logging import Filter, Formatter, LogRecord
+
+# Rich console markup, such as [bold] or [/red]
+MARKUP_PATTERN = re.compile(r"\[/?(?:bold|dim|italic|red|green|yellow)\]")
+
+
+class ContainerLogFilter(Filter):
+    """Shows which container a record came from.
+
+    Containers share the `nixos_nspawn.container` logger and attach their name to each
+    record. This restores the familiar `nixos_nspawn.container.<name>` logger name on output.
+    """
+
+    def filter(self, record: LogRecord) -> bool:
+        container = getattr(record, "container", None)
+        if container and not record.name.endswith(f".{container}"):
+            record.name = f"{record.name}.{container}"
+        return True
+
+
+class PlainFormatter(Formatter):
+    """Formats records for plain text output, stripping any rich markup"""
+
+    def format(self, record: LogRecord) -> str:
+        return MARKUP_PATTERN.sub("", super().format(record))
@@ -0,0 +1,125 @@
+from json import loads
+from logging import getLogger
+from os import scandir
+from pathlib import Path
+from threading import RLock
+from typing import Optional
+
+from ..constants import MACHINED_STATE_DIR
+from .command import CommandError, run_command
+
+STATE_POWERED_OFF = "powered off"
+
+
+class MachineStateSnapshot(object):
+    """A point-in-time view of every machine registered with systemd-machined.
+
+    The snapshot is collected lazily in a single pass and shared between all
+    Containers of a manager, so that listing N containers does not fork
+    `machinectl` N times. Call refresh() to discard stale data.
+    It may be shared by threads acting on different containers.
+    """
+
+    def __init__(self, state_dir: Optional[Path] = None) -> None:
+        self.state_dir = state_dir or MACHINED_STATE_DIR
+
+        self.__machines: Optional[dict[str, dict[str, str]]] = None
+        self.__stale: set[str] = set()
+        self.__lock = RLock()
+        self.__logger = getLogger("nixos_nspawn.machine_state")
+
+    def refresh(self, name: Optional[str] = None) -> None:
+        """Discard the snapshot, or just one machine's entry if a name is given"""
+        with self.__lock:
+            if name is None:
+                self.__machines = None
+                self.__stale.clear()
+            else:
+                self.__stale.add(name)
+
+    def _parse_state_file(self, path: Path) -> Optional[dict[str, str]]:
+        # machined persists each machine as a simple KEY=VALUE file.
+        # It does not persist the state itself, but it can be derived the same
+        # way machine_get_state() does: a pending scope job means it is opening.
+        try:
+            with path.open() as state_fd:
+                lines = state_fd.read().splitlines()
+        except FileNotFoundError:
+            return None
+
+        props: dict[str, str] = {}
+        for line in lines:
+            if line.startswith("#") or "=" not in line:
+                continue
+            key, value = line.split("=", 1)
+            props[key] = value
+
+        props["State"] = "opening" if props.get("SCOPE_JOB") else "running"
+        return props
+
+    def _collect_from_machinectl(self) -> dict[str, dict[str, str]]:
+        # Fallback for hosts where machined's state directory is unavailable.
+        # Still one fork for the whole fleet rather than one per container.
+        try:
+            _, stdout = run_command(
+                ["machinectl", "list", "--output=json"],
+                capture_stdout=True,
+                capture_stderr=True,
+            )
+        except (CommandError, FileNotFoundError):
+            return {}
+
+        return {
+            machine["machine"]: {"NAME": machine["machine"], "State": "running"}
+            for machine in loads(stdout or "[]")
+        }
+
+    def _collect(self) -> dict[str, dict[str, str]]:
+        if not self.state_dir.is_dir():
+            self.__logger.debug("%s does not exist, querying machinectl", self.state_dir)
+            return self._collect_from_machinectl()
+
+        machines: dict[str, dict[str, str]] = {}
+        with scandir(self.state_dir) as entries:
+            for entry in entries:
+                # Skip the unit:* symlinks and any temporary files
+                if ":" in entry.name or entry.name.startswith(".") or not entry.is_file():
+                    continue
+                if (props := self._parse_state_file(Path(entry.path))) is not None:
+                    machines[props.get("NAME", entry.name)] = props
+
+        self.__logger.debug("Collected state of %d machines", len(machines))
+        return machines
+
+    @property
+    def machines(self) -> dict[str, dict[str, str]]:
+        with self.__lock:
+            if self.__machines is None:
+                self.__machines = self._collect()
+                self.__stale.clear()
+
+            return self.__machines
+
+    def get(self, name: str) -> Optional[dict[str, str]]:
+        """Returns the registered properties of a machine, or None if it is not running"""
+        with self.__lock:
+            machines = self.machines
+            if name in self.__stale:
+                self.__stale.discard(name)
+                if self.state_dir.is_dir():
+                    props = self._parse_state_file(self.state_dir / name)
+                else:
+                    props = self._collect_from_machinectl().get(name)
+
+                if props is None:
+                    machines.pop(name, None)
+                else:
+                    machines[name] = props
+
+            return machines.get(name)
+
+    def state(self, name: str) -> str:
+        if props := self.get(name):
+            return props["State"]
+
+        return STATE_POWERED_OFF
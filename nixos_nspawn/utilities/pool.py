@@ -0,0 +1,20 @@
+from collections.abc import Callable
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextvars import copy_context
+from typing import Any, TypeVar
+
+# Imported by the modules which start worker threads, when they start them. Not imported
+# by the package, since most commands never need concurrent.futures.
+
+T = TypeVar("T")
+
+
+class ContextThreadPoolExecutor(ThreadPoolExecutor):
+    """A ThreadPoolExecutor whose tasks run in the context of the thread submitting them.
+
+    Worker threads otherwise start from an empty context, so anything kept in a
+    ContextVar, such as the daemon request a log record belongs to, would be lost.
+    """
+
+    def submit(self, fn: Callable[..., T], /, *args: Any, **kwargs: Any) -> Future[T]:  # noqa: ANN401
+        return super().submit(copy_context().run, fn, *args, **kwargs)
@@ -0,0 +1,335 @@
+import json
+import os
+import sys
+from collections.abc import Callable
+from dataclasses import asdict, dataclass, field
+from logging import getLogger
+from pathlib import Path
+from shutil import which
+from subprocess import DEVNULL, Popen
+from threading import Lock
+from time import monotonic, time, time_ns
+from typing import Optional
+
+from ..constants import MACHINE_STATE_DIR
+from .command import CommandError, run_command
+from .trace import CATEGORY_FILESYSTEM, traced
+from .tree_copy import is_subvolume
+
+# Beside the state directories, so that moving one in is a rename on the same filesystem.
+# Hidden, so that machinectl doesn't list it as an image.
+TRASH_DIR = MACHINE_STATE_DIR / ".nixos-nspawn-trash"
+
+# Written in the trash by the reaper while it runs, and removed when it is done
+PROGRESS_FILE = ".reaper.json"
+
+# Directories emptied at once
+DEFAULT_REAP_JOBS = 8
+
+# Journal identifier of reapers started in the background, and where journald takes their output
+REAPER_IDENTIFIER = "nixos-nspawn-reap"
+JOURNAL_STREAM_SOCKET = Path("/run/systemd/journal/stdout")
+
+# Seconds between updates of the progress file
+PROGRESS_INTERVAL = 1.0
+
+DIRECTORY_FLAGS = os.O_RDONLY | os.O_DIRECTORY | os.O_NOFOLLOW | os.O_CLOEXEC
+
+
+@dataclass
+class ReapProgress:
+    """How much of one trashed state directory has been deleted so far"""
+
+    entry: str
+    files: int = 0
+    bytes: int = 0
+    started: float = field(default_factory=time)
+    elapsed: float = 0.0
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+def _open_directory(root_fd: int, parts: tuple[str, ...]) -> int:
+    """Opens a directory below root_fd without following any symlinks on the way"""
+    fd = os.dup(root_fd)
+    for part in parts:
+        try:
+            child = os.open(part, DIRECTORY_FLAGS, dir_fd=fd)
+        finally:
+            os.close(fd)
+        fd = child
+    return fd
+
+
+class _TreeDeleter(object):
+    """Deletes a directory tree, emptying up to `jobs` directories at once.
+
+    Directories are only ever opened relative to their already open parent, and
+    never through a symlink, so a tree changed under it can't redirect deletion
+    outside of itself.
+    """
+
+    def __init__(self, progress: ReapProgress, on_progress: Callable[[], None]) -> None:
+        self.progress = progress
+        self.on_progress = on_progress
+        self.__lock = Lock()
+
+    def _empty(self, root_fd: int, parts: tuple[str, ...]) -> list[tuple[str, ...]]:
+        """Deletes everything in a directory except subdirectories, which are returned"""
+        subdirectories = []
+        files = size = 0
+        fd = _open_directory(root_fd, parts)
+        try:
+            with os.scandir(fd) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirectories.append((*parts, entry.name))
+                        continue
+                    size += entry.stat(follow_symlinks=False).st_blocks * 512
+                    os.unlink(entry.name, dir_fd=fd)
+                    files += 1
+        finally:
+            os.close(fd)
+
+        with self.__lock:
+            self.progress.files += files
+            self.progress.bytes += size
+        self.on_progress()
+        return subdirectories
+
+    def delete(self, path: Path, jobs: int) -> None:
+        # Imported here, since most commands never need it
+        from concurrent.futures import FIRST_COMPLETED, wait
+
+        from .pool import ContextThreadPoolExecutor
+
+        root_fd = os.open(path, DIRECTORY_FLAGS)
+        try:
+            directories: list[tuple[str, ...]] = []
+            with ContextThreadPoolExecutor(jobs, thread_name_prefix="nixos-nspawn-reap") as pool:
+                running = {pool.submit(self._empty, root_fd, ())}
+                while running:
+                    done, running = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        for subdirectory in future.result():
+                            directories.append(subdirectory)
+                            running.add(pool.submit(self._empty, root_fd, subdirectory))
+
+            # Deepest first, now that every one of them is empty
+            for parts in sorted(directories, key=len, reverse=True):
+                parent = _open_directory(root_fd, parts[:-1])
+                try:
+                    os.rmdir(parts[-1], dir_fd=parent)
+                finally:
+                    os.close(parent)
+        finally:
+            os.close(root_fd)
+        os.rmdir(path)
+
+
+def _delete_subvolume(path: Path) -> bool:
+    """Deletes path as a btrfs subvolume if it is one. Returns whether it was."""
+    if not is_subvolume(path):
+        return False
+    try:
+        # btrfs reports what it did on stdout, which would corrupt --json output.
+        # run_command logs what it captures.
+        run_command(
+            ["btrfs", "subvolume", "delete", str(path)],
+            capture_stdout=True,
+            capture_stderr=True,
+        )
+    except (CommandError, OSError) as err:
+        getLogger("nixos_nspawn.reaper").debug("Cannot delete subvolume %s: %s", path, err)
+        return False
+    return True
+
+
+def tree_size(path: Path) -> tuple[int, int]:
+    """Number of files in a directory tree, and the bytes they occupy on disk"""
+    files = size = 0
+    pending = [str(path)]
+    while pending:
+        try:
+            with os.scandir(pending.pop()) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        pending.append(entry.path)
+                        continue
+                    size += entry.stat(follow_symlinks=False).st_blocks * 512
+                    files += 1
+        except FileNotFoundError:
+            # Deleted by the running reaper meanwhile
+            continue
+    return files, size
+
+
+def _trashed_at(entry: Path) -> int:
+    suffix = entry.name.rpartition(".")[2]
+    return int(suffix) if suffix.isdigit() else 0
+
+
+class Trash(object):
+    """State directories of removed containers, waiting to be deleted.
+
+    Moving a state directory here is a rename, so removing a container returns at
+    once however large its state is. A reaper then deletes everything here, usually
+    in the background. Only one reaper runs at a time, holding a lock on the trash
+    directory itself.
+    """
+
+    def __init__(self, path: Optional[Path] = None) -> None:
+        self.path = path or TRASH_DIR
+        self.__logger = getLogger("nixos_nspawn.reaper")
+
+    def put(self, directory: Path, name: str) -> bool:
+        """Moves directory into the trash. Returns False if it can't be moved there,
+        such as when it is on another filesystem."""
+        try:
+            self.path.mkdir(mode=0o700, exist_ok=True)
+            directory.rename(self.path / f"{name}.{time_ns()}")
+        except OSError as err:
+            self.__logger.debug("Cannot move %s to the trash: %s", directory, err)
+            return False
+        return True
+
+    def entries(self) -> list[Path]:
+        """Trashed directories, oldest first"""
+        try:
+            with os.scandir(self.path) as entries:
+                found = [Path(entry.path) for entry in entries if not entry.name.startswith(".")]
+        except FileNotFoundError:
+            return []
+        return sorted(found, key=_trashed_at)
+
+    def progress(self) -> Optional[dict]:
+        """Progress of the reaper running now, if any"""
+        try:
+            return json.loads((self.path / PROGRESS_FILE).read_text())
+        except (OSError, ValueError):
+            return None
+
+    def status(self) -> dict:
+        """What is left in the trash, and the progress of the reaper running now.
+        Measuring what is left reads the whole trash, so it takes a while."""
+        remaining = []
+        for entry in self.entries():
+            files, size = tree_size(entry)
+            remaining.append({"entry": entry.name, "files": files, "bytes": size})
+        return {
+            "remaining": remaining,
+            "files": sum(entry["files"] for entry in remaining),
+            "bytes": sum(entry["bytes"] for entry in remaining),
+            "reaping": self.progress(),
+        }
+
+    def _write_progress(self, progress: ReapProgress) -> None:
+        temporary = self.path / f"{PROGRESS_FILE}.tmp"
+        temporary.write_text(json.dumps(progress.to_dict()))
+        temporary.replace(self.path / PROGRESS_FILE)
+
+    @traced(CATEGORY_FILESYSTEM)
+    def reap(
+        self,
+        jobs: int = DEFAULT_REAP_JOBS,
+        on_progress: Optional[Callable[[ReapProgress], None]] = None,
+        wait: bool = False,
+    ) -> Optional[list[ReapProgress]]:
+        """Deletes everything in the trash, including anything trashed meanwhile.
+        Returns what was deleted, or None if another reaper is running and wait
+        isn't set. Entries which can't be deleted are logged and left in place."""
+        # Imported here, since most commands never need it
+        import fcntl
+
+        try:
+            lock_fd = os.open(self.path, DIRECTORY_FLAGS)
+        except FileNotFoundError:
+            return []
+
+        try:
+            try:
+                fcntl.flock(lock_fd, fcntl.LOCK_EX | (0 if wait else fcntl.LOCK_NB))
+            except BlockingIOError:
+                self.__logger.debug("Another reaper is running")
+                return None
+
+            reaped: list[ReapProgress] = []
+            failed: set[Path] = set()
+            while entries := [entry for entry in self.entries() if entry not in failed]:
+                for entry in entries:
+                    try:
+                        reaped.append(self._reap_entry(entry, jobs, on_progress))
+                    except OSError as err:
+                        self.__logger.warning("Cannot delete %s: %s", entry, err)
+                        failed.add(entry)
+            (self.path / PROGRESS_FILE).unlink(missing_ok=True)
+            return reaped
+        finally:
+            os.close(lock_fd)
+
+    def _reap_entry(
+        self,
+        entry: Path,
+        jobs: int,
+        on_progress: Optional[Callable[[ReapProgress], None]],
+    ) -> ReapProgress:
+        progress = ReapProgress(entry.name)
+        start = monotonic()
+        last_report = [start]
+        report_lock = Lock()
+
+        def report() -> None:
+            now = monotonic()
+            with report_lock:
+                if now - last_report[0] < PROGRESS_INTERVAL:
+                    return
+                last_report[0] = now
+                progress.elapsed = now - start
+                self._write_progress(progress)
+                if on_progress:
+                    on_progress(progress)
+
+        self.__logger.debug("Deleting %s", entry)
+        self._write_progress(progress)
+        if not _delete_subvolume(entry):
+            _TreeDeleter(progress, report).delete(entry, max(1, jobs))
+
+        progress.elapsed = monotonic() - start
+        if on_progress:
+            on_progress(progress)
+        self.__logger.info(
+            "Deleted %s, %d files and %d bytes in %.2fs",
+            entry.name,
+            progress.files,
+            progress.bytes,
+            progress.elapsed,
+        )
+        return progress
+
+    def reap_in_background(self) -> None:
+        """Starts a reaper which outlives this process. Its output goes to the journal
+        where journald runs, otherwise its logs go to this process's stderr."""
+        # The same modules as this process, however it was installed
+        env = {**os.environ, "PYTHONPATH": os.pathsep.join(path for path in sys.path if path)}
+        args = [
+            sys.executable,
+            "-m",
+            "nixos_nspawn",
+            "reap",
+            "--json",
+            "--trash-dir",
+            str(self.path),
+        ]
+        # systemd-cat fails without journald, in which case the reaper wouldn't run at all
+        systemd_cat = which("systemd-cat") if JOURNAL_STREAM_SOCKET.exists() else None
+        if systemd_cat:
+            args = [systemd_cat, f"--identifier={REAPER_IDENTIFIER}", *args]
+        self.__logger.debug("Starting a reaper: %s", args)
+        Popen(
+            args,
+            env=env,
+            stdin=DEVNULL,
+            stdout=DEVNULL,
+            start_new_session=True,
+        )
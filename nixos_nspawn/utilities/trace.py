@@ -0,0 +1,248 @@
+import json
+import os
+import threading
+from collections.abc import Callable
+from contextlib import AbstractContextManager, nullcontext
+from dataclasses import dataclass, field
+from functools import wraps
+from pathlib import Path
+from threading import Lock
+from time import perf_counter_ns
+from types import TracebackType
+from typing import Any, Optional, TypeVar, cast
+
+# What the time in a span was spent on. Time in nested spans is attributed to them.
+CATEGORY_COMMAND = "command"
+CATEGORY_CALL = "call"
+CATEGORY_SUBPROCESS = "subprocess"
+CATEGORY_FILESYSTEM = "filesystem"
+CATEGORY_WAIT = "wait"
+
+F = TypeVar("F", bound=Callable[..., Any])
+
+
+@dataclass
+class Span:
+    """One timed operation. Times are in nanoseconds from perf_counter_ns()."""
+
+    name: str
+    category: str
+    start: int
+    thread: int
+    args: dict[str, Any] = field(default_factory=dict)
+    duration: int = 0
+    # Time spent in spans nested within this one, on the same thread
+    children: int = 0
+
+    @property
+    def self_time(self) -> int:
+        # Concurrent children (e.g. asyncio commands) may add up to more than the span
+        return max(0, self.duration - self.children)
+
+
+class Tracer(object):
+    """Records nested spans while enabled. While disabled, spans are never created.
+
+    Spans nest per thread. Each span's own time excludes the spans within it,
+    so that time can be attributed to subprocesses, the filesystem and waiting.
+    """
+
+    def __init__(self) -> None:
+        self.enabled = False
+        self.spans: list[Span] = []
+        self.__threads: dict[int, str] = {}
+        self.__local = threading.local()
+        self.__lock = Lock()
+        self.__origin = perf_counter_ns()
+
+    def enable(self) -> None:
+        self.clear()
+        self.enabled = True
+
+    def disable(self) -> None:
+        self.enabled = False
+
+    def clear(self) -> None:
+        with self.__lock:
+            self.spans = []
+            self.__threads = {}
+            self.__origin = perf_counter_ns()
+
+    def _stack(self) -> list[Span]:
+        try:
+            return self.__local.stack
+        except AttributeError:
+            self.__local.stack = []
+            return self.__local.stack
+
+    def begin(self, name: str, category: str, args: dict[str, Any]) -> Span:
+        span = Span(name, category, perf_counter_ns(), threading.get_ident(), args)
+        self._stack().append(span)
+        return span
+
+    def end(self, span: Span) -> None:
+        span.duration = perf_counter_ns() - span.start
+        stack = self._stack()
+        if span in stack:
+            # Normally the innermost, unless a generator was abandoned
+            stack.remove(span)
+        self._add(span)
+
+    def complete(self, name: str, category: str, start: int, args: dict[str, Any]) -> None:
+        """Records a span which started at start and ends now, such as a subprocess
+        that could not be wrapped in span() because it was run by a generator"""
+        span = Span(name, category, start, threading.get_ident(), args)
+        span.duration = perf_counter_ns() - start
+        self._add(span)
+
+    def _add(self, span: Span) -> None:
+        if stack := self._stack():
+            stack[-1].children += span.duration
+        with self.__lock:
+            self.spans.append(span)
+            if span.thread not in self.__threads:
+                self.__threads[span.thread] = threading.current_thread().name
+
+    def to_chrome(self) -> dict:
+        """The spans as Chrome trace events, which Perfetto and chrome://tracing load"""
+        pid = os.getpid()
+        with self.__lock:
+            spans = sorted(self.spans, key=lambda span: (span.start, -span.duration))
+            events: list[dict] = [
+                {"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": name}}
+                for tid, name in self.__threads.items()
+            ]
+            origin = self.__origin
+
+        events.extend(
+            {
+                "name": span.name,
+                "cat": span.category,
+                "ph": "X",
+                # Microseconds
+                "ts": (span.start - origin) / 1000,
+                "dur": span.duration / 1000,
+                "pid": pid,
+                "tid": span.thread,
+                "args": span.args,
+            }
+            for span in spans
+        )
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def write(self, path: Path) -> None:
+        path.write_text(json.dumps(self.to_chrome()))
+
+    def timings(self) -> list[tuple[str, int, float, float]]:
+        """(name, calls, total seconds, own seconds) of each span name, slowest first"""
+        totals: dict[str, list[int]] = {}
+        with self.__lock:
+            for span in self.spans:
+                entry = totals.setdefault(span.name, [0, 0, 0])
+                entry[0] += 1
+                entry[1] += span.duration
+                entry[2] += span.self_time
+
+        return sorted(
+            ((name, calls, total / 1e9, own / 1e9) for name, (calls, total, own) in totals.items()),
+            key=lambda row: row[2],
+            reverse=True,
+        )
+
+    def categories(self) -> dict[str, float]:
+        """Seconds spent in each category, excluding time in nested spans"""
+        totals: dict[str, float] = {}
+        with self.__lock:
+            for span in self.spans:
+                totals[span.category] = totals.get(span.category, 0.0) + span.self_time / 1e9
+        return totals
+
+
+# Shared by everything, and only enabled by --trace or --timings
+tracer = Tracer()
+
+
+class _SpanContext(AbstractContextManager[None]):
+    __slots__ = ("name", "category", "args", "span")
+
+    def __init__(self, name: str, category: str, args: dict[str, Any]) -> None:
+        self.name = name
+        self.category = category
+        self.args = args
+
+    def __enter__(self) -> None:
+        self.span = tracer.begin(self.name, self.category, self.args)
+
+    def __exit__(
+        self,
+        exc_type: Optional[type[BaseException]],
+        exc: Optional[BaseException],
+        traceback: Optional[TracebackType],
+    ) -> None:
+        if exc_type is not None:
+            self.args["error"] = exc_type.__name__
+        tracer.end(self.span)
+
+
+# Returned by span() while tracing is off. Entering it does nothing.
+_NO_SPAN = nullcontext()
+
+
+def span(name: str, category: str = CATEGORY_CALL, **args: Any) -> AbstractContextManager[None]:  # noqa: ANN401
+    """A context manager timing its body as a span"""
+    if not tracer.enabled:
+        return _NO_SPAN
+    return _SpanContext(name, category, args)
+
+
+def traced(category: str = CATEGORY_CALL, name: Optional[str] = None) -> Callable[[F], F]:
+    """Decorates a function or method to time each call as a span named after it.
+
+    Calls are labelled with the name of the Container they're a method of, or
+    otherwise are given as their first argument (after self).
+    """
+
+    def decorate(func: F) -> F:
+        span_name = name or func.__qualname__
+
+        @wraps(func)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:  # noqa: ANN401
+            if not tracer.enabled:
+                return func(*args, **kwargs)
+
+            labels = {}
+            for arg in args[:2]:
+                if isinstance(owner := getattr(arg, "name", None), str):
+                    labels["container"] = owner
+                    break
+            context = _SpanContext(span_name, category, labels)
+            with context:
+                return func(*args, **kwargs)
+
+        return cast(F, wrapper)
+
+    return decorate
+
+
+def format_timings(trace: Tracer) -> str:
+    """A plain table of the time spent in each span, and in each category"""
+    rows = [("SPAN", "CALLS", "TOTAL (s)", "SELF (s)")]
+    rows.extend(
+        (name, str(calls), f"{total:.3f}", f"{own:.3f}")
+        for name, calls, total, own in trace.timings()
+    )
+    widths = [max(len(row[column]) for row in rows) for column in range(4)]
+
+    lines = [
+        "  ".join(
+            [row[0].ljust(widths[0])]
+            + [cell.rjust(width) for cell, width in zip(row[1:], widths[1:], strict=True)]
+        )
+        for row in rows
+    ]
+    categories = ", ".join(
+        f"{category} {seconds:.3f}s"
+        for category, seconds in sorted(trace.categories().items(), key=lambda item: -item[1])
+    )
+    lines.append(f"Time by category: {categories}")
+    return "\n".join(lines) + "\n"
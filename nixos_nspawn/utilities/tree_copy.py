@@ -0,0 +1,157 @@
+import errno
+import fcntl
+import os
+import shutil
+import stat
+from logging import getLogger
+from pathlib import Path
+from threading import Lock
+
+from .command import CommandError, run_command
+from .trace import CATEGORY_FILESYSTEM, traced
+
+# ioctl(dest, FICLONE, src) shares src's extents with dest, on btrfs, XFS and others
+FICLONE = 0x40049409
+
+# The root directory of every btrfs subvolume has this inode number
+BTRFS_SUBVOLUME_INODE = 256
+
+# Errors meaning the filesystem can't reflink, rather than that the copy failed
+REFLINK_UNSUPPORTED = frozenset(
+    {errno.EOPNOTSUPP, errno.ENOTTY, errno.EXDEV, errno.EINVAL, errno.ENOSYS}
+)
+
+# Files copied at once, when they can't be reflinked
+DEFAULT_COPY_JOBS = 8
+
+COPY_SNAPSHOT = "snapshot"
+COPY_REFLINK = "reflink"
+COPY_PLAIN = "copy"
+
+
+class _TreeCopier(object):
+    """Copies a directory tree, preserving ownership, modes, times and hard links.
+
+    Files are reflinked until the filesystem refuses, then copied. Either way, up to
+    `jobs` files are copied at once.
+    """
+
+    def __init__(self, jobs: int) -> None:
+        self.jobs = jobs
+        self.reflink = True
+        self.__lock = Lock()
+        self.__logger = getLogger("nixos_nspawn.copy")
+
+    def _copy_file(self, source: str, destination: str, st: os.stat_result) -> None:
+        if self.reflink:
+            try:
+                with open(source, "rb") as source_fd, open(destination, "wb") as destination_fd:
+                    fcntl.ioctl(destination_fd.fileno(), FICLONE, source_fd.fileno())
+                self._copy_metadata(source, destination, st)
+                return
+            except OSError as err:
+                if err.errno not in REFLINK_UNSUPPORTED:
+                    raise
+                with self.__lock:
+                    if self.reflink:
+                        self.__logger.debug("Cannot reflink, copying instead: %s", err)
+                    self.reflink = False
+
+        shutil.copyfile(source, destination, follow_symlinks=False)
+        self._copy_metadata(source, destination, st)
+
+    @staticmethod
+    def _copy_metadata(source: str, destination: str, st: os.stat_result) -> None:
+        # Before the mode is copied, since chown clears the setuid and setgid bits
+        os.chown(destination, st.st_uid, st.st_gid, follow_symlinks=False)
+        shutil.copystat(source, destination, follow_symlinks=False)
+
+    def copy(self, source: Path, destination: Path) -> None:
+        # Imported here, since most commands never need it
+        from .pool import ContextThreadPoolExecutor
+
+        directories: list[tuple[str, str, os.stat_result]] = []
+        # Hard links are made once every file they could point to exists
+        links: list[tuple[str, str]] = []
+        seen: dict[tuple[int, int], str] = {}
+
+        with ContextThreadPoolExecutor(self.jobs, thread_name_prefix="nixos-nspawn-copy") as pool:
+            futures = []
+            pending = [(str(source), str(destination))]
+            while pending:
+                source_dir, destination_dir = pending.pop()
+                directories.append((source_dir, destination_dir, os.lstat(source_dir)))
+                os.mkdir(destination_dir, 0o700)
+
+                with os.scandir(source_dir) as entries:
+                    for entry in entries:
+                        target = os.path.join(destination_dir, entry.name)
+                        st = entry.stat(follow_symlinks=False)
+                        if stat.S_ISDIR(st.st_mode):
+                            pending.append((entry.path, target))
+                        elif stat.S_ISREG(st.st_mode):
+                            if st.st_nlink > 1:
+                                if (original := seen.get((st.st_dev, st.st_ino))) is not None:
+                                    links.append((original, target))
+                                    continue
+                                seen[(st.st_dev, st.st_ino)] = target
+                            futures.append(pool.submit(self._copy_file, entry.path, target, st))
+                        elif stat.S_ISLNK(st.st_mode):
+                            os.symlink(os.readlink(entry.path), target)
+                            self._copy_metadata(entry.path, target, st)
+                        elif not stat.S_ISSOCK(st.st_mode):
+                            # Device nodes and FIFOs. Sockets are recreated by their servers.
+                            os.mknod(target, st.st_mode, st.st_rdev)
+                            self._copy_metadata(entry.path, target, st)
+
+            for future in futures:
+                future.result()
+
+        for original, target in links:
+            os.link(original, target)
+
+        # Deepest first, since adding entries changes a directory's modification time
+        for source_dir, destination_dir, st in reversed(directories):
+            self._copy_metadata(source_dir, destination_dir, st)
+
+
+def is_subvolume(path: Path) -> bool:
+    """Whether path is the root of a btrfs subvolume"""
+    # Other filesystems may have a directory with this inode number too, in which case
+    # the snapshot fails
+    return os.stat(path).st_ino == BTRFS_SUBVOLUME_INODE
+
+
+def _snapshot(source: Path, destination: Path) -> bool:
+    """Snapshots source if it is a btrfs subvolume. Returns whether it was."""
+    if not is_subvolume(source):
+        return False
+    try:
+        # btrfs reports what it did on stdout, which would corrupt --json output.
+        # run_command logs what it captures.
+        run_command(
+            ["btrfs", "subvolume", "snapshot", str(source), str(destination)],
+            capture_stdout=True,
+            capture_stderr=True,
+        )
+    except (CommandError, OSError) as err:
+        getLogger("nixos_nspawn.copy").debug("Cannot snapshot %s: %s", source, err)
+        return False
+    return True
+
+
+@traced(CATEGORY_FILESYSTEM)
+def copy_tree(source: Path, destination: Path, jobs: int = DEFAULT_COPY_JOBS) -> str:
+    """Copies the directory source to destination, which must not exist, in the quickest
+    way the filesystem supports. Returns which way that was.
+
+    A btrfs subvolume is snapshotted, and files on filesystems which support reflinks
+    share their data with the original. Both take the same time however large the
+    files are. Otherwise, files are copied in parallel.
+    """
+    if _snapshot(source, destination):
+        return COPY_SNAPSHOT
+
+    copier = _TreeCopier(max(1, jobs))
+    copier.copy(source, destination)
+    return COPY_REFLINK if copier.reflink else COPY_PLAIN
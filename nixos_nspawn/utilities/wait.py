@@ -0,0 +1,65 @@
+from collections.abc import Callable
+from dataclasses import dataclass
+from logging import getLogger
+from pathlib import Path
+from time import monotonic, sleep
+from typing import Optional
+
+from .inotify import IN_DIR_CHANGES, Inotify
+from .trace import CATEGORY_WAIT, traced
+
+# Used when inotify cannot be used, e.g. the watched directory does not exist yet
+FALLBACK_POLL_INTERVAL = 0.1
+
+
+@dataclass(frozen=True)
+class WaitResult:
+    satisfied: bool
+    elapsed: float
+
+    def __bool__(self) -> bool:
+        return self.satisfied
+
+
+@traced(CATEGORY_WAIT)
+def wait_for(
+    predicate: Callable[[], bool],
+    timeout: float,
+    watch_dir: Optional[Path] = None,
+) -> WaitResult:
+    """Waits until predicate() is true or the timeout expires.
+
+    The predicate is re-evaluated whenever an entry in watch_dir changes, so the wait
+    completes as soon as the condition holds rather than on the next polling tick.
+    """
+    logger = getLogger("nixos_nspawn.wait")
+    start = monotonic()
+    deadline = start + timeout
+
+    inotify: Optional[Inotify] = None
+    if watch_dir is not None:
+        try:
+            inotify = Inotify()
+            inotify.add_watch(watch_dir, IN_DIR_CHANGES)
+        except OSError as err:
+            logger.debug("Falling back to polling %s: %s", watch_dir, err)
+            if inotify:
+                inotify.close()
+            inotify = None
+
+    try:
+        # The watch is in place before the first check, so no change can be missed
+        while not predicate():
+            remaining = deadline - monotonic()
+            if remaining <= 0:
+                return WaitResult(False, monotonic() - start)
+
+            if inotify:
+                inotify.read_events(remaining)
+            else:
+                sleep(min(FALLBACK_POLL_INTERVAL, remaining))
+    finally:
+        if inotify:
+            inotify.close()
+
+    return WaitResult(True, monotonic() - start)
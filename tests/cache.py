@@ -0,0 +1,72 @@
+import json
+import unittest
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import mock
+
+from nixos_nspawn.backends import SubprocessBackend
+from nixos_nspawn.models import Container
+from nixos_nspawn.utilities import PersistentCache, path_cache_key
+
+
+class PersistentCacheTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self._tmp = TemporaryDirectory()
+        self.root = Path(self._tmp.name)
+        self.cache_path = self.root / "run" / "cache.marshal"
+
+    def tearDown(self) -> None:
+        self._tmp.cleanup()
+
+    def test_roundtrip(self) -> None:
+        cache = PersistentCache(self.cache_path)
+        cache.put("alpha", "profile_data", "key1", {"declarative": False})
+        cache.save()
+
+        cache = PersistentCache(self.cache_path)
+        self.assertEqual({"declarative": False}, cache.get("alpha", "profile_data", "key1"))
+        self.assertIsNone(cache.get("alpha", "profile_data", "key2"))
+        self.assertIsNone(cache.get("alpha", "profile_data", None))
+
+        cache.invalidate("alpha")
+        cache.save()
+        self.assertIsNone(PersistentCache(self.cache_path).get("alpha", "profile_data", "key1"))
+
+    def test_path_key_tracks_changes(self) -> None:
+        data = self.root / "data.json"
+        data.write_text("{}")
+        key = path_cache_key(data)
+        self.assertEqual(key, path_cache_key(data))
+
+        data.write_text('{"declarative": true}')
+        self.assertNotEqual(key, path_cache_key(data))
+        self.assertIsNone(path_cache_key(self.root / "missing.json"))
+
+    def test_container_profile_data(self) -> None:
+        data_dir = self.root / "profiles" / "alpha" / "system" / "nixos-nspawn"
+        data_dir.mkdir(parents=True)
+        (data_dir / "data.json").write_text(json.dumps({"declarative": False}))
+        cache = PersistentCache(self.cache_path)
+
+        with (
+            mock.patch("nixos_nspawn.models.container.NIX_PROFILE_DIR", self.root / "profiles"),
+            mock.patch("nixos_nspawn.models.container.DECLARATIVE_CONFIG_DIR", self.root / "decl"),
+        ):
+            container = Container(
+                self.root / "alpha.nspawn", backend=SubprocessBackend(), cache=cache
+            )
+            self.assertTrue(container.is_imperative)
+            cache.save()
+
+            # A fresh container is served from the cache without parsing JSON
+            container = Container(
+                self.root / "alpha.nspawn",
+                backend=SubprocessBackend(),
+                cache=PersistentCache(self.cache_path),
+            )
+            with mock.patch("nixos_nspawn.models.container.load") as load:
+                self.assertTrue(container.is_imperative)
+                load.assert_not_called()
+
+            # Unmanaged containers have no profile data at all
+            self.assertEqual({}, Container(self.root / "beta.nspawn", cache=cache).profile_data)
@@ -0,0 +1,123 @@
+import asyncio
+import sys
+import unittest
+from time import monotonic
+
+from nixos_nspawn.utilities import (
+    CommandError,
+    CommandStatsCollector,
+    CommandTimeoutError,
+    run_command,
+    run_command_async,
+    stream_command,
+)
+
+
+class RunCommandTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.stats = CommandStatsCollector()
+
+    def test_output_larger_than_pipe_buffer(self) -> None:
+        script = "import sys; sys.stdout.write('x' * 1_000_000); sys.stderr.write('y' * 1_000_000)"
+        _, stdout = run_command(
+            [sys.executable, "-c", script],
+            capture_stdout=True,
+            capture_stderr=True,
+            timeout=30,
+            collector=self.stats,
+        )
+        self.assertEqual(1_000_000, len(stdout))
+        (stats,) = self.stats.commands
+        self.assertEqual(0, stats.exit_code)
+        self.assertEqual(2_000_000, stats.output_bytes)
+
+    def test_streams_lines(self) -> None:
+        lines: list[tuple[str, str]] = []
+        _, stdout = run_command(
+            ["sh", "-c", "echo a; echo b >&2; echo c"],
+            capture_stdout=True,
+            capture_stderr=True,
+            on_line=lambda stream, line: lines.append((stream, line)),
+            collector=self.stats,
+        )
+        self.assertEqual("a\nc", stdout)
+        self.assertEqual([("stdout", "a"), ("stderr", "b"), ("stdout", "c")], lines)
+
+    def test_error_carries_output(self) -> None:
+        with self.assertRaises(CommandError) as err:
+            run_command(
+                ["sh", "-c", "echo broken >&2; exit 3"],
+                capture_stdout=True,
+                capture_stderr=True,
+                collector=self.stats,
+            )
+        self.assertEqual(3, err.exception.exit_code)
+        self.assertEqual("broken", str(err.exception))
+        self.assertEqual(1, self.stats.totals["sh"]["failed"])
+
+    def test_captures_stderr_alone(self) -> None:
+        with self.assertRaises(CommandError) as err:
+            run_command(
+                ["sh", "-c", "echo ignored; echo broken >&2; exit 3"],
+                capture_stderr=True,
+                collector=self.stats,
+            )
+        self.assertEqual("broken", str(err.exception))
+
+        with self.assertRaises(CommandError) as err:
+            asyncio.run(
+                run_command_async(
+                    ["sh", "-c", "echo ignored; echo broken >&2; exit 3"],
+                    capture_stderr=True,
+                    collector=self.stats,
+                )
+            )
+        self.assertEqual("broken", str(err.exception))
+
+    def test_timeout_kills_process_group(self) -> None:
+        start = monotonic()
+        with self.assertRaises(CommandTimeoutError):
+            # The background sleep holds the pipe open unless the whole group is killed
+            run_command(
+                ["sh", "-c", "sleep 30 & sleep 30"],
+                capture_stdout=True,
+                timeout=0.2,
+                collector=self.stats,
+            )
+        self.assertLess(monotonic() - start, 5)
+        self.assertTrue(self.stats.commands[0].timed_out)
+
+    def test_closing_stream_kills_command(self) -> None:
+        lines = stream_command(["sh", "-c", "echo ready; sleep 30"], collector=self.stats)
+        self.assertEqual(("stdout", "ready"), next(lines))
+        start = monotonic()
+        lines.close()
+        self.assertLess(monotonic() - start, 5)
+        self.assertEqual(1, len(self.stats.commands))
+
+
+class RunCommandAsyncTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.stats = CommandStatsCollector()
+
+    def test_concurrent(self) -> None:
+        async def run() -> list[tuple[int, str]]:
+            return await asyncio.gather(
+                *(
+                    run_command_async(
+                        ["sh", "-c", f"sleep 0.2; echo {i}"],
+                        capture_stdout=True,
+                        collector=self.stats,
+                    )
+                    for i in range(3)
+                )
+            )
+
+        start = monotonic()
+        self.assertEqual([(0, "0"), (0, "1"), (0, "2")], asyncio.run(run()))
+        self.assertLess(monotonic() - start, 0.6)
+        self.assertEqual(3, self.stats.totals["sh"]["count"])
+
+    def test_timeout(self) -> None:
+        with self.assertRaises(CommandTimeoutError):
+            asyncio.run(run_command_async(["sleep", "30"], timeout=0.2, collector=self.stats))
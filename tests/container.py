@@ -0,0 +1,181 @@
+import unittest
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import mock
+
+from nixos_nspawn.backends import HostActions
+from nixos_nspawn.models import Container
+
+NSPAWN_UNIT = """[Exec]
+Boot=false
+Parameters={toplevel}/init
+
+[Network]
+Port=tcp:{port}:{port}
+"""
+
+OVERRIDES = """[Service]
+ExecReload={toplevel}/bin/switch-to-configuration test
+TimeoutStartSec=1min
+"""
+
+
+class DynamicActivationTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self._tmp = TemporaryDirectory()
+        self.root = Path(self._tmp.name)
+        (self.root / "profiles" / "alpha").mkdir(parents=True)
+        self._patch = mock.patch(
+            "nixos_nspawn.models.container.NIX_PROFILE_DIR", self.root / "profiles"
+        )
+        self._patch.start()
+        self.container = Container(self.root / "nspawn" / "alpha.nspawn", backend=mock.Mock())
+
+    def tearDown(self) -> None:
+        self._patch.stop()
+        self._tmp.cleanup()
+
+    def make_system(self, toplevel: str, port: int = 80, network: str = "") -> Path:
+        system = self.root / "store" / toplevel
+        data = system / "nixos-nspawn"
+        data.mkdir(parents=True)
+        (data / "alpha.nspawn").write_text(NSPAWN_UNIT.format(toplevel=system, port=port))
+        (data / "service-overrides.conf").write_text(OVERRIDES.format(toplevel=system))
+        if network:
+            (data / "20-ve-alpha.network").write_text(network)
+        return system
+
+    def switch_to(self, system: Path) -> None:
+        link = self.root / "profiles" / "alpha" / "system"
+        link.unlink(missing_ok=True)
+        link.symlink_to(system)
+
+    def test_reload_when_only_the_system_changed(self) -> None:
+        previous = self.make_system("aaa-alpha")
+        self.switch_to(self.make_system("bbb-alpha"))
+
+        self.assertFalse(self.container.needs_restart(previous))
+        self.container.activate_config("dynamic", previous=previous)
+        self.container.backend.reload_unit.assert_called_once_with("systemd-nspawn@alpha.service")
+        self.container.backend.reboot_machine.assert_not_called()
+
+    def test_restart_when_the_unit_changed(self) -> None:
+        previous = self.make_system("aaa-alpha")
+        self.switch_to(self.make_system("bbb-alpha", port=8080))
+
+        self.assertTrue(self.container.needs_restart(previous))
+        self.container.activate_config("dynamic", previous=previous)
+        self.container.backend.reboot_machine.assert_called_once_with("alpha")
+
+    def test_restart_when_networks_changed(self) -> None:
+        previous = self.make_system("aaa-alpha", network="[Match]\nName=ve-alpha\n")
+        self.switch_to(self.make_system("bbb-alpha"))
+        self.assertTrue(self.container.needs_restart(previous))
+
+    def test_restart_without_previous(self) -> None:
+        self.switch_to(self.make_system("aaa-alpha"))
+        self.assertTrue(self.container.needs_restart(None))
+
+
+class ConfigFilesTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self._tmp = TemporaryDirectory()
+        self.root = Path(self._tmp.name)
+        (self.root / "profiles" / "alpha").mkdir(parents=True)
+        self._patches = [
+            mock.patch("nixos_nspawn.models.container.NIX_PROFILE_DIR", self.root / "profiles"),
+            mock.patch("nixos_nspawn.models.container.NIX_STORE_DIR", self.root / "store"),
+            mock.patch("nixos_nspawn.models.container.RUNTIME_UNIT_DIR", self.root / "run"),
+        ]
+        for patch in self._patches:
+            patch.start()
+        self.backend = mock.Mock()
+        self.backend.unit_needs_daemon_reload.return_value = False
+        self.host = HostActions(self.backend)
+        self.container = Container(
+            self.root / "etc" / "nspawn" / "alpha.nspawn", backend=self.backend, host=self.host
+        )
+        self.network_dir = self.root / "etc" / "network"
+        self.network_dir.parent.mkdir()
+
+    def tearDown(self) -> None:
+        for patch in self._patches:
+            patch.stop()
+        self._tmp.cleanup()
+
+    def make_system(self, toplevel: str, networks: dict[str, str]) -> Path:
+        system = self.root / "store" / toplevel
+        data = system / "nixos-nspawn"
+        data.mkdir(parents=True)
+        (data / "alpha.nspawn").write_text(NSPAWN_UNIT.format(toplevel="/init", port=80))
+        (data / "service-overrides.conf").write_text(OVERRIDES.format(toplevel="/sw"))
+        for name, contents in networks.items():
+            (data / name).write_text(contents)
+
+        link = self.root / "profiles" / "alpha" / "system"
+        link.unlink(missing_ok=True)
+        link.symlink_to(system)
+        return system
+
+    def actions(self) -> list[str]:
+        actions = [str(action) for action in self.host.performed]
+        self.host.performed.clear()
+        return actions
+
+    def test_first_write(self) -> None:
+        system = self.make_system("aaa-alpha", {"20-ve-alpha.network": "a"})
+        self.container.write_config_files()
+
+        link = self.network_dir / "20-ve-alpha.network"
+        self.assertEqual(system / "nixos-nspawn" / link.name, link.readlink())
+        self.assertEqual(
+            [
+                f"link {link}",
+                "reload systemd-networkd.service",
+                f"link {self.container.unit_file}",
+                f"copy {self.root}/run/systemd-nspawn@alpha.service.d/override.conf",
+            ],
+            self.actions(),
+        )
+
+    def test_unchanged_rewrite_does_nothing(self) -> None:
+        self.make_system("aaa-alpha", {"20-ve-alpha.network": "a"})
+        self.container.write_config_files()
+        self.container.reload()
+        self.actions()
+        self.backend.reset_mock()
+
+        self.container.write_config_files()
+        self.container.reload()
+        self.assertEqual([], self.actions())
+        self.backend.daemon_reload.assert_not_called()
+        self.backend.reload_unit.assert_called_once_with("systemd-nspawn@alpha.service")
+
+    def test_stale_networks_removed(self) -> None:
+        self.make_system("aaa-alpha", {"20-ve-alpha.network": "a", "30-vz-alpha.network": "b"})
+        self.container.write_config_files()
+        # Belongs to another container
+        (self.network_dir / "20-ve-beta.network").symlink_to(
+            self.root / "store" / "ccc-beta" / "nixos-nspawn" / "20-ve-beta.network"
+        )
+        self.actions()
+
+        self.make_system("bbb-alpha", {"20-ve-alpha.network": "a"})
+        self.container.write_config_files()
+
+        self.assertEqual(
+            ["20-ve-alpha.network", "20-ve-beta.network"],
+            sorted(path.name for path in self.network_dir.iterdir()),
+        )
+        actions = self.actions()
+        self.assertIn(f"unlink {self.network_dir / '30-vz-alpha.network'}", actions)
+        self.assertEqual(1, actions.count("reload systemd-networkd.service"))
+        # Only the store path changed, not the overrides' contents
+        self.assertNotIn("copy", " ".join(actions))
+
+    def test_changed_overrides_reload_daemon(self) -> None:
+        self.make_system("aaa-alpha", {})
+        self.container.write_config_files()
+        self.container.reload()
+        self.backend.daemon_reload.assert_called_once_with()
+        self.assertIn("daemon-reload", self.actions())
@@ -0,0 +1,319 @@
+import json
+import logging
+import threading
+import unittest
+from argparse import Namespace
+from contextlib import redirect_stdout
+from io import StringIO
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import mock
+
+import nixos_nspawn
+from nixos_nspawn.daemon import (
+    ContainerWatcher,
+    DaemonClient,
+    DaemonError,
+    DaemonServer,
+    DaemonUnavailableError,
+)
+from nixos_nspawn.daemon.events import ChangeSet, EventStream
+from nixos_nspawn.daemon.server import absolute_arguments
+from nixos_nspawn.manager import NixosNspawnManager
+from nixos_nspawn.utilities import FileLocks, MachineStateSnapshot, PersistentCache
+from nixos_nspawn.utilities.pool import ContextThreadPoolExecutor
+
+
+class DaemonTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        tmp = TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.root = Path(tmp.name)
+        self.unit_file_dir = self.root / "nspawn"
+        self.profile_dir = self.root / "profiles"
+        self.machined_dir = self.root / "machines"
+        for path in (self.unit_file_dir, self.profile_dir, self.machined_dir):
+            path.mkdir()
+
+        self.cache = PersistentCache(self.root / "cache.marshal")
+        self.machine_state = MachineStateSnapshot(self.machined_dir)
+        self.watcher = ContainerWatcher(
+            self.unit_file_dir,
+            self.cache,
+            self.machine_state,
+            profile_dir=self.profile_dir,
+            declarative_dir=self.root / "declarative.d",
+            machined_dir=self.machined_dir,
+        )
+
+
+class ContainerWatcherTest(DaemonTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        (self.unit_file_dir / "alpha.nspawn").touch()
+        self.watcher.open()
+        self.addCleanup(self.watcher.stop)
+
+    def test_index_follows_unit_files(self) -> None:
+        self.assertEqual(["alpha"], self.watcher.names())
+
+        (self.unit_file_dir / "beta.nspawn").touch()
+        (self.unit_file_dir / "alpha.nspawn").unlink()
+        (self.unit_file_dir / "notes.txt").touch()
+        self.watcher.poll()
+
+        self.assertEqual(["beta"], self.watcher.names())
+
+    def test_machine_state_follows_machined(self) -> None:
+        self.assertIsNone(self.machine_state.get("alpha"))
+
+        (self.machined_dir / "alpha").write_text("NAME=alpha\nLEADER=100\n")
+        self.watcher.poll()
+
+        self.assertEqual("running", self.machine_state.state("alpha"))
+
+    def test_new_profiles_are_watched(self) -> None:
+        (self.profile_dir / "alpha").mkdir()
+        self.watcher.poll()
+        self.cache.put("alpha", "profile_data", "key", {})
+
+        (self.profile_dir / "alpha" / "system").symlink_to("/nix/store/aaa-alpha")
+        self.watcher.poll()
+
+        self.assertIsNone(self.cache.get("alpha", "profile_data", "key"))
+
+
+class DaemonServerTest(DaemonTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        (self.unit_file_dir / "alpha.nspawn").write_text("[Exec]\nBoot=false\n")
+        self.socket = self.root / "daemon.sock"
+        self.server = DaemonServer(
+            self.unit_file_dir,
+            socket_path=self.socket,
+            cache=self.cache,
+            machine_state=self.machine_state,
+            watcher=self.watcher,
+        )
+        self.server.bind()
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(self.server.shutdown)
+        self.client = DaemonClient(self.socket, timeout=10)
+
+    def test_socket_is_private(self) -> None:
+        self.assertEqual(0, self.socket.stat().st_mode & 0o077)
+
+    def test_ping(self) -> None:
+        self.assertIn("version", self.client.ping())
+
+    def test_run(self) -> None:
+        args = ["--unit-file-dir", str(self.unit_file_dir), "list", "--json"]
+        result = self.client.call("run", args=args, cwd="/")
+        self.assertEqual(0, result["exit_code"])
+        self.assertEqual([], json.loads(result["stdout"]))
+
+    def test_rich_output(self) -> None:
+        args = ["--unit-file-dir", str(self.unit_file_dir), "list"]
+        result = self.client.call("run", args=args, cwd="/")
+        self.assertEqual("Showing 0 of 1 containers:\n", result["stdout"])
+
+    def test_other_unit_file_dir(self) -> None:
+        with self.assertRaises(DaemonUnavailableError):
+            self.client.call("run", args=["--unit-file-dir", "/elsewhere", "list"])
+
+    def test_unknown_method(self) -> None:
+        with self.assertRaises(DaemonError):
+            self.client.call("launch")
+
+    def test_cli_uses_daemon(self) -> None:
+        stdout = StringIO()
+        args = ["nixos-nspawn", "--unit-file-dir", str(self.unit_file_dir), "list", "--json"]
+        with (
+            mock.patch("nixos_nspawn.constants.DAEMON_SOCKET", self.socket),
+            redirect_stdout(stdout),
+        ):
+            self.assertEqual(0, nixos_nspawn.main(args))
+
+        self.assertEqual([], json.loads(stdout.getvalue()))
+        self.assertEqual(1, self.server.requests)
+
+    def test_cli_without_daemon(self) -> None:
+        stdout = StringIO()
+        args = ["nixos-nspawn", "--unit-file-dir", str(self.unit_file_dir), "list", "--json"]
+        with (
+            mock.patch("nixos_nspawn.constants.DAEMON_SOCKET", self.root / "missing.sock"),
+            redirect_stdout(stdout),
+        ):
+            self.assertEqual(0, nixos_nspawn.main(args))
+
+        self.assertEqual([], json.loads(stdout.getvalue()))
+        self.assertEqual(0, self.server.requests)
+
+    def test_errors_reach_the_client(self) -> None:
+        args = ["--unit-file-dir", str(self.unit_file_dir), "update", "alpha"]
+        result = self.client.call("run", args=[*args, "--profile", "/a", "--flake", "/b"])
+        self.assertEqual(1, result["exit_code"])
+        self.assertIn("mutually exclusive", result["stdout"])
+
+    def test_worker_logs_reach_the_client(self) -> None:
+        logger = logging.getLogger("nixos_nspawn.test")
+        logger.setLevel(logging.INFO)
+        self.addCleanup(logger.setLevel, logging.NOTSET)
+        elsewhere = threading.Thread(target=logger.info, args=("another request",))
+
+        with self.server._capture_logs(verbose=False) as logs:
+            with ContextThreadPoolExecutor(2) as pool:
+                pool.submit(logger.info, "from a worker").result()
+            elsewhere.start()
+            elsewhere.join()
+
+        self.assertIn("from a worker", logs.getvalue())
+        self.assertNotIn("another request", logs.getvalue())
+
+    def test_builds_need_the_same_environment(self) -> None:
+        args = ["--unit-file-dir", str(self.unit_file_dir), "update", "alpha", "--profile", "/a"]
+        with mock.patch.dict("os.environ", {"NIXOS_NSPAWN_EVAL": "/daemon/eval.nix"}):
+            with self.assertRaises(DaemonUnavailableError):
+                self.client.call("run", args=args, environment={"NIXOS_NSPAWN_EVAL": "/eval.nix"})
+            with self.assertRaises(DaemonUnavailableError):
+                self.client.call("run", args=args)
+
+            # Reads don't build anything
+            list_args = ["--unit-file-dir", str(self.unit_file_dir), "list"]
+            self.assertEqual(0, self.client.call("run", args=list_args)["exit_code"])
+
+    def test_lock_timeout_is_passed(self) -> None:
+        args = ["--unit-file-dir", str(self.unit_file_dir), "--lock-timeout", "5", "list"]
+        with mock.patch(
+            "nixos_nspawn.daemon.server.NixosNspawnManager", wraps=NixosNspawnManager
+        ) as manager:
+            self.assertEqual(0, self.client.call("run", args=args)["exit_code"])
+        self.assertEqual(5, manager.call_args.kwargs["locks"].timeout)
+
+    def test_lock_timeout_between_clients(self) -> None:
+        lock_dir = self.root / "locks"
+        held = threading.Event()
+        release = threading.Event()
+
+        def hold() -> None:
+            with FileLocks(lock_dir).container("alpha"):
+                held.set()
+                release.wait(10)
+
+        holder = threading.Thread(target=hold)
+        holder.start()
+        self.addCleanup(holder.join)
+        self.addCleanup(release.set)
+        held.wait(10)
+
+        args = ["--unit-file-dir", str(self.unit_file_dir), "--lock-timeout", "0.1"]
+        with mock.patch("nixos_nspawn.utilities.lock.LOCK_DIR", lock_dir):
+            result = self.client.call("run", args=[*args, "remove", "alpha"])
+        self.assertNotEqual(0, result["exit_code"])
+        self.assertIn("lock on alpha", result["stdout"] + result["stderr"])
+
+
+class AbsoluteArgumentsTest(unittest.TestCase):
+    def test_relative_paths(self) -> None:
+        args = Namespace(
+            config=Path("containers/alpha.nix"),
+            profile=Path("/nix/store/aaa-alpha"),
+            flake="./src#alpha",
+        )
+        absolute_arguments(args, "/home/user")
+
+        self.assertEqual(Path("/home/user/containers/alpha.nix"), args.config)
+        self.assertEqual(Path("/nix/store/aaa-alpha"), args.profile)
+        self.assertEqual("/home/user/src#alpha", args.flake)
+
+    def test_remote_flakes(self) -> None:
+        args = Namespace(flake="github:owner/repo#alpha")
+        absolute_arguments(args, "/home/user")
+        self.assertEqual("github:owner/repo#alpha", args.flake)
+
+
+class EventStreamTest(DaemonTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.changes = ChangeSet()
+        self.watcher.listener = self.changes.add
+        for target, value in (
+            ("nixos_nspawn.models.container.NIX_PROFILE_DIR", self.profile_dir),
+            ("nixos_nspawn.models.container.DECLARATIVE_CONFIG_DIR", self.root / "declarative.d"),
+        ):
+            patch = mock.patch(target, value)
+            patch.start()
+            self.addCleanup(patch.stop)
+
+        self.install_generation("alpha", 1)
+        (self.unit_file_dir / "alpha.nspawn").touch()
+        self.watcher.open()
+        self.addCleanup(self.watcher.stop)
+
+        manager = NixosNspawnManager(
+            self.unit_file_dir,
+            backend=mock.Mock(),
+            machine_state=self.machine_state,
+            cache=self.cache,
+        )
+        self.stream = EventStream(manager)
+        self.snapshot = self.stream.snapshot(self.watcher.names())
+
+    def install_generation(self, name: str, generation: int) -> None:
+        system = self.root / "store" / f"{generation}-{name}"
+        (system / "nixos-nspawn").mkdir(parents=True)
+        (system / "nixos-nspawn" / "data.json").write_text('{"declarative": false}')
+
+        profile = self.profile_dir / name
+        profile.mkdir(exist_ok=True)
+        (profile / f"system-{generation}-link").symlink_to(system)
+        (profile / ".system").symlink_to(f"system-{generation}-link")
+        (profile / ".system").replace(profile / "system")
+
+    def events(self) -> list[dict]:
+        self.watcher.poll()
+        events = self.stream.update(self.watcher.names(), self.changes.take(0))
+        return [{k: v for k, v in event.items() if k != "time"} for event in events]
+
+    def test_snapshot(self) -> None:
+        self.assertEqual("snapshot", self.snapshot["event"])
+        [alpha] = self.snapshot["containers"]
+        self.assertEqual(
+            ("alpha", "powered off", 1), (alpha["name"], alpha["state"], alpha["generation"])
+        )
+
+    def test_state_change(self) -> None:
+        (self.machined_dir / "alpha").write_text("NAME=alpha\nLEADER=100\n")
+        self.assertEqual(
+            [{"event": "state", "name": "alpha", "state": "running", "previous": "powered off"}],
+            self.events(),
+        )
+        self.assertEqual([], self.events())
+
+    def test_new_generation(self) -> None:
+        self.install_generation("alpha", 2)
+        [event] = self.events()
+        self.assertEqual(
+            ("generation", 2, 1), (event["event"], event["generation"], event["previous"])
+        )
+
+    def test_added_and_removed(self) -> None:
+        self.install_generation("beta", 1)
+        (self.unit_file_dir / "beta.nspawn").touch()
+        (self.unit_file_dir / "alpha.nspawn").unlink()
+
+        events = self.events()
+        self.assertEqual(["removed", "added"], [event["event"] for event in events])
+        self.assertEqual(["alpha", "beta"], [event["name"] for event in events])
+
+    def test_changes_are_coalesced(self) -> None:
+        self.changes.add("machine", "alpha")
+        self.changes.add("profile", "alpha")
+        self.assertEqual({"alpha": {"machine", "profile"}}, self.changes.take(0))
+        self.assertEqual({}, self.changes.take(0))
+
+        self.changes.add("machine", "alpha")
+        self.changes.add("all", "")
+        self.assertIsNone(self.changes.take(0))
@@ -0,0 +1,184 @@
+import shutil
+import subprocess
+import unittest
+from pathlib import Path
+from signal import SIGRTMIN
+from tempfile import TemporaryDirectory
+from threading import Event, Thread
+from typing import Optional
+
+try:
+    from jeepney import DBusAddress, MessageType, new_error, new_method_return, new_signal
+    from jeepney.bus_messages import message_bus
+    from jeepney.io.blocking import DBusConnection, open_dbus_connection
+
+    from nixos_nspawn.backends.dbus_backend import DBusBackend, DBusBackendError
+except ImportError:
+    DBusBackend = None  # type: ignore[assignment,misc]
+
+DBUS_DAEMON = shutil.which("dbus-daemon")
+
+BUS_CONFIG = """<!DOCTYPE busconfig PUBLIC "-//freedesktop//DTD D-Bus Bus Configuration 1.0//EN"
+ "http://www.freedesktop.org/standards/dbus/1.0/busconfig.dtd">
+<busconfig>
+  <type>session</type>
+  <listen>unix:path={socket}</listen>
+  <auth>EXTERNAL</auth>
+  <policy context="default">
+    <allow send_destination="*" eavesdrop="true"/>
+    <allow eavesdrop="true"/>
+    <allow own="*"/>
+  </policy>
+</busconfig>
+"""
+
+
+class FakeSystemd(Thread):
+    """Serves just enough of the machine1 and systemd1 APIs for the backend"""
+
+    def __init__(self, address: str) -> None:
+        super().__init__(daemon=True)
+        self.address = address
+        self.calls: list[tuple[str, tuple]] = []
+        self.ready = Event()
+        self.jobs = 0
+        self.connection: Optional[DBusConnection] = None
+
+    def reply(self, msg, member: str):  # noqa: ANN001, ANN201
+        body = msg.body
+        if member == "GetMachine":
+            if body[0] != "alpha":
+                return new_error(msg, "org.freedesktop.machine1.NoSuchMachine", "s", ("No such",))
+            return new_method_return(msg, "o", ("/org/freedesktop/machine1/machine/alpha",))
+        if member == "GetUnit":
+            if body[0] != "systemd-nspawn@alpha.service":
+                return new_error(msg, "org.freedesktop.systemd1.NoSuchUnit", "s", ("No such",))
+            return new_method_return(msg, "o", ("/org/freedesktop/systemd1/unit/alpha",))
+        if member == "Get":
+            values = {
+                "State": ("s", "running"),
+                "Leader": ("u", 1234),
+                "NeedDaemonReload": ("b", True),
+            }
+            return new_method_return(msg, "v", (values[body[1]],))
+        if member in ("StartUnit", "ReloadUnit"):
+            self.jobs += 1
+            return new_method_return(msg, "o", (f"/org/freedesktop/systemd1/job/{self.jobs}",))
+        if member == "RevertUnitFiles":
+            return new_method_return(msg, "a(sss)", ([],))
+        return new_method_return(msg)
+
+    def run(self) -> None:
+        self.connection = conn = open_dbus_connection(self.address)
+        for name in ("org.freedesktop.systemd1", "org.freedesktop.machine1"):
+            conn.send_and_get_reply(message_bus.RequestName(name))
+        self.ready.set()
+
+        while True:
+            try:
+                msg = conn.receive()
+            except (OSError, EOFError):
+                return
+            if msg.header.message_type != MessageType.method_call:
+                continue
+
+            member = msg.header.fields[3]
+            self.calls.append((member, msg.body))
+            conn.send(self.reply(msg, member))
+
+            if member in ("StartUnit", "ReloadUnit"):
+                conn.send(
+                    new_signal(
+                        DBusAddress(
+                            "/org/freedesktop/systemd1",
+                            interface="org.freedesktop.systemd1.Manager",
+                        ),
+                        "JobRemoved",
+                        "uoss",
+                        (
+                            self.jobs,
+                            f"/org/freedesktop/systemd1/job/{self.jobs}",
+                            msg.body[0],
+                            "failed" if msg.body[0] == "broken.service" else "done",
+                        ),
+                    )
+                )
+
+
+@unittest.skipIf(DBusBackend is None or DBUS_DAEMON is None, "Needs jeepney and dbus-daemon")
+class DBusBackendTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self._tmp = TemporaryDirectory()
+        tmp = Path(self._tmp.name)
+        config = tmp / "bus.conf"
+        config.write_text(BUS_CONFIG.format(socket=tmp / "bus"))
+
+        self.daemon = subprocess.Popen(
+            [str(DBUS_DAEMON), "--nofork", "--print-address", f"--config-file={config}"],
+            stdout=subprocess.PIPE,
+        )
+        assert self.daemon.stdout
+        address = self.daemon.stdout.readline().decode().strip()
+
+        self.service = FakeSystemd(address)
+        self.service.start()
+        self.service.ready.wait(5)
+
+        self.backend = DBusBackend(address=address, timeout=5)
+
+    def tearDown(self) -> None:
+        self.backend.close()
+        self.daemon.terminate()
+        self.daemon.wait()
+        self._tmp.cleanup()
+
+    def test_machine_properties(self) -> None:
+        self.assertEqual("running", self.backend.get_machine_property("alpha", "State"))
+        self.assertEqual("1234", self.backend.get_machine_property("alpha", "Leader"))
+        with self.assertRaises(DBusBackendError):
+            self.backend.get_machine_property("beta", "State")
+
+    def test_need_daemon_reload(self) -> None:
+        self.assertTrue(self.backend.unit_needs_daemon_reload("systemd-nspawn@alpha.service"))
+        self.assertFalse(self.backend.unit_needs_daemon_reload("systemd-nspawn@beta.service"))
+
+    def test_jobs(self) -> None:
+        self.backend.start_machine("alpha")
+        self.backend.reload_unit("systemd-networkd.service")
+        with self.assertRaises(DBusBackendError):
+            self.backend.reload_unit("broken.service")
+
+        members = [member for member, _ in self.service.calls]
+        self.assertEqual(1, members.count("Subscribe"))
+        self.assertIn(
+            ("StartUnit", ("systemd-nspawn@alpha.service", "replace")), self.service.calls
+        )
+
+    def test_threads_have_own_connections(self) -> None:
+        errors: list[BaseException] = []
+
+        def start() -> None:
+            try:
+                self.backend.start_machine("alpha")
+            except BaseException as err:
+                errors.append(err)
+
+        threads = [Thread(target=start) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+
+        self.assertEqual([], errors)
+        members = [member for member, _ in self.service.calls]
+        # Each thread's connection subscribes to job signals separately
+        self.assertEqual(3, members.count("Subscribe"))
+        self.assertEqual(3, members.count("StartUnit"))
+
+    def test_power(self) -> None:
+        self.backend.poweroff_machine("alpha")
+        self.backend.reboot_machine("alpha")
+        self.backend.revert_unit("systemd-nspawn@alpha.service")
+
+        self.assertIn(("KillMachine", ("alpha", "leader", int(SIGRTMIN) + 4)), self.service.calls)
+        self.assertEqual("Reload", self.service.calls[-1][0])
@@ -0,0 +1,80 @@
+import os
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import mock
+
+from nixos_nspawn.utilities import DurableWriter, durable
+
+
+class DurableWriterTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self._tmp = TemporaryDirectory()
+        self.root = Path(self._tmp.name)
+        self.writer = DurableWriter()
+
+    def tearDown(self) -> None:
+        self._tmp.cleanup()
+
+    def test_symlink_replaces_atomically(self) -> None:
+        link = self.root / "alpha.nspawn"
+        link.symlink_to("/old")
+        with mock.patch.object(durable.os, "replace", wraps=os.replace) as replace:
+            self.writer.symlink(link, "/new")
+        # Renamed over the old link, never unlinked first
+        replace.assert_called_once()
+        self.assertEqual("/new", os.readlink(link))
+        self.assertEqual(["alpha.nspawn"], os.listdir(self.root))
+
+    def test_write_bytes(self) -> None:
+        path = self.root / "override.conf"
+        path.write_text("old")
+        self.writer.write_bytes(path, b"new")
+        self.assertEqual(b"new", path.read_bytes())
+        self.assertEqual(0o644, path.stat().st_mode & 0o777)
+        self.assertEqual(["override.conf"], os.listdir(self.root))
+
+    def test_threads_write_the_same_file(self) -> None:
+        path = self.root / "override.conf"
+        data = [f"thread {index}".encode() for index in range(8)]
+        with ThreadPoolExecutor(8) as pool:
+            list(pool.map(lambda contents: self.writer.write_bytes(path, contents), data * 20))
+        self.writer.sync()
+
+        self.assertIn(path.read_bytes(), data)
+        self.assertEqual(["override.conf"], os.listdir(self.root))
+        self.assertFalse(self.writer.pending)
+
+    def test_sync_only_touches_what_changed(self) -> None:
+        self.writer.symlink(self.root / "a", "/a")
+        self.writer.add_filesystem(self.root)
+        self.writer.add_filesystem(self.root / "a")  # Missing target, ignored
+
+        with (
+            mock.patch.object(durable, "syncfs") as syncfs,
+            mock.patch.object(durable, "fsync_directory") as fsync_directory,
+            mock.patch.object(durable.os, "sync") as sync,
+        ):
+            self.writer.sync()
+            self.writer.sync()
+
+        syncfs.assert_called_once_with(self.root)
+        fsync_directory.assert_called_once_with(self.root)
+        sync.assert_not_called()
+        self.assertFalse(self.writer.pending)
+
+    def test_filesystems_synced_before_links(self) -> None:
+        calls: list[str] = []
+        self.writer.add_filesystem(self.root)
+        with mock.patch.object(durable, "syncfs", side_effect=lambda _: calls.append("syncfs")):
+            with mock.patch.object(
+                durable.os, "replace", side_effect=lambda *_: calls.append("replace")
+            ):
+                self.writer.symlink(self.root / "a", "/a")
+                self.writer.symlink(self.root / "b", "/b")
+        self.assertEqual(["syncfs", "replace", "replace"], calls)
+
+    def test_syncfs(self) -> None:
+        durable.syncfs(self.root)
+        durable.fsync_directory(self.root)
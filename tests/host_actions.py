@@ -0,0 +1,64 @@
+import unittest
+from unittest import mock
+
+from nixos_nspawn.backends import DAEMON_RELOAD, HostActions
+
+
+class HostActionsTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.backend = mock.Mock()
+        self.host = HostActions(self.backend)
+        self._patch = mock.patch.object(self.host.durable, "sync")
+        self.sync = self._patch.start()
+
+    def tearDown(self) -> None:
+        self._patch.stop()
+
+    def test_immediate_outside_batch(self) -> None:
+        self.host.reload_networkd("alpha")
+        self.host.reload_networkd("beta")
+        self.host.sync()
+        self.assertEqual(2, self.backend.reload_unit.call_count)
+        self.sync.assert_called_once_with()
+        # Only needed by reloads
+        self.host.daemon_reload("alpha")
+        self.backend.daemon_reload.assert_not_called()
+        self.assertTrue(self.host.is_pending(DAEMON_RELOAD))
+        self.assertEqual(0, self.host.saved)
+
+    def test_batch_coalesces(self) -> None:
+        with self.host.batch():
+            for name in ("alpha", "beta", "gamma"):
+                self.host.reload_networkd(name)
+                self.host.sync(name)
+                self.host.daemon_reload(name)
+            self.backend.reload_unit.assert_not_called()
+
+            # The first start needs the networks and files, but not a daemon-reload
+            self.host.flush("sync", "reload-networkd")
+            self.backend.reload_unit.assert_called_once_with("systemd-networkd.service")
+            self.sync.assert_called_once_with()
+
+            with self.host.batch():
+                self.host.reload_networkd("delta")
+            # The inner batch doesn't flush
+            self.assertEqual(1, self.backend.reload_unit.call_count)
+
+        self.assertEqual(2, self.backend.reload_unit.call_count)
+        self.backend.daemon_reload.assert_not_called()
+        # 2 networkd reloads, 2 syncs and 3 daemon-reloads weren't needed
+        self.assertEqual(7, self.host.saved)
+        self.assertEqual(
+            ["sync", "reload systemd-networkd.service", "reload systemd-networkd.service"],
+            [str(action) for action in self.host.performed],
+        )
+        self.assertEqual(2, len(self.host.for_container("alpha")))
+
+    def test_reload_flushes_daemon_reload_once(self) -> None:
+        with self.host.batch():
+            self.host.daemon_reload("alpha")
+            self.host.daemon_reload("beta")
+            self.host.flush()
+            self.host.flush()
+        self.backend.daemon_reload.assert_called_once_with()
+        self.assertEqual(1, self.host.saved)
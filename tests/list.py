@@ -0,0 +1,75 @@
+import json
+import unittest
+from contextlib import redirect_stdout
+from io import StringIO
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import mock
+
+import nixos_nspawn
+from nixos_nspawn.utilities import MachineStateSnapshot
+
+
+class ListFieldsTest(unittest.TestCase):
+    def setUp(self) -> None:
+        tmp = TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        root = Path(tmp.name)
+        self.unit_file_dir = root / "nspawn"
+        self.unit_file_dir.mkdir()
+        for index, name in enumerate(("alpha", "beta", "gamma")):
+            data_dir = root / "profiles" / name / "system" / "nixos-nspawn"
+            data_dir.mkdir(parents=True)
+            (data_dir / "data.json").write_text(json.dumps({"declarative": index == 2}))
+            (self.unit_file_dir / f"{name}.nspawn").touch()
+        (self.unit_file_dir / "unmanaged.nspawn").touch()
+
+        for target, value in (
+            ("nixos_nspawn.models.container.NIX_PROFILE_DIR", root / "profiles"),
+            ("nixos_nspawn.models.container.DECLARATIVE_CONFIG_DIR", root / "declarative.d"),
+            ("nixos_nspawn.utilities.cache.RUNTIME_DIR", root / "run"),
+            ("nixos_nspawn.constants.DAEMON_SOCKET", root / "daemon.sock"),
+        ):
+            patch = mock.patch(target, value)
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def list(self, *args: str) -> str:
+        stdout = StringIO()
+        with redirect_stdout(stdout):
+            argv = ["nixos-nspawn", "--unit-file-dir", str(self.unit_file_dir), "list", *args]
+            self.assertEqual(0, nixos_nspawn.main(argv))
+        return stdout.getvalue()
+
+    def test_ndjson_fields(self) -> None:
+        with mock.patch.object(
+            MachineStateSnapshot, "_collect", side_effect=AssertionError("machined was queried")
+        ):
+            output = self.list("--fields", "name,type", "--ndjson")
+
+        self.assertEqual(
+            [
+                {"name": "alpha", "type": "imperative"},
+                {"name": "beta", "type": "imperative"},
+                {"name": "gamma", "type": "declarative"},
+            ],
+            [json.loads(line) for line in output.splitlines()],
+        )
+
+    def test_filter(self) -> None:
+        output = self.list("--filter", "type=declarative", "--json")
+        self.assertEqual(["gamma"], [row["name"] for row in json.loads(output)])
+
+    def test_table(self) -> None:
+        with mock.patch.object(MachineStateSnapshot, "_collect", return_value={}):
+            output = self.list("--table")
+
+        self.assertEqual(
+            [
+                "NAME   TYPE         STATE",
+                "alpha  imperative   powered off",
+                "beta   imperative   powered off",
+                "gamma  declarative  powered off",
+            ],
+            output.splitlines(),
+        )
@@ -0,0 +1,90 @@
+import fcntl
+import os
+import unittest
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from threading import Event, Thread
+from unittest import mock
+
+from nixos_nspawn.backends import HostActions
+from nixos_nspawn.utilities import FileLocks, LockStatsCollector, LockTimeoutError
+
+
+class FileLocksTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self._tmp = TemporaryDirectory()
+        self.addCleanup(self._tmp.cleanup)
+        self.lock_dir = Path(self._tmp.name) / "locks"
+        self.stats = LockStatsCollector()
+        self.locks = FileLocks(self.lock_dir, timeout=0.2, stats=self.stats)
+
+    def hold_elsewhere(self, name: str) -> int:
+        """Locks a container as another process would, through its own open file"""
+        path = self.lock_dir / "containers" / f"{name}.lock"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd = os.open(path, os.O_RDWR | os.O_CREAT)
+        self.addCleanup(os.close, fd)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        return fd
+
+    def test_reentrant(self) -> None:
+        with self.locks.container("alpha"), self.locks.container("alpha"):
+            fd = os.open(self.lock_dir / "containers" / "alpha.lock", os.O_RDWR)
+            self.addCleanup(os.close, fd)
+            with self.assertRaises(BlockingIOError):
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+        # Released once the outermost block ends
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        self.assertEqual(2, self.stats.totals["container"]["count"])
+
+    def test_other_process_times_out(self) -> None:
+        self.hold_elsewhere("alpha")
+
+        with self.assertRaises(LockTimeoutError), self.locks.container("alpha"):
+            self.fail("Should not have been locked")
+        # Unrelated containers are not held up
+        with self.locks.container("beta"):
+            pass
+
+        totals = self.stats.totals["container"]
+        self.assertEqual((2, 1, 1), (totals["count"], totals["contended"], totals["timeouts"]))
+        self.assertGreaterEqual(totals["waited"], 0.2)
+
+    def test_threads_take_turns(self) -> None:
+        locked, release = Event(), Event()
+
+        def hold() -> None:
+            with self.locks.container("alpha"):
+                locked.set()
+                release.wait()
+
+        thread = Thread(target=hold)
+        thread.start()
+        locked.wait()
+        Thread(target=lambda: release.wait(0.05) or release.set()).start()
+
+        with self.locks.container("alpha"):
+            self.assertTrue(release.is_set())
+        thread.join()
+        self.assertEqual(1, self.stats.totals["container"]["contended"])
+
+    def test_unwritable_directory(self) -> None:
+        self.lock_dir.write_text("")
+        with self.locks.container("alpha"), self.locks.host():
+            pass
+        self.assertEqual(0, self.stats.totals["host"]["timeouts"])
+
+    def test_host_reloads_are_locked(self) -> None:
+        backend = mock.Mock()
+        host = HostActions(backend, self.locks)
+        with mock.patch.object(self.locks, "host", wraps=self.locks.host) as host_lock:
+            host.reload_networkd("alpha")
+            host.sync("alpha")
+
+        backend.reload_unit.assert_called_once()
+        host_lock.assert_called_once_with()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,50 @@
+import unittest
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import mock
+
+from nixos_nspawn.utilities import STATE_POWERED_OFF, MachineStateSnapshot
+
+
+class MachineStateSnapshotTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self._tmp = TemporaryDirectory()
+        self.state_dir = Path(self._tmp.name)
+        (self.state_dir / "running").write_text(
+            "# This is private data. Do not parse.\nNAME=running\nLEADER=100\n"
+        )
+        (self.state_dir / "opening").write_text("NAME=opening\nSCOPE_JOB=/job/1\n")
+        (self.state_dir / "unit:systemd-nspawn@running.service").symlink_to("running")
+
+    def tearDown(self) -> None:
+        self._tmp.cleanup()
+
+    def test_states(self) -> None:
+        snapshot = MachineStateSnapshot(self.state_dir)
+        self.assertEqual("running", snapshot.state("running"))
+        self.assertEqual("opening", snapshot.state("opening"))
+        self.assertEqual(STATE_POWERED_OFF, snapshot.state("missing"))
+        self.assertEqual("100", snapshot.get("running")["LEADER"])
+        self.assertEqual(2, len(snapshot.machines))
+
+    def test_single_collection(self) -> None:
+        snapshot = MachineStateSnapshot(self.state_dir)
+        with mock.patch("nixos_nspawn.utilities.machine_state.scandir") as scandir:
+            scandir.return_value.__enter__.return_value = []
+            for _ in range(5):
+                snapshot.state("running")
+            self.assertEqual(1, scandir.call_count)
+
+    def test_refresh(self) -> None:
+        snapshot = MachineStateSnapshot(self.state_dir)
+        self.assertEqual("running", snapshot.state("running"))
+
+        (self.state_dir / "running").unlink()
+        self.assertEqual("running", snapshot.state("running"))
+
+        snapshot.refresh("running")
+        self.assertEqual(STATE_POWERED_OFF, snapshot.state("running"))
+
+        (self.state_dir / "new").write_text("NAME=new\n")
+        snapshot.refresh()
+        self.assertEqual("running", snapshot.state("new"))
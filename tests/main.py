@@ -1,12 +1,40 @@
+import subprocess
+import sys
 import unittest
+from contextlib import redirect_stderr
+from io import StringIO
+from tempfile import TemporaryDirectory
 
 import nixos_nspawn
 
 
 class CommandTest(unittest.TestCase):
+    def setUp(self) -> None:
+        tmp = TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.unit_file_dir = tmp.name
+
     def test_help(self) -> None:
         self.assertEqual(
             0,
             nixos_nspawn.main(["nixos-nspawn", "--help"]),
             msg="Non-0 exit status with --help argument",
         )
+
+    def test_counts_are_not_negative(self) -> None:
+        with redirect_stderr(StringIO()):
+            for args in (["gc", "--all", "--keep-last", "-2"], ["start", "--all", "--jobs", "0"]):
+                self.assertEqual(2, nixos_nspawn.main(["nixos-nspawn", *args]), msg=args)
+
+    def test_json_does_not_import_rich(self) -> None:
+        script = (
+            "import sys, nixos_nspawn;"
+            f"nixos_nspawn.main(['nixos-nspawn', '--unit-file-dir', {self.unit_file_dir!r},"
+            " 'list', '--json']);"
+            "print(','.join(m for m in sys.modules if m.split('.')[0] in ('rich', 'jeepney')))"
+        )
+        result = subprocess.run(
+            [sys.executable, "-c", script], check=True, capture_output=True, text=True
+        )
+        self.assertEqual("[]", result.stdout.splitlines()[0])
+        self.assertEqual("", result.stdout.splitlines()[1].strip())
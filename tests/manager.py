@@ -0,0 +1,193 @@
+import json
+import unittest
+from contextlib import AbstractContextManager, nullcontext
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import Any
+from unittest import mock
+
+from nixos_nspawn.backends import SubprocessBackend
+from nixos_nspawn.manager import NixosNspawnManager, NixosNspawnManagerError
+from nixos_nspawn.models import Container
+from nixos_nspawn.utilities import CommandError, FileLocks, PersistentCache
+
+
+class BuildManyTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self._tmp = TemporaryDirectory()
+        self.unit_file_dir = Path(self._tmp.name)
+        for name in ("alpha", "beta"):
+            (self.unit_file_dir / f"{name}.nspawn").touch()
+
+        self.manager = NixosNspawnManager(self.unit_file_dir, backend=SubprocessBackend())
+        self.containers = self.manager.list()
+
+    def tearDown(self) -> None:
+        self._tmp.cleanup()
+
+    def test_flakes_in_one_invocation(self) -> None:
+        outputs = [{"outputs": {"out": f"/nix/store/{i}-x"}} for i in range(2)]
+        with mock.patch("nixos_nspawn.manager.manager.run_command") as run_command:
+            run_command.return_value = (0, json.dumps(outputs))
+            paths, errors = self.manager.build_many(self.containers, flake="/src", system="sys")
+
+        run_command.assert_called_once()
+        args = run_command.call_args.args[0]
+        self.assertIn("/src#nixosContainers.sys.alpha", args)
+        self.assertIn("/src#nixosContainers.sys.beta", args)
+        self.assertEqual({"alpha": Path("/nix/store/0-x"), "beta": Path("/nix/store/1-x")}, paths)
+        self.assertEqual({}, errors)
+
+    def test_configs_in_one_invocation(self) -> None:
+        stdout = "/nix/store/aaa-beta\n/nix/store/bbb-alpha"
+        with mock.patch("nixos_nspawn.manager.manager.run_command") as run_command:
+            run_command.return_value = (0, stdout)
+            paths, _ = self.manager.build_many(self.containers, config=Path("/cfg.nix"))
+
+        args = run_command.call_args.args[0]
+        batch = json.loads(args[args.index("containers") + 1])
+        self.assertEqual(["alpha", "beta"], [entry["name"] for entry in batch])
+        self.assertEqual(Path("/nix/store/bbb-alpha"), paths["alpha"])
+
+    def test_failures_are_attributed(self) -> None:
+        def build(args: list[str], capture_stdout: bool = False) -> tuple[int, str]:
+            if "/src#nixosContainers.sys.beta" in args:
+                raise CommandError(args, 1, "beta is broken")
+            return 0, json.dumps([{"outputs": {"out": "/nix/store/0-alpha"}}])
+
+        with mock.patch("nixos_nspawn.manager.manager.run_command", side_effect=build):
+            paths, errors = self.manager.build_many(self.containers, flake="/src", system="sys")
+
+        self.assertEqual({"alpha": Path("/nix/store/0-alpha")}, paths)
+        self.assertEqual({"beta": "beta is broken"}, errors)
+
+    def test_systems_are_rooted(self) -> None:
+        outputs = [{"outputs": {"out": f"/nix/store/{i}-x"}} for i in range(2)]
+        with mock.patch("nixos_nspawn.manager.manager.run_command") as run_command:
+            run_command.return_value = (0, json.dumps(outputs))
+            self.manager.build_many(
+                self.containers, flake="/src", system="sys", gc_roots=Path("/roots")
+            )
+
+        args = run_command.call_args.args[0]
+        self.assertEqual("/roots/batch", args[args.index("--out-link") + 1])
+        self.assertNotIn("--no-link", args)
+
+    def test_unrecognised_systems_are_failures(self) -> None:
+        stdout = "/nix/store/aaa-beta\n/nix/store/bbb-renamed"
+        with mock.patch("nixos_nspawn.manager.manager.run_command") as run_command:
+            run_command.return_value = (0, stdout)
+            paths, errors = self.manager.build_many(self.containers, config=Path("/cfg.nix"))
+
+        self.assertEqual({"beta": Path("/nix/store/aaa-beta")}, paths)
+        self.assertEqual(["alpha"], list(errors))
+
+    def test_shared_sources_are_refused(self) -> None:
+        with mock.patch("nixos_nspawn.manager.manager.run_command") as run_command:
+            for source in (
+                {"profile": Path("/nix/store/aaa-alpha")},
+                {"config": Path(__file__)},
+                {"flake": "/src#alpha"},
+            ):
+                with self.assertRaises(NixosNspawnManagerError):
+                    self.manager.update_many(self.containers, **source)
+        run_command.assert_not_called()
+
+    def test_locks_are_sorted_and_held_while_checking(self) -> None:
+        events: list[str] = []
+
+        def lock(name: str) -> AbstractContextManager[None]:
+            events.append(f"lock {name}")
+            return nullcontext()
+
+        def is_unchanged(container: Container, *args: Any) -> bool:  # noqa: ANN401
+            events.append(f"check {container.name}")
+            return True
+
+        with (
+            mock.patch.object(self.manager.locks, "container", side_effect=lock),
+            mock.patch.object(self.manager, "is_unchanged", side_effect=is_unchanged),
+        ):
+            results = self.manager.update_many(list(reversed(self.containers)), flake="/src")
+
+        self.assertEqual(["unchanged", "unchanged"], [result.status for result in results])
+        self.assertEqual(["lock alpha", "lock beta", "check beta", "check alpha"], events)
+
+
+class UnchangedUpdateTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self._tmp = TemporaryDirectory()
+        root = Path(self._tmp.name)
+        (root / "nspawn").mkdir()
+        (root / "nspawn" / "alpha.nspawn").touch()
+        self.system = root / "store" / "abc-alpha"
+        self.system.mkdir(parents=True)
+        (root / "profiles" / "alpha").mkdir(parents=True)
+        (root / "profiles" / "alpha" / "system").symlink_to(self.system)
+
+        self._patch = mock.patch("nixos_nspawn.models.container.NIX_PROFILE_DIR", root / "profiles")
+        self._patch.start()
+        self.manager = NixosNspawnManager(
+            root / "nspawn", backend=SubprocessBackend(), locks=FileLocks(root / "locks")
+        )
+        self.manager.cache = PersistentCache(root / "cache.marshal")
+        self.container = self.manager.get("alpha")
+
+    def tearDown(self) -> None:
+        self._patch.stop()
+        self._tmp.cleanup()
+
+    def test_same_profile_is_a_no_op(self) -> None:
+        with (
+            mock.patch("nixos_nspawn.models.container.run_command") as run_command,
+            mock.patch.object(Container, "write_config_files") as write_config_files,
+        ):
+            self.assertFalse(self.manager.update(self.container, profile=self.system))
+            run_command.assert_not_called()
+            write_config_files.assert_not_called()
+
+            results = self.manager.update_many([self.container], profile=self.system)
+            self.assertEqual("unchanged", results[0].status)
+            run_command.assert_not_called()
+
+    def test_locked_flake_is_remembered(self) -> None:
+        flake = "github:owner/repo/" + "a" * 40 + "#alpha"
+        self.assertFalse(self.manager.is_unchanged(self.container, flake=flake))
+
+        with mock.patch("nixos_nspawn.models.container.run_command") as run_command:
+            self.assertFalse(self.manager.update(self.container, flake=flake))
+            run_command.assert_called_once()
+
+            # The second run knows the result without invoking Nix at all
+            self.assertTrue(self.manager.is_unchanged(self.container, flake=flake))
+            self.assertFalse(self.manager.update(self.container, flake=flake))
+            run_command.assert_called_once()
+
+        self.assertFalse(self.manager.is_unchanged(self.container, flake="/src#alpha"))
+
+
+class CloseTest(unittest.TestCase):
+    def test_closes_the_backend(self) -> None:
+        cache = PersistentCache(Path("/nonexistent/cache.marshal"))
+        backend = mock.Mock()
+        NixosNspawnManager(Path("/nonexistent"), backend=backend, cache=cache).close()
+        backend.close.assert_called_once_with()
+
+    def test_unused_backend_is_not_created(self) -> None:
+        cache = PersistentCache(Path("/nonexistent/cache.marshal"))
+        with mock.patch("nixos_nspawn.backends.get_backend") as get_backend:
+            NixosNspawnManager(Path("/nonexistent"), cache=cache).close()
+        get_backend.assert_not_called()
+
+
+class CollectGarbageTest(unittest.TestCase):
+    def test_reports_freed_bytes(self) -> None:
+        manager = NixosNspawnManager(Path("/nonexistent"), backend=SubprocessBackend())
+
+        def gc(args: list[str], **kwargs: Any) -> tuple[int, str]:  # noqa: ANN401
+            kwargs["on_line"]("stderr", "deleting '/nix/store/abc-alpha'")
+            kwargs["on_line"]("stderr", "2 store paths deleted, 1.50 MiB freed")
+            return 0, ""
+
+        with mock.patch("nixos_nspawn.manager.manager.run_command", side_effect=gc):
+            self.assertEqual((2, 1572864), manager.collect_garbage())
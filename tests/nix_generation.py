@@ -0,0 +1,91 @@
+import os
+import unittest
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import mock
+
+from nixos_nspawn.backends import HostActions
+from nixos_nspawn.models import Container, ContainerError, NixGeneration
+from nixos_nspawn.models.nix_generation import read_generations
+
+
+class NixGenerationTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self._tmp = TemporaryDirectory()
+        self.root = Path(self._tmp.name)
+        self.profile_dir = self.root / "profiles" / "alpha"
+        self.profile_dir.mkdir(parents=True)
+        self.profile = self.profile_dir / "system"
+        # Out of order, with a gap, like a profile after deleting generations
+        for generation_id in (2, 10, 1, 4):
+            store_path = self.root / "store" / f"{generation_id}-alpha"
+            store_path.mkdir(parents=True)
+            link = self.profile_dir / f"system-{generation_id}-link"
+            link.symlink_to(store_path)
+            os.utime(link, (generation_id * 86400, generation_id * 86400), follow_symlinks=False)
+        self.profile.symlink_to("system-4-link")
+
+        self._patch = mock.patch(
+            "nixos_nspawn.models.container.NIX_PROFILE_DIR", self.root / "profiles"
+        )
+        self._patch.start()
+        self.container = Container(
+            self.root / "alpha.nspawn", backend=mock.Mock(), host=HostActions(mock.Mock())
+        )
+
+    def tearDown(self) -> None:
+        self._patch.stop()
+        self._tmp.cleanup()
+
+    def test_read(self) -> None:
+        generations = list(read_generations(self.profile))
+        self.assertEqual([1, 2, 4, 10], [g.generation_id for g in generations])
+        self.assertEqual([False, False, True, False], [g.current for g in generations])
+        self.assertEqual("(current)", generations[2].label)
+        self.assertEqual("", generations[0].label)
+        self.assertRegex(generations[0].date, r"^\d{4}-\d\d-\d\d \d\d:\d\d:\d\d$")
+        self.assertEqual([], list(read_generations(self.root / "missing" / "system")))
+
+    def test_from_list_output(self) -> None:
+        generation = NixGeneration.from_list_output("  12   2024-05-01 10:20:30   (current)")
+        self.assertEqual(NixGeneration(12, "2024-05-01 10:20:30", "(current)", True), generation)
+        generation = NixGeneration.from_list_output("   3   2024-04-01 09:00:00   ")
+        self.assertEqual(NixGeneration(3, "2024-04-01 09:00:00", "", False), generation)
+
+    def test_rollback(self) -> None:
+        self.container.rollback()
+        self.assertEqual("system-2-link", os.readlink(self.profile))
+        self.assertEqual(self.root / "store" / "2-alpha", self.container.system_path)
+
+        self.container.rollback()
+        self.assertEqual(
+            1, [g for g in self.container.get_generations() if g.current][0].generation_id
+        )
+        with self.assertRaises(ContainerError):
+            self.container.rollback()
+
+    def test_switch_generation(self) -> None:
+        self.container.switch_generation(10)
+        self.assertEqual("system-10-link", os.readlink(self.profile))
+        self.assertEqual(4, self.container.previous_generation_id())
+        with self.assertRaises(ContainerError):
+            self.container.switch_generation(3)
+
+    def test_prune_keep_last(self) -> None:
+        removed, kept = self.container.prune_generations(keep_last=1, dry_run=True)
+        self.assertEqual(([1, 2], [4, 10]), (removed, kept))
+        self.assertTrue((self.profile_dir / "system-1-link").is_symlink())
+
+        self.container.prune_generations(keep_last=1)
+        self.assertEqual([4, 10], self.container.generation_ids())
+        # Still current
+        self.assertEqual("system-4-link", os.readlink(self.profile))
+
+        removed, kept = self.container.prune_generations(keep_last=0, dry_run=True)
+        self.assertEqual(([10], [4]), (removed, kept))
+
+    def test_prune_keep_newer_than(self) -> None:
+        removed, kept = self.container.prune_generations(keep_newer_than=2 * 86400)
+        self.assertEqual(([1], [2, 4, 10]), (removed, kept))
+        removed, kept = self.container.prune_generations(keep_last=1, keep_newer_than=20 * 86400)
+        self.assertEqual(([2], [4, 10]), (removed, kept))
@@ -0,0 +1,123 @@
+import fcntl
+import os
+import unittest
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import mock
+
+from nixos_nspawn.utilities import CommandError, Trash, reaper
+
+
+class TrashTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self._tmp = TemporaryDirectory()
+        self.addCleanup(self._tmp.cleanup)
+        self.root = Path(self._tmp.name)
+        self.trash = Trash(self.root / "trash")
+
+        self.outside = self.root / "outside"
+        self.outside.mkdir()
+        (self.outside / "keep").write_text("keep")
+
+    def make_state(self, name: str) -> Path:
+        state = self.root / name
+        (state / "var" / "lib" / "app").mkdir(parents=True)
+        (state / "etc").mkdir()
+        for i in range(20):
+            (state / "var" / "lib" / "app" / f"file{i}").write_text("x" * 1024)
+        (state / "etc" / "hostname").write_text(name)
+        (state / "etc" / "outside").symlink_to(self.outside)
+        (state / "var" / "lib" / "app" / "keep").symlink_to(self.outside / "keep")
+        return state
+
+    def test_reap(self) -> None:
+        state = self.make_state("alpha")
+        self.assertTrue(self.trash.put(state, "alpha"))
+        self.assertFalse(state.exists())
+        self.assertEqual([entry.name.split(".")[0] for entry in self.trash.entries()], ["alpha"])
+
+        reaped = self.trash.reap(jobs=4)
+
+        self.assertEqual([progress.entry.split(".")[0] for progress in reaped], ["alpha"])
+        self.assertEqual(reaped[0].files, 23)
+        self.assertGreater(reaped[0].bytes, 0)
+        self.assertEqual(list(self.trash.path.iterdir()), [])
+        # Symlinks were removed, not followed
+        self.assertEqual((self.outside / "keep").read_text(), "keep")
+
+    def test_status(self) -> None:
+        self.trash.put(self.make_state("alpha"), "alpha")
+        self.trash.put(self.make_state("beta"), "beta")
+
+        status = self.trash.status()
+        names = [entry["entry"].split(".")[0] for entry in status["remaining"]]
+        self.assertEqual(names, ["alpha", "beta"])
+        self.assertEqual(status["files"], 46)
+        self.assertIsNone(status["reaping"])
+
+        self.trash.reap()
+        self.assertEqual(self.trash.status()["remaining"], [])
+
+    def test_one_reaper_at_a_time(self) -> None:
+        self.trash.put(self.make_state("alpha"), "alpha")
+        fd = os.open(self.trash.path, os.O_RDONLY | os.O_DIRECTORY)
+        self.addCleanup(os.close, fd)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+
+        self.assertIsNone(self.trash.reap())
+        self.assertEqual(len(self.trash.entries()), 1)
+
+    def test_deletes_subvolumes(self) -> None:
+        self.trash.put(self.make_state("alpha"), "alpha")
+        (entry,) = self.trash.entries()
+
+        with (
+            mock.patch.object(reaper, "is_subvolume", return_value=True),
+            mock.patch.object(reaper, "run_command") as run_command,
+        ):
+            # Not btrfs after all, so the tree is deleted instead
+            run_command.side_effect = CommandError(["btrfs"], 1, "")
+            self.trash.reap()
+            run_command.assert_called_once_with(
+                ["btrfs", "subvolume", "delete", str(entry)],
+                capture_stdout=True,
+                capture_stderr=True,
+            )
+        self.assertEqual(self.trash.entries(), [])
+
+    def test_background_reaper_logs(self) -> None:
+        journal = self.root / "journal"
+        journal.touch()
+        with (
+            mock.patch.object(reaper, "JOURNAL_STREAM_SOCKET", journal),
+            mock.patch.object(reaper, "which", return_value="/bin/systemd-cat"),
+            mock.patch.object(reaper, "Popen") as popen,
+        ):
+            self.trash.reap_in_background()
+        args, kwargs = popen.call_args
+        self.assertEqual(args[0][:2], ["/bin/systemd-cat", "--identifier=nixos-nspawn-reap"])
+        self.assertNotIn("stderr", kwargs)
+
+        # Without journald, the reaper logs to the same stderr as this process
+        journal.unlink()
+        with (
+            mock.patch.object(reaper, "JOURNAL_STREAM_SOCKET", journal),
+            mock.patch.object(reaper, "which", return_value="/bin/systemd-cat"),
+            mock.patch.object(reaper, "Popen") as popen,
+        ):
+            self.trash.reap_in_background()
+        args, kwargs = popen.call_args
+        self.assertEqual(args[0][1:4], ["-m", "nixos_nspawn", "reap"])
+        self.assertNotIn("stderr", kwargs)
+
+    def test_put_fails_across_filesystems(self) -> None:
+        state = self.make_state("alpha")
+        with mock.patch.object(
+            Path, "rename", side_effect=OSError(18, "Invalid cross-device link")
+        ):
+            self.assertFalse(self.trash.put(state, "alpha"))
+        self.assertTrue(state.exists())
+
+
+if __name__ == "__main__":
+    unittest.main()
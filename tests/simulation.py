@@ -0,0 +1,333 @@
+import fcntl
+import json
+import logging
+import unittest
+from contextlib import redirect_stderr, redirect_stdout
+from io import StringIO
+from pathlib import Path
+from time import perf_counter, sleep
+from typing import Any
+from unittest import mock
+
+import nixos_nspawn
+from benchmarks._fleet import Fleet, fake_fleet
+from benchmarks._stubs import make_system
+from nixos_nspawn.constants import RC_OPERATION_FAILED
+from nixos_nspawn.models import Container, ContainerError
+from nixos_nspawn.models import container as container_module
+
+
+class SimulatedHostTest(unittest.TestCase):
+    """Runs commands against a synthetic fleet, with stubs in place of host programs"""
+
+    def setUp(self) -> None:
+        context = fake_fleet(4, running_ratio=0.5, stubs=True)
+        self.fleet: Fleet = context.__enter__()
+        self.addCleanup(context.__exit__, None, None, None)
+
+        # Otherwise the handler installed by the first command writes to its stdout forever
+        patch = mock.patch.object(logging.getLogger(), "handlers", [logging.NullHandler()])
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def run_command(self, *args: str) -> tuple[int, str]:
+        stdout = StringIO()
+        with redirect_stdout(stdout), redirect_stderr(StringIO()):
+            argv = ["nixos-nspawn", "--unit-file-dir", str(self.fleet.unit_file_dir), *args]
+            exit_code = nixos_nspawn.main(argv)
+        return exit_code, stdout.getvalue()
+
+    def test_fleet_layout(self) -> None:
+        self.assertEqual(self.fleet.names(), ["bench0", "bench1", "bench2", "bench3"])
+        self.assertEqual(
+            sorted(p.name for p in self.fleet.machined_dir.iterdir()), ["bench0", "bench2"]
+        )
+
+        exit_code, stdout = self.run_command(
+            "list", "--ndjson", "--fields", "name,state,generation"
+        )
+        self.assertEqual(exit_code, 0)
+        rows = [json.loads(line) for line in stdout.splitlines()]
+        self.assertEqual([row["generation"] for row in rows], [1, 1, 1, 1])
+        self.assertEqual(rows[0]["state"], "running")
+        self.assertEqual(rows[1]["state"], "powered off")
+
+    def test_autostart(self) -> None:
+        self.assertEqual(self.run_command("autostart")[0], 0)
+        self.assertEqual(len(list(self.fleet.machined_dir.iterdir())), 4)
+        self.assertEqual(
+            [call[:2] for call in self.fleet.popen_calls], [["machinectl", "start"]] * 2
+        )
+
+    def test_update_from_profile(self) -> None:
+        system = make_system(self.fleet.store_dir, "bench1")
+        self.assertEqual(self.run_command("update", "bench1", "--profile", str(system))[0], 0)
+
+        exit_code, stdout = self.run_command("list-generations", "bench1", "--json")
+        self.assertEqual(exit_code, 0)
+        generations = json.loads(stdout)
+        self.assertEqual([g["generation_id"] for g in generations if g["current"]], [2])
+        self.assertEqual(
+            (self.fleet.unit_file_dir / "bench1.nspawn").resolve().parent.parent, system
+        )
+
+    def test_update_many(self) -> None:
+        flake = str(self.fleet.root / "flake")
+        self.assertEqual(self.run_command("update", "--all", "--flake", flake)[0], 0)
+
+        (build,) = [call for call in self.fleet.popen_calls if call[:2] == ["nix", "build"]]
+        # The systems were rooted until the profiles switched to them, and no longer
+        roots = Path(build[build.index("--out-link") + 1]).parent
+        self.assertFalse(roots.exists())
+
+        # One system for every container is refused
+        system = make_system(self.fleet.store_dir, "bench1")
+        self.assertNotEqual(self.run_command("update", "--all", "--profile", str(system))[0], 0)
+        self.assertNotEqual(self.run_command("update", "--all", "--flake", f"{flake}#bench1")[0], 0)
+
+    def test_remove(self) -> None:
+        self.assertEqual(self.run_command("remove", "bench0")[0], 0)
+        self.assertNotIn("bench0", self.fleet.names())
+        self.assertFalse((self.fleet.machined_dir / "bench0").exists())
+
+    def test_remove_deletes_state_in_background(self) -> None:
+        for name in ("bench1", "bench3"):
+            (self.fleet.state_dir / name / "var" / "lib").mkdir(parents=True)
+            (self.fleet.state_dir / name / "var" / "lib" / "data").write_text("x" * 4096)
+        trash = self.fleet.state_dir / ".nixos-nspawn-trash"
+
+        self.assertEqual(self.run_command("remove", "--delete-state", "--wait", "bench1")[0], 0)
+        self.assertFalse((self.fleet.state_dir / "bench1").exists())
+        self.assertEqual(list(trash.iterdir()), [])
+
+        self.assertEqual(self.run_command("remove", "--delete-state", "bench3")[0], 0)
+        self.assertFalse((self.fleet.state_dir / "bench3").exists())
+        deadline = perf_counter() + 30
+        while any(trash.iterdir()) and perf_counter() < deadline:
+            sleep(0.05)
+        self.assertEqual(list(trash.iterdir()), [])
+
+    def test_failure_rate(self) -> None:
+        self.use_fleet(1, running_ratio=0, failure_rate={"machinectl": 1.0})
+
+        self.assertNotEqual(self.run_command("autostart")[0], 0)
+        self.assertEqual(list(self.fleet.machined_dir.iterdir()), [])
+
+    def use_fleet(self, size: int, **kwargs: Any) -> None:  # noqa: ANN401
+        context = fake_fleet(size, stubs=True, **kwargs)
+        self.fleet = context.__enter__()
+        self.addCleanup(context.__exit__, None, None, None)
+
+    def test_stop_in_parallel(self) -> None:
+        self.use_fleet(8, running_ratio=1, latency={"machinectl": 0.5})
+
+        start = perf_counter()
+        exit_code, stdout = self.run_command("stop", "--all", "--jobs", "8", "--ndjson")
+        self.assertEqual(exit_code, 0)
+        # One after another, it would take at least 4 seconds
+        self.assertLess(perf_counter() - start, 3)
+
+        results = [json.loads(line) for line in stdout.splitlines()]
+        self.assertEqual(sorted(r["name"] for r in results), self.fleet.names())
+        self.assertEqual({r["status"] for r in results}, {"stopped"})
+        self.assertEqual(list(self.fleet.machined_dir.iterdir()), [])
+
+    def test_power_filter(self) -> None:
+        exit_code, stdout = self.run_command("reboot", "--filter", "state=running", "--json")
+        self.assertEqual(exit_code, 0)
+        self.assertEqual(
+            [(r["name"], r["status"]) for r in json.loads(stdout)],
+            [("bench0", "rebooted"), ("bench2", "rebooted")],
+        )
+
+        exit_code, stdout = self.run_command("start", "bench0", "bench1", "--json")
+        self.assertEqual(
+            [(r["name"], r["status"]) for r in json.loads(stdout)],
+            [("bench0", "unchanged"), ("bench1", "started")],
+        )
+
+    def test_power_retries(self) -> None:
+        self.use_fleet(2, running_ratio=0, failure_rate={"machinectl": 1.0})
+
+        with mock.patch("nixos_nspawn.manager.manager.POWER_RETRY_BACKOFF", 0):
+            exit_code, stdout = self.run_command("start", "--all", "--retries", "2", "--json")
+
+        self.assertEqual(exit_code, RC_OPERATION_FAILED)
+        self.assertEqual({r["status"] for r in json.loads(stdout)}, {"failed"})
+        self.assertEqual(len(self.fleet.popen_calls), 6)
+
+    def start_after(self, name: str, *dependencies: str) -> None:
+        data_file = (self.fleet.unit_file_dir / f"{name}.nspawn").resolve().parent / "data.json"
+        data = json.loads(data_file.read_text())
+        data["activation"]["after"] = list(dependencies)
+        data_file.write_text(json.dumps(data))
+
+    def test_autostart_order(self) -> None:
+        self.use_fleet(4, running_ratio=0, latency={"machinectl": 0.1})
+        self.start_after("bench0", "bench1")
+        self.start_after("bench1", "bench2")
+
+        exit_code, stdout = self.run_command("autostart", "--budget", "0")
+        self.assertEqual(exit_code, 0)
+        self.assertIn("exceeded its budget", stdout)
+
+        started = [
+            call[2] for call in self.fleet.popen_calls if call[:2] == ["machinectl", "start"]
+        ]
+        self.assertEqual(sorted(started), self.fleet.names())
+        self.assertLess(started.index("bench2"), started.index("bench1"))
+        self.assertLess(started.index("bench1"), started.index("bench0"))
+
+    def test_autostart_skips_dependents_of_failures(self) -> None:
+        self.use_fleet(5, running_ratio=0)
+        self.start_after("bench0", "bench1")
+        self.start_after("bench1", "bench2")
+        self.start_after("bench3", "missing")
+        start = Container.start
+
+        def fail_bench2(container: Container, *args: Any) -> float:  # noqa: ANN401
+            if container.name == "bench2":
+                raise ContainerError("bench2 did not start")
+            return start(container, *args)
+
+        with (
+            mock.patch.object(Container, "start", fail_bench2),
+            mock.patch("nixos_nspawn.manager.manager.POWER_RETRY_BACKOFF", 0),
+        ):
+            exit_code, stdout = self.run_command("autostart", "--json")
+
+        self.assertEqual(exit_code, RC_OPERATION_FAILED)
+        results = {r["name"]: r for r in json.loads(stdout)}
+        self.assertEqual(results["bench4"]["status"], "started")
+        self.assertIn("bench2 failed", results["bench1"]["error"])
+        self.assertIn("bench1 failed", results["bench0"]["error"])
+        self.assertIn("missing does not exist", results["bench3"]["error"])
+        started = [
+            call[2] for call in self.fleet.popen_calls if call[:2] == ["machinectl", "start"]
+        ]
+        self.assertNotIn("bench0", started)
+        self.assertNotIn("bench1", started)
+        self.assertNotIn("bench3", started)
+
+    def test_autostart_cycle(self) -> None:
+        self.use_fleet(3, running_ratio=0)
+        self.start_after("bench0", "bench1")
+        self.start_after("bench1", "bench0")
+
+        exit_code, stdout = self.run_command("autostart", "--json")
+        self.assertEqual(exit_code, RC_OPERATION_FAILED)
+        results = {r["name"]: r for r in json.loads(stdout)}
+        self.assertEqual(results["bench2"]["status"], "started")
+        self.assertEqual(results["bench0"]["status"], "failed")
+        self.assertIn("cycle", results["bench1"]["error"])
+        self.assertEqual(sorted(p.name for p in self.fleet.machined_dir.iterdir()), ["bench2"])
+
+    def test_autostart_retries_failures(self) -> None:
+        self.use_fleet(1, running_ratio=0, failure_rate={"machinectl": 1.0})
+
+        with mock.patch("nixos_nspawn.manager.manager.POWER_RETRY_BACKOFF", 0):
+            exit_code, stdout = self.run_command("autostart", "--retries", "1", "--json")
+
+        self.assertEqual(exit_code, RC_OPERATION_FAILED)
+        self.assertEqual(json.loads(stdout)[0]["status"], "failed")
+        self.assertEqual(len(self.fleet.popen_calls), 2)
+
+    def test_locked_container_is_skipped(self) -> None:
+        lock_file = self.fleet.runtime_dir / "locks" / "containers" / "bench0.lock"
+        lock_file.parent.mkdir(parents=True)
+        with lock_file.open("w") as held:
+            fcntl.flock(held, fcntl.LOCK_EX)
+            exit_code, stdout = self.run_command(
+                "--lock-timeout", "0.1", "stop", "bench0", "bench2", "--json"
+            )
+
+        self.assertEqual(exit_code, RC_OPERATION_FAILED)
+        results = {r["name"]: r for r in json.loads(stdout)}
+        self.assertIn("lock on bench0", results["bench0"]["error"])
+        self.assertEqual(results["bench2"]["status"], "stopped")
+        self.assertEqual([p.name for p in self.fleet.machined_dir.iterdir()], ["bench0"])
+
+    def test_clone(self) -> None:
+        state = self.fleet.state_dir / "bench1"
+        (state / "etc" / "ssh").mkdir(parents=True)
+        (state / "etc" / "machine-id").write_text("0123456789abcdef0123456789abcdef\n")
+        (state / "etc" / "ssh" / "ssh_host_ed25519_key").write_text("secret")
+        (state / "data").write_text("warm")
+
+        system = make_system(self.fleet.store_dir, "replica")
+        exit_code, stdout = self.run_command(
+            "clone", "bench1", "replica", "--profile", str(system), "--json"
+        )
+        self.assertEqual(exit_code, 0)
+        self.assertIn(json.loads(stdout)["state_copy"], ("reflink", "copy"))
+
+        copy = self.fleet.state_dir / "replica"
+        self.assertEqual((copy / "data").read_text(), "warm")
+        self.assertEqual((copy / "etc" / "machine-id").read_text(), "")
+        self.assertEqual(list((copy / "etc" / "ssh").iterdir()), [])
+        self.assertEqual((state / "etc" / "machine-id").stat().st_size, 33)
+
+        # Its own system, not the one built for bench1
+        self.assertEqual(
+            (self.fleet.unit_file_dir / "replica.nspawn").resolve(),
+            system / "nixos-nspawn" / "replica.nspawn",
+        )
+        self.assertIn(["machinectl", "start", "replica"], self.fleet.popen_calls)
+
+    def test_create_from_template(self) -> None:
+        system = make_system(self.fleet.store_dir, "replica")
+        exit_code, _ = self.run_command(
+            "create", "--from-template", "bench0", "replica", "--profile", str(system)
+        )
+        self.assertEqual(exit_code, 0)
+        self.assertIn("replica", self.fleet.names())
+
+        # Not without a system of its own
+        exit_code, _ = self.run_command("create", "--from-template", "bench0", "other")
+        self.assertNotEqual(exit_code, 0)
+        self.assertNotIn("other", self.fleet.names())
+
+        # Not over an existing container
+        system = make_system(self.fleet.store_dir, "bench1")
+        exit_code, _ = self.run_command(
+            "create", "--from-template", "bench0", "bench1", "--profile", str(system)
+        )
+        self.assertNotEqual(exit_code, 0)
+        self.assertEqual(
+            (self.fleet.unit_file_dir / "bench1.nspawn").resolve().name, "bench1.nspawn"
+        )
+
+    def test_start_timeout_leaves_nothing_behind(self) -> None:
+        start = Container.start
+        with (
+            # Started, but never seen to be ready
+            mock.patch.object(container_module, "_is_running", return_value=False),
+            mock.patch.object(Container, "start", lambda self: start(self, wait=0.2)),
+        ):
+            system = make_system(self.fleet.store_dir, "fresh")
+            self.assertNotEqual(self.run_command("create", "fresh", "--profile", str(system))[0], 0)
+            system = make_system(self.fleet.store_dir, "replica")
+            self.assertNotEqual(
+                self.run_command("clone", "bench1", "replica", "--profile", str(system))[0], 0
+            )
+
+        for name in ("fresh", "replica"):
+            self.assertNotIn(name, self.fleet.names())
+            self.assertFalse((self.fleet.profile_dir / name).exists())
+            self.assertFalse((self.fleet.machined_dir / name).exists())
+            self.assertIn(["machinectl", "poweroff", name], self.fleet.popen_calls)
+        self.assertFalse((self.fleet.state_dir / "replica").exists())
+
+    def test_clone_refuses_another_containers_system(self) -> None:
+        # Built for bench2, so it embeds that name rather than the replica's
+        system = (self.fleet.unit_file_dir / "bench2.nspawn").resolve().parent.parent
+
+        exit_code, _ = self.run_command("clone", "bench2", "replica", "--profile", str(system))
+        self.assertNotEqual(exit_code, 0)
+        self.assertNotIn("replica", self.fleet.names())
+        self.assertFalse((self.fleet.profile_dir / "replica").exists())
+        self.assertFalse((self.fleet.state_dir / "replica").exists())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,119 @@
+import json
+import unittest
+from contextlib import redirect_stderr, redirect_stdout
+from io import StringIO
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from time import sleep
+from unittest import mock
+
+import nixos_nspawn
+from nixos_nspawn.utilities import (
+    CATEGORY_WAIT,
+    Tracer,
+    format_timings,
+    run_command,
+    span,
+    traced,
+    tracer,
+)
+
+
+class Named(object):
+    name = "alpha"
+
+    @traced(CATEGORY_WAIT)
+    def nap(self) -> None:
+        sleep(0.01)
+
+
+class TracerTest(unittest.TestCase):
+    def setUp(self) -> None:
+        tracer.enable()
+        self.addCleanup(tracer.disable)
+
+    def test_disabled_records_nothing(self) -> None:
+        tracer.disable()
+        with span("outer"):
+            Named().nap()
+        run_command(["true"])
+        self.assertEqual([], tracer.spans)
+
+    def test_nesting(self) -> None:
+        with span("outer", detail="x"):
+            Named().nap()
+            run_command(["true"])
+
+        spans = {span.name: span for span in tracer.spans}
+        self.assertEqual({"outer", "Named.nap", "true"}, spans.keys())
+        self.assertEqual({"container": "alpha"}, spans["Named.nap"].args)
+        self.assertEqual("subprocess", spans["true"].category)
+
+        outer = spans["outer"]
+        self.assertEqual({"detail": "x"}, outer.args)
+        self.assertEqual(outer.children, spans["Named.nap"].duration + spans["true"].duration)
+        self.assertGreaterEqual(tracer.categories()[CATEGORY_WAIT], 0.01)
+
+    def test_errors_are_labelled(self) -> None:
+        with self.assertRaises(ValueError), span("failing"):
+            raise ValueError()
+        self.assertEqual({"error": "ValueError"}, tracer.spans[0].args)
+
+    def test_chrome_format(self) -> None:
+        with span("outer"):
+            Named().nap()
+
+        events = tracer.to_chrome()["traceEvents"]
+        self.assertEqual(["M", "X", "X"], [event["ph"] for event in events])
+        outer, inner = events[1:]
+        self.assertEqual(["outer", "Named.nap"], [outer["name"], inner["name"]])
+        # Nested in time, on the same thread
+        self.assertEqual(outer["tid"], inner["tid"])
+        self.assertLessEqual(outer["ts"], inner["ts"])
+        self.assertGreaterEqual(outer["ts"] + outer["dur"], inner["ts"] + inner["dur"])
+
+    def test_timings(self) -> None:
+        trace = Tracer()
+        trace.enable()
+        outer = trace.begin("outer", "call", {})
+        trace.end(trace.begin("inner", "wait", {}))
+        trace.end(outer)
+
+        self.assertEqual(["inner", "outer"], sorted(name for name, *_ in trace.timings()))
+        table = format_timings(trace)
+        self.assertIn("SPAN", table)
+        self.assertIn("Time by category: ", table)
+
+
+class TraceOptionTest(unittest.TestCase):
+    def test_trace_file(self) -> None:
+        with TemporaryDirectory() as tmp:
+            root = Path(tmp)
+            stderr = StringIO()
+            with (
+                mock.patch("nixos_nspawn.utilities.cache.RUNTIME_DIR", root / "run"),
+                redirect_stdout(StringIO()),
+                redirect_stderr(stderr),
+            ):
+                exit_code = nixos_nspawn.main(
+                    [
+                        "nixos-nspawn",
+                        "--unit-file-dir",
+                        tmp,
+                        "--trace",
+                        str(root / "trace.json"),
+                        "--timings",
+                        "list",
+                        "--json",
+                    ]
+                )
+
+            self.assertEqual(0, exit_code)
+            events = json.loads((root / "trace.json").read_text())["traceEvents"]
+            self.assertIn("list", [event["name"] for event in events])
+            self.assertIn("Time by category", stderr.getvalue())
+            self.assertFalse(tracer.enabled)
+
+
+if __name__ == "__main__":
+    unittest.main()
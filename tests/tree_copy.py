@@ -0,0 +1,74 @@
+import errno
+import os
+import stat
+import unittest
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import mock
+
+from nixos_nspawn.utilities import CommandError, copy_tree, tree_copy
+
+
+class CopyTreeTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self._tmp = TemporaryDirectory()
+        self.addCleanup(self._tmp.cleanup)
+        self.source = Path(self._tmp.name) / "source"
+        self.destination = Path(self._tmp.name) / "destination"
+
+        (self.source / "etc" / "ssh").mkdir(parents=True)
+        (self.source / "etc" / "hostname").write_text("alpha\n")
+        (self.source / "etc" / "ssh" / "ssh_host_key").write_text("secret")
+        (self.source / "etc" / "ssh" / "ssh_host_key").chmod(0o600)
+        (self.source / "etc" / "hosts").symlink_to("/etc/static/hosts")
+        os.link(self.source / "etc" / "hostname", self.source / "hostname-link")
+        os.mkfifo(self.source / "fifo")
+        os.utime(self.source / "etc", (1, 1))
+
+    def assert_copied(self) -> None:
+        self.assertEqual("alpha\n", (self.destination / "etc" / "hostname").read_text())
+        key = self.destination / "etc" / "ssh" / "ssh_host_key"
+        self.assertEqual(0o600, stat.S_IMODE(key.stat().st_mode))
+        self.assertEqual("/etc/static/hosts", os.readlink(self.destination / "etc" / "hosts"))
+        self.assertEqual(
+            (self.destination / "etc" / "hostname").stat().st_ino,
+            (self.destination / "hostname-link").stat().st_ino,
+        )
+        self.assertTrue(stat.S_ISFIFO((self.destination / "fifo").lstat().st_mode))
+        self.assertEqual(1, (self.destination / "etc").stat().st_mtime)
+
+    def test_copy(self) -> None:
+        method = copy_tree(self.source, self.destination, jobs=4)
+        self.assertIn(method, (tree_copy.COPY_REFLINK, tree_copy.COPY_PLAIN))
+        self.assert_copied()
+
+    def test_falls_back_without_reflinks(self) -> None:
+        unsupported = OSError(errno.EOPNOTSUPP, "Operation not supported")
+        with mock.patch.object(tree_copy.fcntl, "ioctl", side_effect=unsupported) as ioctl:
+            method = copy_tree(self.source, self.destination)
+
+        self.assertEqual(tree_copy.COPY_PLAIN, method)
+        self.assert_copied()
+        # Not tried again once the filesystem has refused
+        self.assertLessEqual(ioctl.call_count, 2)
+
+    def test_snapshots_subvolumes(self) -> None:
+        with (
+            mock.patch.object(tree_copy, "is_subvolume", return_value=True),
+            mock.patch.object(tree_copy, "run_command", return_value=(0, "")) as run_command,
+        ):
+            self.assertEqual(tree_copy.COPY_SNAPSHOT, copy_tree(self.source, self.destination))
+            run_command.assert_called_once_with(
+                ["btrfs", "subvolume", "snapshot", str(self.source), str(self.destination)],
+                capture_stdout=True,
+                capture_stderr=True,
+            )
+
+            # Not btrfs after all
+            run_command.side_effect = CommandError(["btrfs"], 1, "")
+            self.assertNotEqual(tree_copy.COPY_SNAPSHOT, copy_tree(self.source, self.destination))
+        self.assert_copied()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,53 @@
+import unittest
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from threading import Timer
+
+from nixos_nspawn.utilities import MachineStateSnapshot, wait_for
+from nixos_nspawn.utilities.inotify import IN_CREATE, IN_DELETE, Inotify
+
+
+class InotifyTest(unittest.TestCase):
+    def test_events(self) -> None:
+        with TemporaryDirectory() as tmp, Inotify() as inotify:
+            watch = Path(tmp)
+            inotify.add_watch(watch, IN_CREATE | IN_DELETE)
+            (watch / "machine").touch()
+            (watch / "machine").unlink()
+
+            events = inotify.read_events(1)
+            self.assertEqual(
+                [(IN_CREATE, "machine"), (IN_DELETE, "machine")],
+                [(event.mask, event.name) for event in events],
+            )
+            self.assertEqual(watch / "machine", events[0].path)
+            self.assertEqual([], inotify.read_events(0))
+
+
+class WaitForTest(unittest.TestCase):
+    def test_wakes_on_removal(self) -> None:
+        with TemporaryDirectory() as tmp:
+            state_dir = Path(tmp)
+            (state_dir / "alpha").write_text("NAME=alpha\n")
+            snapshot = MachineStateSnapshot(state_dir)
+
+            def gone() -> bool:
+                snapshot.refresh("alpha")
+                return snapshot.get("alpha") is None
+
+            Timer(0.2, (state_dir / "alpha").unlink).start()
+            result = wait_for(gone, 5, watch_dir=state_dir)
+
+            self.assertTrue(result)
+            self.assertGreaterEqual(result.elapsed, 0.2)
+            self.assertLess(result.elapsed, 1)
+
+    def test_deadline(self) -> None:
+        with TemporaryDirectory() as tmp:
+            result = wait_for(lambda: False, 0.1, watch_dir=Path(tmp))
+            self.assertFalse(result)
+            self.assertGreaterEqual(result.elapsed, 0.1)
+
+    def test_missing_watch_dir(self) -> None:
+        result = wait_for(lambda: True, 1, watch_dir=Path("/nonexistent"))
+        self.assertTrue(result)